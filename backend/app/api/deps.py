@@ -4,20 +4,72 @@ import os
 from fastapi import HTTPException, Security, status
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 
+from app.core.config import get_settings
+from app.services.analytics import PoolAnalytics
+from app.services.idempotency import IdempotencyCache
 from app.services.machine_manager import MachineManager
+from app.services.state_store import create_state_store
+from app.services.status_journal import StatusJournal
+from app.services.webhooks import WebhookDispatcher, parse_subscriptions
 
 logger = logging.getLogger(__name__)
 bearer_scheme = HTTPBearer(auto_error=False)
 
 _manager_instance = None
+_idempotency_cache = None
+_webhook_dispatcher = None
 
 async def get_machine_manager() -> MachineManager:
     global _manager_instance
     if _manager_instance is None:
-        _manager_instance = MachineManager()
+        settings = get_settings()
+        state_store = create_state_store(settings)
+        _manager_instance = MachineManager(
+            state_store=state_store,
+            reservation_ttl=settings.RESERVATION_TTL,
+            max_reservation_ttl=settings.RESERVATION_MAX_TTL,
+            journal=StatusJournal(
+                settings.JOURNAL_DIR,
+                segment_bytes=settings.JOURNAL_SEGMENT_BYTES,
+                max_segments=settings.JOURNAL_MAX_SEGMENTS,
+            ),
+            analytics=PoolAnalytics(
+                retention_minutes=settings.ANALYTICS_RETENTION_MINUTES, store=state_store
+            ),
+        )
     return _manager_instance
 
 
+async def get_idempotency_cache() -> IdempotencyCache:
+    global _idempotency_cache
+    if _idempotency_cache is None:
+        settings = get_settings()
+        manager = await get_machine_manager()
+        _idempotency_cache = IdempotencyCache(
+            max_entries=settings.IDEMPOTENCY_MAX_KEYS,
+            ttl=settings.IDEMPOTENCY_TTL,
+            store=manager.state,  # 共用狀態時，key 也登記在 store 讓各 worker 共用
+        )
+    return _idempotency_cache
+
+
+async def get_webhook_dispatcher() -> WebhookDispatcher:
+    global _webhook_dispatcher
+    if _webhook_dispatcher is None:
+        settings = get_settings()
+        _webhook_dispatcher = WebhookDispatcher(
+            parse_subscriptions(settings.load_webhook_config()),
+            queue_dir=settings.WEBHOOK_QUEUE_DIR,
+            batch_window=settings.WEBHOOK_BATCH_WINDOW,
+            batch_max=settings.WEBHOOK_BATCH_MAX,
+            max_retries=settings.WEBHOOK_MAX_RETRIES,
+            retry_base=settings.WEBHOOK_RETRY_BASE,
+            timeout=settings.WEBHOOK_TIMEOUT,
+            queue_max=settings.WEBHOOK_QUEUE_MAX,
+        )
+    return _webhook_dispatcher
+
+
 async def verify_bearer_token(
     credentials: HTTPAuthorizationCredentials = Security(bearer_scheme),
 ) -> str:
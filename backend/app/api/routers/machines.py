@@ -1,13 +1,23 @@
-from typing import Optional
-from fastapi import APIRouter, Depends, HTTPException, status
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Hashable, List, Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response, status
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from app.services.machine_manager import MachineManager
-from app.api.deps import get_machine_manager
-from app.models.machine import Machine, ReleaseResponse, ReleaseResult
+from app.api.deps import get_idempotency_cache, get_machine_manager, get_webhook_dispatcher
+from app.core.profiling import loop_monitor, sample_profile
+from app.core.timing import TimedRoute, recorder
+from app.models.machine import LeaseResult, Machine, RefreshResult, ReleaseResponse, ReleaseResult
+from app.models.reservation import ReservationQuery
+from app.models.summary import MachineSummary
+from app.services.idempotency import IdempotencyCache, IdempotencyKeyConflict
+from app.services.webhooks import WebhookDispatcher
 
+import asyncio
 import logging
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
 logger = logging.getLogger(__name__)
+_profile_lock = asyncio.Lock()
 
 @router.get("/machines", response_model=dict)
 async def list_machines(
@@ -17,28 +27,120 @@ async def list_machines(
     status: Optional[str] = None,
     manager: MachineManager = Depends(get_machine_manager),
 ):
-    machines = manager.get_machines(vendor, model, version, status)
+    machines = await manager.get_machines(vendor, model, version, status)
     return {"machines": machines}
 
+@router.get("/machines/summary", response_model=MachineSummary)
+async def machine_summary(
+    manager: MachineManager = Depends(get_machine_manager),
+):
+    """各 vendor / model / version 與 status 的機器數量，不需下載完整機器列表"""
+    return await manager.machine_summary()
+
+@router.get("/pools/hot-spares", response_model=dict)
+async def list_hot_spares(
+    manager: MachineManager = Depends(get_machine_manager),
+):
+    """各 pool 的 hot spare 狀況；deficit > 0 代表 pool 不足以維持設定的備用數量"""
+    return {"pools": await manager.hot_spare_report()}
+
+async def _idempotent(
+    cache: IdempotencyCache,
+    key: Optional[str],
+    fingerprint: Hashable,
+    response: Response,
+    operation: Callable[[], Awaitable[Any]],
+) -> Any:
+    """有 Idempotency-Key 時，重試直接回傳第一次的結果 (失敗的結果不保存)"""
+    if not key:
+        return await operation()
+    try:
+        result, replayed = await cache.run(key, fingerprint, operation)
+    except IdempotencyKeyConflict:
+        raise HTTPException(
+            status_code=422, detail="Idempotency-Key was already used for a different request"
+        )
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
+    return result
+
 @router.post("/reserve/{vendor}/{model}/{version}", response_model=Machine)
 async def reserve_machine(
     vendor: str,
     model: str,
     version: str,
+    response: Response,
+    owner: Optional[str] = None,
+    ttl: Optional[int] = Query(None, ge=0, description="Lease 秒數，未 heartbeat 超過此時間會自動釋放"),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255),
+    manager: MachineManager = Depends(get_machine_manager),
+    cache: IdempotencyCache = Depends(get_idempotency_cache),
+):
+    async def reserve():
+        machine = await manager.reserve_machine(vendor, model, version, owner=owner, ttl=ttl)
+        if not machine:
+            raise HTTPException(status_code=404, detail="No available machines found")
+        return machine.model_copy()  # 保存借出當下的狀態供重試回傳
+
+    fingerprint = ("reserve", vendor, model, version, owner, ttl)
+    return await _idempotent(cache, idempotency_key, fingerprint, response, reserve)
+
+@router.post("/reserve", response_model=Machine)
+async def reserve_matching(
+    query: ReservationQuery,
+    response: Response,
+    owner: Optional[str] = None,
+    ttl: Optional[int] = Query(None, ge=0, description="Lease 秒數，未 heartbeat 超過此時間會自動釋放"),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255),
     manager: MachineManager = Depends(get_machine_manager),
+    cache: IdempotencyCache = Depends(get_idempotency_cache),
 ):
-    machine = await manager.reserve_machine(vendor, model, version)
-    if not machine:
-        raise HTTPException(status_code=404, detail="No available machines found")
-    return machine
+    """依條件借用 (vendor / model / version glob、版本範圍、hostname 前綴、網段)"""
+    async def reserve():
+        machine = await manager.reserve_matching(query, owner=owner, ttl=ttl)
+        if not machine:
+            raise HTTPException(status_code=404, detail="No available machines match the query")
+        return machine.model_copy()
+
+    fingerprint = ("reserve_matching", tuple(query.model_dump().items()), owner, ttl)
+    return await _idempotent(cache, idempotency_key, fingerprint, response, reserve)
+
+@router.post("/reservations/{serial_number}/heartbeat", response_model=Machine)
+async def heartbeat_reservation(
+    serial_number: str,
+    owner: Optional[str] = None,
+    ttl: Optional[int] = Query(None, ge=0),
+    manager: MachineManager = Depends(get_machine_manager),
+):
+    """延長借用 lease，CI job 應在 ttl 內定期呼叫"""
+    result = await manager.renew_lease(serial_number, owner=owner, ttl=ttl)
+
+    if result == LeaseResult.NOT_FOUND:
+        raise HTTPException(status_code=404, detail=f"Machine {serial_number} not found")
+    elif result == LeaseResult.NOT_RESERVED:
+        raise HTTPException(status_code=409, detail=f"Machine {serial_number} is not reserved")
+    elif result == LeaseResult.OWNER_MISMATCH:
+        raise HTTPException(status_code=409, detail=f"Machine {serial_number} is reserved by another owner")
+
+    return await manager.get_machine(serial_number)
 
 @router.post("/release/{serial_number}", response_model=ReleaseResponse)
 async def release_machine(
     serial_number: str,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", max_length=255),
     manager: MachineManager = Depends(get_machine_manager),
+    cache: IdempotencyCache = Depends(get_idempotency_cache),
 ):
+    async def release():
+        return await _release(serial_number, manager)
+
+    fingerprint = ("release", serial_number)
+    return await _idempotent(cache, idempotency_key, fingerprint, response, release)
+
+async def _release(serial_number: str, manager: MachineManager) -> ReleaseResponse:
     result = await manager.release_machine(serial_number)
-    machine = manager.get_machine(serial_number) # 取得最新狀態的機器物件
+    machine = await manager.get_machine(serial_number) # 取得最新狀態的機器物件
 
     # 根據結果決定 HTTP 回應
     if result == ReleaseResult.NOT_FOUND:
@@ -55,12 +157,133 @@ async def release_machine(
         return ReleaseResponse(
             status=ReleaseResult.SUCCESS,
             message="Machine reset initiated successfully. It will be reachable soon.",
-            machine=machine
+            machine=machine.model_copy()
         )
     
     # 理論上不會跑到這裡
     raise HTTPException(status_code=500, detail="Unknown error")
 
+@router.get("/history", response_model=dict)
+async def get_history(
+    serial: Optional[str] = None,
+    vendor: Optional[str] = None,
+    model: Optional[str] = None,
+    version: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: int = Query(1000, ge=1, le=10000),
+    manager: MachineManager = Depends(get_machine_manager),
+):
+    """
+    查詢狀態變更紀錄，可依序號或 pool (vendor/model/version) 過濾。
+    未指定時間區間時回傳最近 24 小時。
+    """
+    if manager.journal is None:
+        raise HTTPException(status_code=503, detail="Status journal is not enabled")
+
+    end = end or datetime.now(timezone.utc)
+    start = start or end - timedelta(hours=24)
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=timezone.utc)
+    if end.tzinfo is None:
+        end = end.replace(tzinfo=timezone.utc)
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+
+    transitions = await asyncio.to_thread(
+        manager.journal.query,
+        start,
+        end,
+        serial=serial,
+        pool=(vendor, model, version),
+        limit=limit,
+    )
+    return {"transitions": transitions}
+
+@router.get("/analytics/pools", response_model=dict)
+async def get_pool_analytics(
+    window: int = Query(60, ge=1, description="統計視窗 (分鐘)"),
+    manager: MachineManager = Depends(get_machine_manager),
+):
+    """各 pool 在視窗內的佔用率、借用成功率、release 後恢復時間與不可達時間"""
+    if manager.analytics is None:
+        raise HTTPException(status_code=503, detail="Pool analytics is not enabled")
+    return {"pools": await manager.analytics.report(window)}
+
+@router.get("/admin/timings", response_model=dict)
+async def get_request_timings():
+    """各 route 的延遲統計與最近的慢 request (新的在前)"""
+    return {
+        "slow_threshold_ms": recorder.slow_threshold * 1000,
+        "routes": recorder.route_latencies(),
+        "slow_requests": list(reversed(recorder.slow_requests)),
+    }
+
+@router.get("/admin/loop-lag", response_model=dict)
+async def get_loop_lag():
+    return {"event_loop": loop_monitor.stats()}
+
+@router.get("/admin/ssh-pool", response_model=dict)
+async def get_ssh_pool_stats(manager: MachineManager = Depends(get_machine_manager)):
+    """SSH session 的排隊深度與等待時間"""
+    return {"ssh_pool": manager.connector.ssh_pool.stats()}
+
+@router.get("/admin/webhooks", response_model=dict)
+async def webhook_stats(
+    webhooks: WebhookDispatcher = Depends(get_webhook_dispatcher),
+):
+    """各 webhook 訂閱的投遞狀況 (緩衝、磁碟暫存、已送出與丟棄的事件數)"""
+    return {"subscriptions": webhooks.stats()}
+
+@router.get("/admin/profile", response_class=PlainTextResponse)
+async def profile_process(
+    seconds: float = Query(5, gt=0, le=60),
+    interval_ms: float = Query(10, ge=1, le=1000),
+):
+    """取樣整個 process 的 stack，回傳 collapsed stack 格式 (可直接餵給 flamegraph.pl / speedscope)"""
+    if _profile_lock.locked():
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    async with _profile_lock:
+        collapsed = await asyncio.to_thread(sample_profile, seconds, interval_ms / 1000)
+    return PlainTextResponse(
+        collapsed,
+        headers={"Content-Disposition": 'attachment; filename="profile.collapsed"'},
+    )
+
+@router.post("/admin/refresh")
+async def bulk_refresh(
+    vendor: Optional[str] = None,
+    model: Optional[str] = None,
+    version: Optional[str] = None,
+    status: Optional[str] = None,
+    serial: Optional[List[str]] = Query(None, description="指定序號 (可重複)，設定時忽略其他過濾條件"),
+    concurrency: int = Query(16, ge=1, le=128),
+    manager: MachineManager = Depends(get_machine_manager),
+):
+    """
+    重新驗證 (ping + 序號) 符合條件的機器，每台完成時就以 NDJSON 回傳一行結果。
+    借用中或重啟中的機器會被略過。
+    """
+    unknown: List[str] = []
+    if serial:
+        machines = []
+        for s in dict.fromkeys(serial):
+            machine = await manager.get_machine(s)
+            if machine is None:
+                unknown.append(s)
+            else:
+                machines.append(machine)
+    else:
+        machines = await manager.get_machines(vendor, model, version, status)
+
+    async def stream():
+        for s in unknown:
+            yield RefreshResult(serial=s, error="not found").model_dump_json() + "\n"
+        async for result in manager.refresh_machines(machines, concurrency=concurrency):
+            yield result.model_dump_json() + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
 @router.post("/admin/reload", status_code=status.HTTP_200_OK)
 async def reload_configuration(
     manager: MachineManager = Depends(get_machine_manager),
@@ -1,9 +1,10 @@
-import yaml
 import os
 from pathlib import Path
-from typing import Dict, Any, Tuple
+from typing import Dict, Any, List, Optional, Tuple
 import logging
 
+from app.core.inventory import fragment_cache, load_device_inventory, load_yaml, merge_inventories
+
 logger = logging.getLogger(__name__)
 
 class Settings:
@@ -20,6 +21,86 @@ class Settings:
         self.CREDENTIALS_PATH: Path = Path(
             os.getenv("CREDENTIALS_PATH", str(self.CONFIG_DIR / "credentials.yaml"))
         )
+        # device.yaml 解析後的 JSON 快照 (以檔案內容 hash 判斷是否失效)；
+        # 未指定目錄時放在 BASE_DIR/data，無法寫入時改放設定檔旁邊
+        self.DEVICE_SNAPSHOT: bool = os.getenv("DEVICE_SNAPSHOT", "true").lower() in ("1", "true", "yes")
+        self.DEVICE_SNAPSHOT_DIR: Optional[Path] = (
+            Path(os.environ["DEVICE_SNAPSHOT_DIR"]) if os.getenv("DEVICE_SNAPSHOT_DIR") else None
+        )
+        # 分散的設備清單：目錄中的每個 *.yaml 與 device.yaml 格式相同，載入時合併
+        self.DEVICE_FRAGMENTS_DIR: Path = Path(
+            os.getenv("DEVICE_FRAGMENTS_DIR", str(self.CONFIG_DIR / "devices.d"))
+        )
+        # 解析 fragment 的 process 數量 (0 = CPU 數量，1 = 不另開 process)
+        self.INVENTORY_PARSE_WORKERS: int = int(os.getenv("INVENTORY_PARSE_WORKERS", "0"))
+        self.POOL_CONFIG_PATH: Path = Path(
+            os.getenv("POOL_CONFIG_PATH", str(self.CONFIG_DIR / "pools.yaml"))
+        )
+
+        self.WEBHOOK_CONFIG_PATH: Path = Path(
+            os.getenv("WEBHOOK_CONFIG_PATH", str(self.CONFIG_DIR / "webhooks.yaml"))
+        )
+
+        # 狀態儲存: memory (單一 process) 或 sqlite (多個 worker / replica 共用)
+        self.STATE_BACKEND: str = os.getenv("STATE_BACKEND", "memory").lower()
+        self.STATE_DB_PATH: Path = Path(
+            os.getenv("STATE_DB_PATH", str(self.BASE_DIR / "data" / "state.db"))
+        )
+        # Leader lease 的有效秒數；leader 失聯後最多這麼久就會由其他 process 接手
+        self.LEADER_LEASE_TTL: float = float(os.getenv("LEADER_LEASE_TTL", "15"))
+        # 借用 lease 的預設與最大秒數；0 表示未指定 ttl 的借用不會自動到期
+        self.RESERVATION_TTL: float = float(os.getenv("RESERVATION_TTL", "0"))
+        self.RESERVATION_MAX_TTL: float = float(os.getenv("RESERVATION_MAX_TTL", "86400"))
+
+        # 狀態變更 journal 的位置與 segment 輪替設定
+        self.JOURNAL_DIR: Path = Path(
+            os.getenv("JOURNAL_DIR", str(self.BASE_DIR / "data" / "journal"))
+        )
+        self.JOURNAL_SEGMENT_BYTES: int = int(os.getenv("JOURNAL_SEGMENT_BYTES", str(4 * 1024 * 1024)))
+        self.JOURNAL_MAX_SEGMENTS: int = int(os.getenv("JOURNAL_MAX_SEGMENTS", "50"))
+        # Idempotency-Key 結果保存的秒數與最多保存的 key 數量
+        self.IDEMPOTENCY_TTL: int = int(os.getenv("IDEMPOTENCY_TTL", "3600"))
+        self.IDEMPOTENCY_MAX_KEYS: int = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "10000"))
+        # 同時執行的 SSH session 上限
+        self.SSH_MAX_WORKERS: int = int(os.getenv("SSH_MAX_WORKERS", "16"))
+        # SSH circuit breaker：連續失敗幾次後暫停連線 (0 = 停用) 與暫停的秒數
+        self.SSH_BREAKER_THRESHOLD: int = int(os.getenv("SSH_BREAKER_THRESHOLD", "3"))
+        self.SSH_BREAKER_COOLDOWN: float = float(os.getenv("SSH_BREAKER_COOLDOWN", "60"))
+        # SSH ControlMaster：master 連線閒置多少秒後關閉 (0 = 不共用連線)
+        self.SSH_CONTROL_PERSIST: int = int(os.getenv("SSH_CONTROL_PERSIST", "60"))
+        # control socket 目錄 (權限 0700)；未設定時每個 process 建立自己的暫存目錄
+        self.SSH_CONTROL_DIR: Optional[Path] = (
+            Path(os.environ["SSH_CONTROL_DIR"]) if os.getenv("SSH_CONTROL_DIR") else None
+        )
+        # Ping 逾時 (毫秒)：依各 IP 的 RTT 估計，限制在 MIN 與 MAX 之間，沒有樣本時使用 INITIAL
+        self.PING_INITIAL_TIMEOUT_MS: float = float(os.getenv("PING_INITIAL_TIMEOUT_MS", "1000"))
+        self.PING_MIN_TIMEOUT_MS: float = float(os.getenv("PING_MIN_TIMEOUT_MS", "200"))
+        self.PING_MAX_TIMEOUT_MS: float = float(os.getenv("PING_MAX_TIMEOUT_MS", "3000"))
+        # 最近 PING_LOSS_WINDOW 次探測中掉包 PING_LOSS_THRESHOLD 次才判定為不可達
+        self.PING_LOSS_THRESHOLD: int = int(os.getenv("PING_LOSS_THRESHOLD", "2"))
+        self.PING_LOSS_WINDOW: int = int(os.getenv("PING_LOSS_WINDOW", "3"))
+        # 第一個封包遲到時再送一個 (hedged probe)
+        self.PING_HEDGE: bool = os.getenv("PING_HEDGE", "true").lower() in ("1", "true", "yes")
+        # 同一 gateway / 網段至少有這麼多台機器時，監控先探測 gateway (0 = 停用)
+        self.GATEWAY_PROBE_MIN_GROUP: int = int(os.getenv("GATEWAY_PROBE_MIN_GROUP", "2"))
+        # 超過此毫秒數的 request 會記錄到 GET /admin/timings 的慢 request 緩衝區
+        self.SLOW_REQUEST_MS: float = float(os.getenv("SLOW_REQUEST_MS", "1000"))
+        self.SLOW_REQUEST_BUFFER: int = int(os.getenv("SLOW_REQUEST_BUFFER", "100"))
+        # event loop 被卡住超過此毫秒數時記錄 loop thread 的 stack (0 = 停用)
+        self.LOOP_LAG_THRESHOLD_MS: float = float(os.getenv("LOOP_LAG_THRESHOLD_MS", "500"))
+        # webhook：合併事件的秒數與每批上限、重試次數與第一次重試的間隔 (之後加倍)、request 逾時
+        self.WEBHOOK_BATCH_WINDOW: float = float(os.getenv("WEBHOOK_BATCH_WINDOW", "2"))
+        self.WEBHOOK_BATCH_MAX: int = int(os.getenv("WEBHOOK_BATCH_MAX", "100"))
+        self.WEBHOOK_MAX_RETRIES: int = int(os.getenv("WEBHOOK_MAX_RETRIES", "5"))
+        self.WEBHOOK_RETRY_BASE: float = float(os.getenv("WEBHOOK_RETRY_BASE", "1"))
+        self.WEBHOOK_TIMEOUT: float = float(os.getenv("WEBHOOK_TIMEOUT", "5"))
+        # 送不出去的批次暫存目錄與每個訂閱最多保留的批次數
+        self.WEBHOOK_QUEUE_DIR: Path = Path(
+            os.getenv("WEBHOOK_QUEUE_DIR", str(self.BASE_DIR / "data" / "webhooks"))
+        )
+        self.WEBHOOK_QUEUE_MAX: int = int(os.getenv("WEBHOOK_QUEUE_MAX", "1000"))
+        # 使用率統計保留的分鐘數 (每個 pool 每分鐘一個 bucket)
+        self.ANALYTICS_RETENTION_MINUTES: int = int(os.getenv("ANALYTICS_RETENTION_MINUTES", str(7 * 24 * 60)))
 
     @staticmethod
     def _ensure_file(path: Path, kind: str) -> None:
@@ -28,21 +109,79 @@ class Settings:
         if not path.is_file():
             raise FileExistsError(f"{kind} at {path} is not a file")
 
+    def device_snapshot_paths(self) -> List[Path]:
+        """device.yaml 快照的候選位置，依序嘗試 (預設 backend/data，不寫進設定目錄)"""
+        if not self.DEVICE_SNAPSHOT:
+            return []
+        name = f".{self.DEVICE_CONFIG_PATH.name}.snapshot"
+        if self.DEVICE_SNAPSHOT_DIR is not None:
+            return [self.DEVICE_SNAPSHOT_DIR / name]
+        return [self.BASE_DIR / "data" / name, self.DEVICE_CONFIG_PATH.parent / name]
+
     def load_device_config(self) -> Dict[str, Any]:
         """
-        載入 device.yaml。
-        每次呼叫都會重新讀取檔案，以支援動態更新。
+        載入 device.yaml 與 DEVICE_FRAGMENTS_DIR 中的 fragment。
+        每次呼叫都會重新讀取檔案，以支援動態更新；內容未變時直接使用解析過的快照，
+        fragment 只重新解析有變更的檔案。兩者都存在時合併，serial 重複視為設定錯誤。
         """
+        if not self.DEVICE_FRAGMENTS_DIR.is_dir():
+            return self._load_device_file()
+
+        sources = []
+        if self.DEVICE_CONFIG_PATH.exists():
+            sources.append((self.DEVICE_CONFIG_PATH.name, self._load_device_file()))
+        logger.debug(f"Loading device fragments from {self.DEVICE_FRAGMENTS_DIR}")
+        sources.extend(fragment_cache.load(self.DEVICE_FRAGMENTS_DIR, self.INVENTORY_PARSE_WORKERS))
+        return merge_inventories(sources)
+
+    def _load_device_file(self) -> Dict[str, Any]:
         self._ensure_file(self.DEVICE_CONFIG_PATH, "device config")
         logger.debug(f"Loading device config from {self.DEVICE_CONFIG_PATH}")
-        with open(self.DEVICE_CONFIG_PATH, "r", encoding="utf-8") as f:
-            data = yaml.safe_load(f)
+        data = load_device_inventory(self.DEVICE_CONFIG_PATH, self.device_snapshot_paths())
 
         if not isinstance(data, dict):
             raise ValueError("device.yaml must be a mapping")
 
         return data
 
+    def load_pool_config(self) -> Dict[str, Any]:
+        """
+        載入 pools.yaml (選用)。
+        檔案不存在時回傳空設定，所有 pool 使用預設值。
+        """
+        if not self.POOL_CONFIG_PATH.exists():
+            return {}
+        self._ensure_file(self.POOL_CONFIG_PATH, "pool config")
+        logger.debug(f"Loading pool config from {self.POOL_CONFIG_PATH}")
+        with open(self.POOL_CONFIG_PATH, "r", encoding="utf-8") as f:
+            data = load_yaml(f)
+
+        if data is None:
+            return {}
+        if not isinstance(data, dict):
+            raise ValueError("pools.yaml must be a mapping")
+
+        return data
+
+    def load_webhook_config(self) -> Dict[str, Any]:
+        """
+        載入 webhooks.yaml (選用)。
+        檔案不存在時回傳空設定，不送出任何通知。
+        """
+        if not self.WEBHOOK_CONFIG_PATH.exists():
+            return {}
+        self._ensure_file(self.WEBHOOK_CONFIG_PATH, "webhook config")
+        logger.debug(f"Loading webhook config from {self.WEBHOOK_CONFIG_PATH}")
+        with open(self.WEBHOOK_CONFIG_PATH, "r", encoding="utf-8") as f:
+            data = load_yaml(f)
+
+        if data is None:
+            return {}
+        if not isinstance(data, dict):
+            raise ValueError("webhooks.yaml must be a mapping")
+
+        return data
+
     def load_credentials(self) -> Tuple[Dict[str, Any], Dict[str, Any]]:
         """
         載入 credentials.yaml。
@@ -52,7 +191,7 @@ class Settings:
         self._ensure_file(self.CREDENTIALS_PATH, "credentials config")
         logger.debug(f"Loading credentials from {self.CREDENTIALS_PATH}")
         with open(self.CREDENTIALS_PATH, "r", encoding="utf-8") as f:
-            data = yaml.safe_load(f)
+            data = load_yaml(f)
 
         if not isinstance(data, dict):
             raise ValueError("credentials.yaml must be a mapping")
@@ -0,0 +1,246 @@
+"""Device inventory loading.
+
+YAML is parsed with libyaml's ``CSafeLoader`` when PyYAML was built with it
+and with the pure-Python ``SafeLoader`` otherwise. ``load_device_inventory``
+additionally keeps a compiled JSON snapshot of the parsed tree, keyed by the
+SHA-256 of the YAML source: while the source is unchanged, loading costs one
+hash and one ``json.loads`` instead of a full YAML parse.
+
+``FragmentCache`` loads an inventory split into ``*.yaml`` fragments (one per
+lab team): changed fragments are parsed in parallel in a process pool, the
+others are reused from the previous load, and the results are merged with
+duplicate-serial detection.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import yaml
+
+logger = logging.getLogger(__name__)
+
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# 快照格式變更時遞增，舊快照會被視為失效
+_SNAPSHOT_VERSION = 1
+
+
+def load_yaml(source: Any) -> Any:
+    """等同 yaml.safe_load，有 libyaml 時使用 C loader"""
+    return yaml.load(source, Loader=YamlLoader)
+
+
+def _stringify_keys(value: Any) -> Any:
+    # 設定的 key (vendor / model / version / 欄位名稱) 一律轉成字串，
+    # 例如未加引號的版本號 9.3 會被 YAML 解析成 float，這裡與 JSON 快照的結果一致
+    if isinstance(value, dict):
+        return {str(k): _stringify_keys(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_stringify_keys(v) for v in value]
+    return value
+
+
+def _read_snapshot(path: Path, digest: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            # 第一行是 header，hash 不符時不需要解析整份快照
+            header = json.loads(f.readline())
+            if header.get("version") != _SNAPSHOT_VERSION or header.get("sha256") != digest:
+                return None
+            data = json.loads(f.read())
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, AttributeError) as e:
+        logger.warning(f"Ignoring unreadable inventory snapshot {path}: {e}")
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def _serialize(data: Dict[str, Any]) -> Optional[str]:
+    try:
+        body = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+    except (TypeError, ValueError):
+        return None
+    # 日期等 JSON 無法原樣表示的值會在往返後改變，這種設定不建立快照
+    return body if json.loads(body) == data else None
+
+
+def _write_snapshot(path: Path, digest: str, body: str) -> bool:
+    header = json.dumps({"version": _SNAPSHOT_VERSION, "sha256": digest})
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(prefix=f".{path.name}.", dir=path.parent)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(header + "\n" + body)
+            os.replace(tmp_name, path)  # 其他 worker 只會讀到完整的快照
+        except BaseException:
+            os.unlink(tmp_name)
+            raise
+    except OSError as e:
+        logger.debug(f"Cannot write inventory snapshot {path}: {e}")
+        return False
+    return True
+
+
+def load_device_inventory(path: Path, snapshot_paths: Iterable[Path] = ()) -> Any:
+    """
+    載入 device.yaml。
+    snapshot_paths 依序為快照的候選位置 (例如設定檔旁邊、資料目錄)：
+    讀取時使用第一個 hash 相符的快照；重新解析後寫入第一個可寫入的位置
+    (設定目錄唯讀時自動改用下一個)。
+    """
+    raw = path.read_bytes()
+    digest = hashlib.sha256(raw).hexdigest()
+    candidates = list(snapshot_paths)
+
+    for candidate in candidates:
+        data = _read_snapshot(candidate, digest)
+        if data is not None:
+            logger.debug(f"Loaded device inventory from snapshot {candidate}")
+            return data
+
+    data = _stringify_keys(load_yaml(raw))
+    body = _serialize(data) if candidates and isinstance(data, dict) else None
+    if body is not None:
+        for candidate in candidates:
+            if _write_snapshot(candidate, digest, body):
+                break
+    return data
+
+
+def _parse_fragment(raw: bytes) -> Any:
+    # 在 worker process 中執行，必須是 module 層級的函式才能 pickle
+    return _stringify_keys(load_yaml(raw))
+
+
+def merge_inventories(sources: Iterable[Tuple[str, Any]]) -> Dict[str, Any]:
+    """
+    合併多份 vendor -> model -> version -> [devices] 設定，同一個 version 的 device 串接。
+    serial 重複時拋出 ValueError (指出兩個來源)，避免其中一台機器被默默覆蓋。
+    """
+    merged: Dict[str, Any] = {}
+    owners: Dict[str, str] = {}
+    for name, data in sources:
+        if data is None:
+            continue
+        if not isinstance(data, dict):
+            raise ValueError(f"Inventory fragment {name} must be a mapping")
+        for vendor, models in data.items():
+            if not isinstance(models, dict):
+                logger.warning(f"Skipping non-mapping vendor {vendor!r} in {name}")
+                continue
+            for model, versions in models.items():
+                if not isinstance(versions, dict):
+                    logger.warning(f"Skipping non-mapping model {vendor}/{model} in {name}")
+                    continue
+                for version, devices in versions.items():
+                    if not isinstance(devices, list):
+                        logger.warning(f"Skipping non-list version {vendor}/{model}/{version} in {name}")
+                        continue
+                    for dev in devices:
+                        serial = dev.get("serial") if isinstance(dev, dict) else None
+                        if serial is not None:
+                            serial = str(serial)
+                            if serial in owners:
+                                raise ValueError(
+                                    f"Duplicate serial {serial} in {owners[serial]} and {name}"
+                                )
+                            owners[serial] = name
+                    (
+                        merged.setdefault(vendor, {})
+                        .setdefault(model, {})
+                        .setdefault(version, [])
+                        .extend(devices)
+                    )
+    return merged
+
+
+class _Fragment:
+    __slots__ = ("stat_key", "digest", "data")
+
+    def __init__(self, stat_key: Tuple[int, int], digest: str, data: Any):
+        self.stat_key = stat_key
+        self.digest = digest
+        self.data = data
+
+
+class FragmentCache:
+    """
+    保存各 fragment 上次解析的結果。
+    mtime / 大小未變的 fragment 不重新讀取；內容 hash 未變的不重新解析。
+    """
+
+    def __init__(self):
+        self._fragments: Dict[Path, _Fragment] = {}
+        self._lock = threading.Lock()
+        self.parsed = 0  # 累計實際解析的 fragment 數量
+
+    @staticmethod
+    def _parse_all(raws: List[bytes], max_workers: int) -> List[Any]:
+        workers = min(max_workers, len(raws))
+        if workers <= 1:
+            return [_parse_fragment(raw) for raw in raws]
+        # forkserver: 不從有多個執行緒的 server process 直接 fork
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context(method)) as pool:
+            return list(pool.map(_parse_fragment, raws))
+
+    def load(self, directory: Path, max_workers: int = 0) -> List[Tuple[str, Any]]:
+        """
+        回傳 [(fragment 名稱, 解析結果)]，依檔名排序。
+        max_workers 為解析用的 process 數量 (0 = CPU 數量，1 = 在目前的 process 解析)。
+        """
+        with self._lock:
+            paths = sorted(p for p in directory.glob("*.yaml") if p.is_file())
+            pending: List[Tuple[Path, Tuple[int, int], str, bytes]] = []
+            current: Dict[Path, _Fragment] = {}
+            for path in paths:
+                st = path.stat()
+                stat_key = (st.st_mtime_ns, st.st_size)
+                cached = self._fragments.get(path)
+                if cached is not None and cached.stat_key == stat_key:
+                    current[path] = cached
+                    continue
+                raw = path.read_bytes()
+                digest = hashlib.sha256(raw).hexdigest()
+                if cached is not None and cached.digest == digest:
+                    cached.stat_key = stat_key
+                    current[path] = cached
+                    continue
+                pending.append((path, stat_key, digest, raw))
+
+            if pending:
+                logger.info(f"Parsing {len(pending)} of {len(paths)} inventory fragments in {directory}")
+                results = self._parse_all(
+                    [raw for *_, raw in pending], max_workers or os.cpu_count() or 1
+                )
+                self.parsed += len(pending)
+                for (path, stat_key, digest, _), data in zip(pending, results):
+                    current[path] = _Fragment(stat_key, digest, data)
+
+            self._fragments = current  # 已刪除的 fragment 一併移除
+            return [(path.name, current[path].data) for path in paths]
+
+
+fragment_cache = FragmentCache()
+
+
+__all__ = [
+    "FragmentCache",
+    "YamlLoader",
+    "fragment_cache",
+    "load_device_inventory",
+    "load_yaml",
+    "merge_inventories",
+]
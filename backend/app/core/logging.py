@@ -2,27 +2,145 @@
 
 from __future__ import annotations
 
+import atexit
+import gzip
+import json
 import logging
-from datetime import datetime
+import logging.handlers
+import os
+import queue
+import shutil
+import time
+from datetime import datetime, timezone
 from pathlib import Path
 
 _LOG_DIR = Path(__file__).resolve().parent.parent.parent / "logs"
 
+_TEXT_FORMAT = "%(asctime)s [%(levelname)s] [%(name)s] %(message)s"
+_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+_listener: logging.handlers.QueueListener | None = None
+
 
 def _ensure_log_dir() -> Path:
     _LOG_DIR.mkdir(parents=True, exist_ok=True)
     return _LOG_DIR
 
 
+def _env_int(name: str, default: int) -> int:
+    # logging 在 import 時就要設定，早於 Settings (需要 CONFIG_DIR)，因此直接讀環境變數
+    return int(os.getenv(name, str(default)))
+
+
+class JsonFormatter(logging.Formatter):
+    """每筆記錄輸出一行 JSON"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "process": record.process,
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class CompressingRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    依大小或時間 (任一條件先達到) 輪替的 file handler。
+    輪替後的舊檔以 gzip 壓縮 (<name>.1.gz, <name>.2.gz, ...)，超過 backupCount 的刪除。
+    """
+
+    def __init__(
+        self,
+        filename: Path,
+        max_bytes: int = 0,
+        interval: int = 0,
+        backup_count: int = 0,
+        compress: bool = True,
+    ):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+        self.interval = interval
+        self._next_rollover = time.time() + interval if interval > 0 else None
+        if compress:
+            self.namer = lambda name: name + ".gz"
+            self.rotator = self._compress
+
+    @staticmethod
+    def _compress(source: str, dest: str) -> None:
+        with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(source)
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if self._next_rollover is not None and record.created >= self._next_rollover:
+            return True
+        return bool(super().shouldRollover(record))
+
+    def doRollover(self) -> None:
+        super().doRollover()
+        if self._next_rollover is not None:
+            self._next_rollover = time.time() + self.interval
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """佇列滿時丟棄記錄而不阻塞呼叫端，並在下一筆成功寫入前補一筆丟棄數量的警告"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.dropped:
+            warning = logging.LogRecord(
+                __name__, logging.WARNING, __file__, 0,
+                "Log queue full; dropped %d records", (self.dropped,), None,
+            )
+            try:
+                self.queue.put_nowait(self.prepare(warning))
+            except queue.Full:
+                self.dropped += 1
+                return
+            self.dropped = 0
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def shutdown_logging() -> None:
+    """停止背景寫入執行緒並送出佇列中剩餘的記錄"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
 def setup_logging() -> Path | None:
     """Configure application-wide logging.
 
     Creates a logs directory if it does not exist and configures the root logger
-    with handlers that write both to stdout and to a timestamped log file.
-    If the directory or log file cannot be created, falls back to stdout-only
-    logging and returns ``None``.
+    with a queue handler; a background listener thread writes the records both to
+    stdout and to a timestamped, rotating log file, so logging never blocks the
+    event loop on I/O. If the directory or log file cannot be created, falls back
+    to stdout-only logging and returns ``None``.
+
+    Environment variables:
+        LOG_FORMAT: ``text`` (default) or ``json`` (one JSON object per line)
+        LOG_MAX_BYTES: rotate when the file exceeds this size (default 50 MiB, 0 disables)
+        LOG_ROTATE_INTERVAL: rotate every N seconds (default 86400, 0 disables)
+        LOG_BACKUP_COUNT: rotated files to keep (default 14)
+        LOG_COMPRESS: gzip rotated files (default true)
+        LOG_QUEUE_SIZE: records buffered before new ones are dropped (default 10000)
     """
 
+    global _listener
+
     if getattr(setup_logging, "_configured", False):
         return getattr(setup_logging, "_log_file")
 
@@ -38,31 +156,45 @@ def setup_logging() -> Path | None:
     log_file = None
     file_error: OSError | None = None
 
-    formatter = logging.Formatter(
-        fmt="%(asctime)s [%(levelname)s] [%(name)s] %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S",
-    )
+    if os.getenv("LOG_FORMAT", "text").lower() == "json":
+        formatter: logging.Formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(fmt=_TEXT_FORMAT, datefmt=_DATE_FORMAT)
 
     root_logger = logging.getLogger()
     root_logger.setLevel(logging.INFO)
 
     for handler in list(root_logger.handlers):
         root_logger.removeHandler(handler)
+    shutdown_logging()
 
+    handlers: list[logging.Handler] = []
     if log_dir is not None:
         candidate_log_file = log_dir / f"{timestamp}.log"
         try:
-            file_handler = logging.FileHandler(candidate_log_file, encoding="utf-8")
+            file_handler = CompressingRotatingFileHandler(
+                candidate_log_file,
+                max_bytes=_env_int("LOG_MAX_BYTES", 50 * 1024 * 1024),
+                interval=_env_int("LOG_ROTATE_INTERVAL", 86400),
+                backup_count=_env_int("LOG_BACKUP_COUNT", 14),
+                compress=os.getenv("LOG_COMPRESS", "true").lower() in ("1", "true", "yes"),
+            )
         except OSError as exc:
             file_error = exc
         else:
             file_handler.setFormatter(formatter)
-            root_logger.addHandler(file_handler)
+            handlers.append(file_handler)
             log_file = candidate_log_file
 
     stream_handler = logging.StreamHandler()
     stream_handler.setFormatter(formatter)
-    root_logger.addHandler(stream_handler)
+    handlers.append(stream_handler)
+
+    # 呼叫端只把記錄放進佇列，檔案與 stdout 的寫入都在 listener 執行緒
+    log_queue: queue.Queue = queue.Queue(maxsize=_env_int("LOG_QUEUE_SIZE", 10000))
+    root_logger.addHandler(DroppingQueueHandler(log_queue))
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
 
     setup_logging._configured = True
     setup_logging._log_file = log_file
@@ -79,5 +211,6 @@ def setup_logging() -> Path | None:
     return log_file
 
 
-__all__ = ["setup_logging"]
+atexit.register(shutdown_logging)
 
+__all__ = ["setup_logging", "shutdown_logging"]
@@ -0,0 +1,148 @@
+"""Event-loop lag watchdog and in-process sampling profiler.
+
+``LoopLagMonitor`` runs a ticking coroutine on the event loop plus a watchdog
+thread: the coroutine measures how late each tick is scheduled, and the thread
+logs the loop thread's stack once the loop has not ticked for longer than the
+threshold (the coroutine itself cannot run while the loop is blocked).
+
+``sample_profile`` samples ``sys._current_frames()`` from a separate thread and
+returns collapsed stacks (``frame;frame;frame count``), the input format of
+flamegraph.pl / speedscope.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from types import FrameType
+from typing import Dict, List, Optional
+
+from app.models.timing import LoopLagStats
+
+logger = logging.getLogger(__name__)
+
+
+class LoopLagMonitor:
+    """量測 event loop 排程延遲，超過門檻時記錄被卡住的 stack"""
+
+    def __init__(self, threshold: float = 0.5, interval: float = 0.1):
+        self.threshold = threshold
+        self.interval = interval
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.stalls = 0
+        self._last_tick = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def configure(self, threshold: float) -> None:
+        self.threshold = threshold
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    async def _tick(self) -> None:
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.last_lag = max(now - expected, 0.0)
+            self.max_lag = max(self.max_lag, self.last_lag)
+            self._last_tick = now
+
+    def _watch(self) -> None:
+        dumped_for: Optional[float] = None
+        while not self._stop.wait(self.threshold / 2):
+            last_tick = self._last_tick
+            stalled = time.monotonic() - last_tick
+            if stalled <= self.threshold + self.interval or dumped_for == last_tick:
+                continue
+            # 同一次卡住只記錄一次 stack
+            dumped_for = last_tick
+            self.stalls += 1
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "<unavailable>\n"
+            logger.warning(
+                f"Event loop blocked for {stalled * 1000:.0f} ms; loop thread stack:\n{stack}"
+            )
+
+    def start(self) -> None:
+        if self.running or self.threshold <= 0:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._tick())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._stop.set()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._watchdog = None
+
+    def stats(self) -> LoopLagStats:
+        return LoopLagStats(
+            running=self.running,
+            threshold_ms=round(self.threshold * 1000, 2),
+            last_lag_ms=round(self.last_lag * 1000, 2),
+            max_lag_ms=round(self.max_lag * 1000, 2),
+            stalls=self.stalls,
+        )
+
+
+loop_monitor = LoopLagMonitor()
+
+
+def _frame_label(frame: FrameType) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)})"
+
+
+def _collapse(frame: Optional[FrameType]) -> List[str]:
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+
+def sample_profile(duration: float, interval: float = 0.01) -> str:
+    """
+    在呼叫的執行緒中取樣所有其他執行緒 duration 秒 (需在 event loop 以外的執行緒呼叫)，
+    回傳 collapsed stack 格式的文字。
+    """
+    own_id = threading.get_ident()
+    names: Dict[int, str] = {}
+    counts: Counter = Counter()
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        names.update({t.ident: t.name for t in threading.enumerate() if t.ident is not None})
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            stack = _collapse(frame)
+            stack.insert(0, names.get(thread_id, f"thread-{thread_id}"))
+            counts[";".join(stack)] += 1
+        time.sleep(interval)
+    return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+
+__all__ = ["LoopLagMonitor", "loop_monitor", "sample_profile"]
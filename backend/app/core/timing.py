@@ -0,0 +1,198 @@
+"""Per-request latency breakdown.
+
+``timed(phase)`` accumulates elapsed time into the timings of the request
+currently being served (a context variable, so it also works inside tasks and
+``asyncio.to_thread`` calls spawned by the request). ``TimingMiddleware``
+records per-route latency, keeps slow requests in a ring buffer and emits a
+``Server-Timing`` header.
+"""
+
+from __future__ import annotations
+
+import functools
+import statistics
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+
+from fastapi.routing import APIRoute
+
+from app.models.timing import RouteLatency, SlowRequest
+
+_current: ContextVar[Optional["RequestTimings"]] = ContextVar("request_timings", default=None)
+
+
+class RequestTimings:
+    """單一 request 各階段累計的秒數"""
+
+    __slots__ = ("started", "phases", "endpoint_done")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {}
+        self.endpoint_done: Optional[float] = None
+
+    def add(self, phase: str, seconds: float) -> None:
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+
+@contextmanager
+def timed(phase: str) -> Iterator[None]:
+    """把區塊的執行時間計入目前 request 的 phase；不在 request 中時不做任何事"""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(phase, time.perf_counter() - start)
+
+
+class TimedRoute(APIRoute):
+    """記錄 endpoint 回傳的時間點，response 開始送出前的時間即為 serialization"""
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        @functools.wraps(endpoint)
+        async def timed_endpoint(*args, **kw):
+            try:
+                return await endpoint(*args, **kw)
+            finally:
+                timings = _current.get()
+                if timings is not None:
+                    timings.endpoint_done = time.perf_counter()
+
+        super().__init__(path, timed_endpoint, **kwargs)
+
+
+class _RouteStats:
+    __slots__ = ("count", "total", "max", "recent")
+
+    def __init__(self, sample_size: int):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent: Deque[float] = deque(maxlen=sample_size)
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.recent.append(seconds)
+
+
+class TimingRecorder:
+    """各 route 的延遲統計與最近的慢 request"""
+
+    def __init__(self, slow_threshold: float = 1.0, slow_buffer: int = 100, sample_size: int = 512):
+        self.slow_threshold = slow_threshold
+        self.sample_size = sample_size
+        self.slow_requests: Deque[SlowRequest] = deque(maxlen=slow_buffer)
+        self._routes: Dict[Tuple[str, str], _RouteStats] = {}
+
+    def configure(self, slow_threshold: float, slow_buffer: int) -> None:
+        self.slow_threshold = slow_threshold
+        if slow_buffer != self.slow_requests.maxlen:
+            self.slow_requests = deque(self.slow_requests, maxlen=slow_buffer)
+
+    def record(
+        self,
+        method: str,
+        route: str,
+        path: str,
+        status_code: int,
+        duration: float,
+        phases: Dict[str, float],
+    ) -> None:
+        key = (method, route)
+        stats = self._routes.get(key)
+        if stats is None:
+            stats = self._routes[key] = _RouteStats(self.sample_size)
+        stats.add(duration)
+
+        if duration >= self.slow_threshold:
+            self.slow_requests.append(SlowRequest(
+                timestamp=datetime.now(timezone.utc),
+                method=method,
+                route=route,
+                path=path,
+                status_code=status_code,
+                duration_ms=round(duration * 1000, 2),
+                phases_ms={k: round(v * 1000, 2) for k, v in phases.items()},
+            ))
+
+    def route_latencies(self) -> List[RouteLatency]:
+        result = []
+        for (method, route), stats in sorted(self._routes.items(), key=lambda item: item[0][::-1]):
+            recent = sorted(stats.recent)
+            p95 = recent[min(int(len(recent) * 0.95), len(recent) - 1)]
+            result.append(RouteLatency(
+                method=method,
+                route=route,
+                count=stats.count,
+                mean_ms=round(stats.total / stats.count * 1000, 2),
+                p50_ms=round(statistics.median(recent) * 1000, 2),
+                p95_ms=round(p95 * 1000, 2),
+                max_ms=round(stats.max * 1000, 2),
+            ))
+        return result
+
+
+recorder = TimingRecorder()
+
+
+def _server_timing(phases: Dict[str, float], total: float) -> bytes:
+    entries = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in phases.items()]
+    entries.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(entries).encode("latin-1")
+
+
+class TimingMiddleware:
+    """Pure ASGI middleware，不經過 BaseHTTPMiddleware 以免額外的 task 與 streaming 開銷"""
+
+    def __init__(self, app, recorder: TimingRecorder = recorder):
+        self.app = app
+        self.recorder = recorder
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = _current.set(timings)
+        status_code = 500
+
+        async def send_with_timing(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                now = time.perf_counter()
+                if timings.endpoint_done is not None:
+                    timings.add("serialize", now - timings.endpoint_done)
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", _server_timing(timings.phases, now - timings.started)))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            # 沒有對應 route 的 request (404) 合併統計，避免任意路徑撐大統計表
+            route = getattr(scope.get("route"), "path", None) or "<unmatched>"
+            self.recorder.record(
+                scope["method"],
+                route,
+                scope["path"],
+                status_code,
+                time.perf_counter() - timings.started,
+                timings.phases,
+            )
+
+
+__all__ = ["TimedRoute", "TimingMiddleware", "TimingRecorder", "recorder", "timed"]
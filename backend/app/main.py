@@ -7,7 +7,14 @@ import asyncio
 
 from app.api.routers import machines
 from app.core.logging import setup_logging
-from app.api.deps import get_machine_manager, verify_bearer_token
+from app.core.profiling import loop_monitor
+from app.core.timing import TimingMiddleware, recorder
+from app.api.deps import get_machine_manager, get_webhook_dispatcher, verify_bearer_token
+from app.core.config import get_settings
+from app.services.analytics import sample_pool_analytics
+from app.services.hot_spare import maintain_hot_spares
+from app.services.leader import LeaderElector
+from app.services.lease_reaper import reap_expired_leases
 from app.services.machine_monitor import monitor_machines
 
 setup_logging()
@@ -23,20 +30,57 @@ def _require_env(var_name: str) -> str:
 async def lifespan(app: FastAPI):
     # Startup
     _require_env("API_BEARER_TOKEN")
+    settings = get_settings()
+    recorder.configure(settings.SLOW_REQUEST_MS / 1000, settings.SLOW_REQUEST_BUFFER)
+    loop_monitor.configure(settings.LOOP_LAG_THRESHOLD_MS / 1000)
+    loop_monitor.start()
     manager = await get_machine_manager()
-    await manager.initialize_status() # 啟動時檢查一次
+    # webhook 在啟動檢查前掛上，啟動時的狀態變更也會通知
+    webhooks = await get_webhook_dispatcher()
+    if webhooks.subscriptions:
+        manager.add_transition_listener(webhooks.on_transition)
+        await webhooks.start()
+
+    # 多個 process 共用狀態時，只有 leader 負責啟動檢查與背景探測
+    elector = LeaderElector(manager.state, ttl=settings.LEADER_LEASE_TTL)
+    is_leader = await elector.acquire()
+    # lease 續約在啟動檢查前開始，檢查超過 LEADER_LEASE_TTL 時其他 process 也不會接手
+    elector_task = asyncio.create_task(elector.run())
+    if is_leader:
+        await manager.initialize_status() # 啟動時檢查一次
+    else:
+        logger.info("Another process holds the leader lease; skipping startup sweep.")
     
-    # 啟動背景監控
-    monitor_task = asyncio.create_task(monitor_machines(manager))
+    # 啟動背景監控、過期借用回收與 hot spare 維護
+    monitor_task = asyncio.create_task(
+        monitor_machines(manager, elector, settings.GATEWAY_PROBE_MIN_GROUP)
+    )
+    reaper_task = asyncio.create_task(reap_expired_leases(manager, elector))
+    spare_task = asyncio.create_task(maintain_hot_spares(manager, elector))
+    tasks = [spare_task, reaper_task, monitor_task, elector_task]
+    # 狀態時間只由 leader 取樣；借用統計由每個 process 寫入共用 store
+    if getattr(manager, "analytics", None) is not None:
+        tasks.append(asyncio.create_task(
+            sample_pool_analytics(manager, manager.analytics, elector)
+        ))
     
     yield
     
     # Shutdown
-    monitor_task.cancel()
-    try:
-        await monitor_task
-    except asyncio.CancelledError:
-        pass
+    for task in tasks:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    await webhooks.stop()  # 未送出的事件寫入磁碟佇列
+    journal = getattr(manager, "journal", None)
+    if journal is not None:
+        await asyncio.to_thread(journal.close)  # 寫完佇列中的狀態變更
+    await loop_monitor.stop()
+    connector = getattr(manager, "connector", None)
+    if connector is not None:
+        await connector.close()
     logger.info("Shutdown complete.")
 
 app = FastAPI(
@@ -51,7 +95,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
+# 最後加入的 middleware 在最外層，才能量到完整的 request 時間
+app.add_middleware(TimingMiddleware)
 
 app.include_router(
     machines.router,
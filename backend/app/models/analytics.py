@@ -0,0 +1,21 @@
+from typing import Dict, Optional
+
+from pydantic import BaseModel
+
+
+class PoolUtilization(BaseModel):
+    """單一 pool 在查詢視窗內的使用統計"""
+    vendor: str
+    model: str
+    version: str
+    window_minutes: int
+    machine_seconds: float  # 視窗內所有機器累計的觀察秒數
+    occupancy: Optional[float] = None  # 被借用 (unavailable) 時間佔比
+    status_seconds: Dict[str, float] = {}
+    unreachable_seconds: float = 0.0
+    reserve_requests: int = 0
+    reserve_success: int = 0
+    reserve_not_found: int = 0  # 沒有可用機器 (API 回傳 404) 的次數
+    reserve_success_rate: Optional[float] = None
+    recoveries: int = 0
+    mean_time_to_available: Optional[float] = None  # release 後恢復 AVAILABLE 的平均秒數
@@ -0,0 +1,19 @@
+from datetime import datetime
+from typing import Optional
+
+from pydantic import BaseModel
+
+from app.models.machine import MachineStatus
+
+
+class StatusTransition(BaseModel):
+    """一次機器狀態變更"""
+    timestamp: datetime
+    serial: str
+    vendor: str
+    model: str
+    version: str
+    from_status: MachineStatus
+    to_status: MachineStatus
+    cause: str = ""
+    duration: Optional[float] = None  # 在 from_status 停留的秒數 (此 process 觀察到的)
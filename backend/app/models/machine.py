@@ -1,3 +1,4 @@
+from datetime import datetime
 from enum import Enum
 from typing import Optional
 from pydantic import BaseModel, ConfigDict
@@ -8,6 +9,11 @@ class MachineStatus(str, Enum):
     UNREACHABLE = "unreachable"
     REBOOTING = "rebooting"
 
+class CircuitState(str, Enum):
+    CLOSED = "closed"          # 正常連線
+    OPEN = "open"              # SSH 連續失敗，暫停連線直到 cooldown 結束
+    HALF_OPEN = "half_open"    # cooldown 結束，下一次連線為試探
+
 class MachineBase(BaseModel):
     """機器的基本屬性定義"""
     vendor: str
@@ -23,6 +29,16 @@ class MachineBase(BaseModel):
 class Machine(MachineBase):
     """包含狀態的完整機器物件"""
     status: MachineStatus = MachineStatus.AVAILABLE
+    expected_available_at: Optional[datetime] = None  # 重啟中機器的預估可用時間
+    lease_owner: Optional[str] = None  # 借用者 (例如 CI job ID)
+    lease_expires_at: Optional[datetime] = None  # 未續約 (heartbeat) 時自動釋放的時間
+    lease_ttl: Optional[float] = None  # 借用時給定的 lease 秒數，heartbeat 未指定 ttl 時沿用
+    last_reserved_at: Optional[datetime] = None  # 最近一次被借出的時間
+    reservation_count: int = 0  # 累計借出次數
+    avg_reboot_seconds: Optional[float] = None  # 重置後恢復可用所需時間 (EWMA)
+    last_verified_at: Optional[datetime] = None  # 最近一次 ping + 序號驗證成功的時間
+    circuit_state: CircuitState = CircuitState.CLOSED  # SSH circuit breaker 狀態 (此 process)
+    circuit_retry_at: Optional[datetime] = None  # circuit 為 open 時，下一次允許試探的時間
     model_config = ConfigDict(from_attributes=True)
 
 class ReserveRequest(BaseModel):
@@ -35,6 +51,22 @@ class ReleaseResult(str, Enum):
     FAILED = "failed"                   # SSH 連線或重置指令執行失敗
     NOT_FOUND = "not_found"             # 找不到該序號的機器
 
+class LeaseResult(str, Enum):
+    SUCCESS = "success"                 # 成功續約
+    NOT_FOUND = "not_found"             # 找不到該序號的機器
+    NOT_RESERVED = "not_reserved"       # 機器目前沒有被借用
+    OWNER_MISMATCH = "owner_mismatch"   # lease 屬於其他借用者
+
+class RefreshResult(BaseModel):
+    """批次重新驗證時單台機器的結果 (NDJSON 的一行)"""
+    serial: str
+    previous_status: Optional[MachineStatus] = None
+    status: Optional[MachineStatus] = None
+    changed: bool = False
+    skipped: bool = False  # 借用中或重啟中的機器不檢查
+    error: Optional[str] = None
+    duration_ms: float = 0.0
+
 class ReleaseResponse(BaseModel):
     """API 回傳給前端的統一格式"""
     status: ReleaseResult
@@ -0,0 +1,26 @@
+from datetime import datetime
+from typing import Optional
+
+from pydantic import BaseModel, ConfigDict, Field
+
+
+class PoolSettings(BaseModel):
+    """單一 pool (vendor/model/version) 的調度設定"""
+    model_config = ConfigDict(extra="forbid")
+
+    allocation_policy: str = "first"  # 借用時挑選機器的策略，見 app.services.allocator
+    hot_spares: int = Field(0, ge=0)  # 需要維持幾台驗證過 (ping + serial) 的可用機器
+    spare_max_age: float = Field(600, gt=0)  # 驗證結果的有效秒數，過期就重新驗證
+    spare_auto_reset: bool = False  # 閒置機器驗證失敗 (SSH 讀不到序號) 時主動重置
+
+
+class HotSpareStatus(BaseModel):
+    """單一 pool 的 hot spare 狀況"""
+    vendor: str
+    model: str
+    version: str
+    target: int
+    verified: int  # 驗證未過期的 AVAILABLE 機器數
+    available: int
+    deficit: int
+    oldest_verified_at: Optional[datetime] = None
@@ -0,0 +1,27 @@
+import ipaddress
+from typing import Optional
+
+from pydantic import BaseModel, ConfigDict, field_validator
+
+
+class ReservationQuery(BaseModel):
+    """
+    以條件借用機器：vendor / model / version 可用 glob (例如 "n9k*")，
+    版本範圍與機器屬性條件可同時指定，所有條件都必須符合。
+    """
+    model_config = ConfigDict(extra="forbid")
+
+    vendor: str = "*"
+    model: str = "*"
+    version: str = "*"
+    min_version: Optional[str] = None  # 含此版本，例如 "9.3" 符合 "9.3(13)"
+    max_version: Optional[str] = None  # 含此版本
+    hostname_prefix: Optional[str] = None
+    subnet: Optional[str] = None  # mgmt_ip 所在網段，例如 "10.192.4.0/24"
+
+    @field_validator("subnet")
+    @classmethod
+    def _valid_subnet(cls, value: Optional[str]) -> Optional[str]:
+        if value is not None:
+            ipaddress.ip_network(value, strict=False)
+        return value
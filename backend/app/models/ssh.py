@@ -0,0 +1,13 @@
+from pydantic import BaseModel
+
+
+class SSHPoolStats(BaseModel):
+    """SSH session 的使用狀況；queued 持續偏高代表 SSH_MAX_WORKERS 不足"""
+    max_workers: int
+    running: int
+    queued: int
+    submitted: int
+    completed: int
+    cancelled: int
+    mean_wait_ms: float
+    max_wait_ms: float
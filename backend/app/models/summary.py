@@ -0,0 +1,10 @@
+from typing import Dict
+
+from pydantic import BaseModel
+
+
+class MachineSummary(BaseModel):
+    """各分類的機器數量；vendors 為 vendor → model → version → status → 數量"""
+    total: int
+    by_status: Dict[str, int]
+    vendors: Dict[str, Dict[str, Dict[str, Dict[str, int]]]]
@@ -0,0 +1,35 @@
+from datetime import datetime
+from typing import Dict
+
+from pydantic import BaseModel
+
+
+class RouteLatency(BaseModel):
+    """單一 route 的延遲統計 (p50 / p95 以最近的樣本計算)"""
+    method: str
+    route: str
+    count: int
+    mean_ms: float
+    p50_ms: float
+    p95_ms: float
+    max_ms: float
+
+
+class SlowRequest(BaseModel):
+    """超過門檻的 request 與各階段耗時 (lock / probe / ssh / serialize)"""
+    timestamp: datetime
+    method: str
+    route: str
+    path: str
+    status_code: int
+    duration_ms: float
+    phases_ms: Dict[str, float] = {}
+
+
+class LoopLagStats(BaseModel):
+    """Event loop 排程延遲；stalls 為超過門檻並記錄 stack 的次數"""
+    running: bool
+    threshold_ms: float
+    last_lag_ms: float
+    max_lag_ms: float
+    stalls: int
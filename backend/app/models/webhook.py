@@ -0,0 +1,30 @@
+from typing import Dict, List, Optional
+
+from pydantic import BaseModel, ConfigDict, Field
+
+from app.models.machine import MachineStatus
+
+
+class WebhookSubscription(BaseModel):
+    """webhooks.yaml 中的一個訂閱"""
+    model_config = ConfigDict(extra="forbid")
+
+    name: str = Field(min_length=1)
+    url: str = Field(min_length=1)
+    # vendor/model/version 的 glob (例如 "cisco/n9k/*")；空白表示所有 pool
+    pools: List[str] = Field(default_factory=list)
+    # 只通知轉換到這些狀態的事件；空白表示所有狀態
+    statuses: List[MachineStatus] = Field(default_factory=list)
+    headers: Dict[str, str] = Field(default_factory=dict)
+
+
+class WebhookStats(BaseModel):
+    """單一訂閱的投遞狀況"""
+    name: str
+    url: str
+    buffered: int  # 記憶體中等待批次送出的事件數
+    spooled: int  # 送不出去、暫存在磁碟上的批次數
+    delivered_events: int
+    failed_attempts: int
+    dropped_events: int  # 緩衝區或磁碟佇列已滿、或對方以 4xx 拒絕而丟棄的事件數
+    last_error: Optional[str] = None
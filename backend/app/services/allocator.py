@@ -0,0 +1,90 @@
+import random
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from typing import Dict, List, Type
+
+from app.models.machine import Machine
+
+_EPOCH = datetime.fromtimestamp(0, tz=timezone.utc)
+
+
+class AllocationPolicy(ABC):
+    """
+    借用時的機器挑選策略。
+    order() 回傳候選機器的嘗試順序，reserve_machine 會依序嘗試直到成功。
+    """
+
+    name = ""
+
+    @abstractmethod
+    def order(self, candidates: List[Machine]) -> List[Machine]:
+        """回傳候選機器的嘗試順序"""
+
+
+class FirstAvailablePolicy(AllocationPolicy):
+    """設定檔順序 (原本的行為)"""
+
+    name = "first"
+
+    def order(self, candidates: List[Machine]) -> List[Machine]:
+        return list(candidates)
+
+
+class LeastRecentlyUsedPolicy(AllocationPolicy):
+    """最久沒被借用的機器優先，從未借出的機器最優先"""
+
+    name = "least_recently_used"
+
+    def order(self, candidates: List[Machine]) -> List[Machine]:
+        return sorted(candidates, key=lambda m: m.last_reserved_at or _EPOCH)
+
+
+class FewestReservationsPolicy(AllocationPolicy):
+    """累計借用次數最少的機器優先 (wear leveling)"""
+
+    name = "fewest_reservations"
+
+    def order(self, candidates: List[Machine]) -> List[Machine]:
+        return sorted(candidates, key=lambda m: m.reservation_count)
+
+
+class FastestResetPolicy(AllocationPolicy):
+    """歷史重置時間最短的機器優先，沒有紀錄的機器排在最後"""
+
+    name = "fastest_reset"
+
+    def order(self, candidates: List[Machine]) -> List[Machine]:
+        return sorted(
+            candidates,
+            key=lambda m: (m.avg_reboot_seconds is None, m.avg_reboot_seconds or 0.0),
+        )
+
+
+class RandomPolicy(AllocationPolicy):
+    name = "random"
+
+    def order(self, candidates: List[Machine]) -> List[Machine]:
+        shuffled = list(candidates)
+        random.shuffle(shuffled)
+        return shuffled
+
+
+POLICIES: Dict[str, Type[AllocationPolicy]] = {
+    policy.name: policy
+    for policy in (
+        FirstAvailablePolicy,
+        LeastRecentlyUsedPolicy,
+        FewestReservationsPolicy,
+        FastestResetPolicy,
+        RandomPolicy,
+    )
+}
+
+
+def get_policy(name: str) -> AllocationPolicy:
+    policy = POLICIES.get(name)
+    if policy is None:
+        raise ValueError(
+            f"Unknown allocation policy '{name}'. Available: {', '.join(POLICIES)}"
+        )
+    return policy()
@@ -0,0 +1,223 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+
+from app.models.analytics import PoolUtilization
+from app.models.history import StatusTransition
+from app.models.machine import Machine, MachineStatus
+from app.services.state_store import PoolCounter, StateStore
+
+logger = logging.getLogger(__name__)
+
+PoolKey = Tuple[str, str, str]
+
+# 狀態時間的指標名稱為 "status:<status>"，其餘指標與 _Bucket 的欄位同名
+_STATUS_PREFIX = "status:"
+
+
+class _Bucket:
+    """單一 pool 一分鐘內的累計數據"""
+
+    __slots__ = (
+        "minute",
+        "status_seconds",
+        "reserve_success",
+        "reserve_not_found",
+        "recoveries",
+        "recovery_seconds",
+    )
+
+    def __init__(self, minute: int):
+        self.minute = minute
+        self.status_seconds: Dict[MachineStatus, float] = {}
+        self.reserve_success = 0
+        self.reserve_not_found = 0
+        self.recoveries = 0
+        self.recovery_seconds = 0.0
+
+    def add(self, metric: str, value: float) -> None:
+        if metric.startswith(_STATUS_PREFIX):
+            status = MachineStatus(metric[len(_STATUS_PREFIX):])
+            self.status_seconds[status] = self.status_seconds.get(status, 0.0) + value
+        else:
+            current = getattr(self, metric)
+            setattr(self, metric, current + (round(value) if isinstance(current, int) else value))
+
+
+class PoolAnalytics:
+    """
+    以每分鐘一個 bucket 累計各 pool 的使用狀況，查詢時只加總視窗內的 bucket。
+    - 狀態時間: 定期取樣目前的機器狀態 (含其他 worker 寫入共用 store 的狀態)
+    - 借用成功 / 404: 由 reserve_machine 通知
+    - release 後恢復可用的時間: 由狀態變更推算
+    共用 StateStore 時各 worker 把本地累計的增量寫入 store，查詢時讀取所有 worker 的合計；
+    狀態時間只由 leader 取樣，避免每個 worker 重複計算。
+    """
+
+    def __init__(self, retention_minutes: int = 7 * 24 * 60, store: Optional[StateStore] = None):
+        self.retention_minutes = retention_minutes
+        self.store = store if store is not None and store.shared else None
+        self._buckets: Dict[PoolKey, Deque[_Bucket]] = {}
+        self._last_sample: Optional[float] = None
+        self._released_at: Dict[str, float] = {}
+        # 尚未寫入共用 store 的增量: (minute, pool, metric) -> value
+        self._pending: Dict[Tuple[int, PoolKey, str], float] = {}
+
+    @classmethod
+    def from_counters(cls, counters: Iterable[PoolCounter], retention_minutes: int) -> "PoolAnalytics":
+        """由 store 中的合計 (依 minute 排序) 建立唯讀的統計"""
+        analytics = cls(retention_minutes)
+        for minute, vendor, model, version, metric, value in counters:
+            analytics._bucket((vendor, model, version), minute * 60).add(metric, value)
+        return analytics
+
+    def _add(self, pool: PoolKey, now: float, metric: str, value: float) -> None:
+        bucket = self._bucket(pool, now)
+        bucket.add(metric, value)
+        if self.store is not None:
+            key = (bucket.minute, pool, metric)
+            self._pending[key] = self._pending.get(key, 0.0) + value
+
+    def _bucket(self, pool: PoolKey, now: float) -> _Bucket:
+        minute = int(now // 60)
+        buckets = self._buckets.get(pool)
+        if buckets is None:
+            buckets = self._buckets[pool] = deque()
+        if not buckets or buckets[-1].minute != minute:
+            buckets.append(_Bucket(minute))
+            while buckets[0].minute <= minute - self.retention_minutes:
+                buckets.popleft()
+        return buckets[-1]
+
+    def pause_sampling(self) -> None:
+        """不是 leader 時呼叫，重新取得 leader 後不把中間的時間算進來"""
+        self._last_sample = None
+
+    def sample(self, machines: List[Machine], now: Optional[float] = None, max_gap: float = 60) -> None:
+        """把距離上次取樣的時間累加到每台機器目前的狀態上"""
+        now = now if now is not None else time.time()
+        if self._last_sample is None:
+            self._last_sample = now
+            return
+        elapsed = min(max(now - self._last_sample, 0.0), max_gap)
+        self._last_sample = now
+        if not elapsed:
+            return
+        for machine in machines:
+            self._add(
+                (machine.vendor, machine.model, machine.version), now,
+                _STATUS_PREFIX + machine.status.value, elapsed,
+            )
+
+    def record_reserve(
+        self, vendor: str, model: str, version: str, success: bool, now: Optional[float] = None
+    ) -> None:
+        self._add(
+            (vendor, model, version), now if now is not None else time.time(),
+            "reserve_success" if success else "reserve_not_found", 1,
+        )
+
+    def on_transition(self, transition: StatusTransition) -> None:
+        ts = transition.timestamp.timestamp()
+        serial = transition.serial
+        if transition.to_status == MachineStatus.REBOOTING:
+            self._released_at[serial] = ts
+        elif transition.from_status == MachineStatus.REBOOTING:
+            # release 發生在其他 worker 時，以第一次觀察到重啟的時間近似
+            self._released_at.setdefault(serial, ts)
+
+        if transition.to_status == MachineStatus.AVAILABLE and serial in self._released_at:
+            pool = (transition.vendor, transition.model, transition.version)
+            self._add(pool, ts, "recoveries", 1)
+            self._add(pool, ts, "recovery_seconds", ts - self._released_at.pop(serial))
+        elif transition.to_status == MachineStatus.UNAVAILABLE:
+            self._released_at.pop(serial, None)
+
+    def summarize(self, window_minutes: int, now: Optional[float] = None) -> List[PoolUtilization]:
+        now = now if now is not None else time.time()
+        first_minute = int(now // 60) - window_minutes + 1
+        summary = []
+        for (vendor, model, version), buckets in sorted(self._buckets.items()):
+            status_seconds: Dict[MachineStatus, float] = {}
+            success = not_found = recoveries = 0
+            recovery_seconds = 0.0
+            # bucket 依時間排序，從最新的往回加總到視窗起點即可
+            for bucket in reversed(buckets):
+                if bucket.minute < first_minute:
+                    break
+                for status, seconds in bucket.status_seconds.items():
+                    status_seconds[status] = status_seconds.get(status, 0.0) + seconds
+                success += bucket.reserve_success
+                not_found += bucket.reserve_not_found
+                recoveries += bucket.recoveries
+                recovery_seconds += bucket.recovery_seconds
+
+            total = sum(status_seconds.values())
+            requests = success + not_found
+            summary.append(PoolUtilization(
+                vendor=vendor,
+                model=model,
+                version=version,
+                window_minutes=window_minutes,
+                machine_seconds=round(total, 1),
+                occupancy=round(status_seconds.get(MachineStatus.UNAVAILABLE, 0.0) / total, 4) if total else None,
+                status_seconds={s.value: round(v, 1) for s, v in status_seconds.items()},
+                unreachable_seconds=round(status_seconds.get(MachineStatus.UNREACHABLE, 0.0), 1),
+                reserve_requests=requests,
+                reserve_success=success,
+                reserve_not_found=not_found,
+                reserve_success_rate=round(success / requests, 4) if requests else None,
+                recoveries=recoveries,
+                mean_time_to_available=round(recovery_seconds / recoveries, 1) if recoveries else None,
+            ))
+        return summary
+
+    async def flush(self) -> None:
+        """把本地的增量寫入共用 store (失敗時保留到下次)"""
+        if self.store is None or not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        counters = [
+            (minute, *pool, metric, value) for (minute, pool, metric), value in pending.items()
+        ]
+        oldest = int(time.time() // 60) - self.retention_minutes + 1
+        try:
+            await self.store.add_pool_counters(counters, oldest)
+        except Exception:
+            for key, value in pending.items():
+                self._pending[key] = self._pending.get(key, 0.0) + value
+            raise
+
+    async def report(self, window_minutes: int, now: Optional[float] = None) -> List[PoolUtilization]:
+        """API 使用：共用 store 時回傳所有 worker 的合計，否則為本 process 的統計"""
+        window_minutes = min(window_minutes, self.retention_minutes)
+        if self.store is None:
+            return self.summarize(window_minutes, now)
+        await self.flush()
+        now = now if now is not None else time.time()
+        counters = await self.store.pool_counters(int(now // 60) - window_minutes + 1)
+        return PoolAnalytics.from_counters(counters, self.retention_minutes).summarize(window_minutes, now)
+
+
+async def sample_pool_analytics(manager, analytics: PoolAnalytics, elector=None):
+    """背景任務：leader 定期取樣機器狀態，每個 worker 定期把本地的統計寫入共用 store"""
+    INTERVAL = 10
+    while True:
+        try:
+            if elector is None or elector.is_leader:
+                analytics.sample(await manager.get_machines())
+            else:
+                analytics.pause_sampling()
+            await analytics.flush()
+            await asyncio.sleep(INTERVAL)
+        except asyncio.CancelledError:
+            try:
+                await analytics.flush()  # 停止前寫入剩餘的增量
+            except Exception as e:
+                logger.error(f"Failed to flush pool analytics: {e}")
+            break
+        except Exception as e:
+            logger.error(f"Analytics sampler error: {e}")
+            await asyncio.sleep(INTERVAL)
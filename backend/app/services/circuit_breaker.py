@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, Optional
+
+from app.models.machine import CircuitState, Machine
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """設備的 circuit 為 open (或 half-open 的試探正在進行)，不嘗試連線"""
+
+
+class _Circuit:
+    __slots__ = ("state", "failures", "opened_at", "trial_running")
+
+    def __init__(self):
+        self.state = CircuitState.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_running = False
+
+
+class CircuitBreaker:
+    """
+    依序號記錄 SSH 失敗，避免對 sshd 卡住的設備反覆等到 timeout。
+    - closed: 正常連線，連續失敗 failure_threshold 次後轉為 open
+    - open: 直接拋出 CircuitOpenError，cooldown 秒後轉為 half-open
+    - half-open: 只放行一次試探，成功回到 closed，失敗重新 open
+    狀態同步寫到 Machine.circuit_state / circuit_retry_at。
+    """
+
+    def __init__(self, failure_threshold: int = 3, cooldown: float = 60):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._circuits: Dict[str, _Circuit] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.failure_threshold > 0
+
+    def _circuit(self, serial: str) -> _Circuit:
+        circuit = self._circuits.get(serial)
+        if circuit is None:
+            circuit = self._circuits[serial] = _Circuit()
+        if circuit.state == CircuitState.OPEN and time.monotonic() - circuit.opened_at >= self.cooldown:
+            circuit.state = CircuitState.HALF_OPEN
+        return circuit
+
+    def state(self, serial: str) -> CircuitState:
+        return self._circuit(serial).state
+
+    def _publish(self, machine: Machine, circuit: _Circuit) -> None:
+        machine.circuit_state = circuit.state
+        if circuit.state == CircuitState.OPEN:
+            remaining = max(self.cooldown - (time.monotonic() - circuit.opened_at), 0.0)
+            machine.circuit_retry_at = datetime.now(timezone.utc) + timedelta(seconds=remaining)
+        else:
+            machine.circuit_retry_at = None
+
+    def _open(self, machine: Machine, circuit: _Circuit) -> None:
+        circuit.state = CircuitState.OPEN
+        circuit.opened_at = time.monotonic()
+        logger.warning(
+            f"[{machine.serial}] SSH circuit opened after {circuit.failures} failures; "
+            f"retrying in {self.cooldown:.0f}s."
+        )
+
+    @contextmanager
+    def guard(self, machine: Machine) -> Iterator[None]:
+        """
+        包住一次 SSH 操作：區塊正常結束記為成功，拋出例外記為失敗
+        (被取消不計)。circuit 不允許連線時立即拋出 CircuitOpenError。
+        """
+        if not self.enabled:
+            yield
+            return
+
+        circuit = self._circuit(machine.serial)
+        trial = False
+        if circuit.state == CircuitState.OPEN or (
+            circuit.state == CircuitState.HALF_OPEN and circuit.trial_running
+        ):
+            self._publish(machine, circuit)
+            raise CircuitOpenError(f"SSH circuit for {machine.serial} is {circuit.state.value}")
+        if circuit.state == CircuitState.HALF_OPEN:
+            trial = circuit.trial_running = True
+        self._publish(machine, circuit)
+
+        try:
+            yield
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            circuit.failures += 1
+            if trial or circuit.failures >= self.failure_threshold:
+                self._open(machine, circuit)
+            raise
+        else:
+            if circuit.state != CircuitState.CLOSED:
+                logger.info(f"[{machine.serial}] SSH circuit closed.")
+            circuit.state = CircuitState.CLOSED
+            circuit.failures = 0
+        finally:
+            if trial:
+                circuit.trial_running = False
+            self._publish(machine, circuit)
+
+    def reset(self, serial: Optional[str] = None) -> None:
+        """清除單台 (或全部) 設備的失敗紀錄"""
+        if serial is None:
+            self._circuits.clear()
+        else:
+            self._circuits.pop(serial, None)
@@ -1,15 +1,49 @@
 import asyncio
+import codecs
 import logging
+import math
+import os
 import re
 import shutil
+import signal
 import subprocess
-from typing import Optional, Tuple
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, Optional, Pattern, Tuple
 
 from app.core.config import get_settings
+from app.core.timing import timed
 from app.models.machine import Machine
+from app.services.circuit_breaker import CircuitBreaker, CircuitOpenError
+from app.services.rtt import RttEstimator
+from app.services.ssh_executor import PRIORITY_RESET, PRIORITY_VERIFY, SSHExecutor
 
 logger = logging.getLogger(__name__)
 
+# 各型號 inventory 輸出中序號的位置
+_SERIAL_PATTERNS: dict[Tuple[str, str], Pattern[str]] = {
+    ("cisco", "n9k"): re.compile(r'NAME:\s*"Chassis".*?SN:\s*([A-Z0-9]+)', re.I | re.S),
+    ("cisco", "c8k"): re.compile(r'NAME:\s*"Chassis".*?SN:\s*([A-Z0-9]+)', re.I | re.S),
+    ("cisco", "xrv"): re.compile(r'NAME:\s*"Rack 0".*?SN:\s*([A-Z0-9]+)', re.I | re.S),
+    # Comware: display device manuinfo → DEVICE_SERIAL_NUMBER
+    ("hp", "5945"): re.compile(r'DEVICE_SERIAL_NUMBER\s*:\s*([A-Z0-9]+)', re.I),
+}
+
+# reload 確認提示已被回答 (例如 NX-OS: "(y/n)?  [n] y")，之後機器就會開始重啟
+_RELOAD_ACK_PATTERN = re.compile(r"\(y/n\)\?\s*(?:\[n\])?\s*y\b", re.I)
+
+# ping 輸出中的單一封包 RTT，例如 "time=0.045 ms" 或 "time<1 ms"
+_PING_RTT_PATTERN = re.compile(r"time[=<]\s*([\d.]+)\s*ms")
+
+_SSH_OPTS = [
+    "-o", "StrictHostKeyChecking=no",
+    "-o", "UserKnownHostsFile=/dev/null",
+    "-o", "HostKeyAlgorithms=+ssh-rsa",
+    "-o", "PubkeyAcceptedKeyTypes=+ssh-rsa",
+    "-o", "KexAlgorithms=+diffie-hellman-group14-sha1",
+]
+
 class DeviceConnector:
     """負責處理與設備的底層連線 (SSH, Ping)。"""
 
@@ -22,6 +56,140 @@ class DeviceConnector:
         # 預載入憑證
         self.credentials, self.default_cred = self.settings.load_credentials()
 
+        # 限制同時進行的 SSH session 數量，重置優先於背景驗證
+        self.ssh_pool = SSHExecutor(max_workers=self.settings.SSH_MAX_WORKERS)
+
+        # sshd 卡住的設備連續失敗後暫停連線，不再每次等到 timeout
+        self.breaker = CircuitBreaker(
+            failure_threshold=self.settings.SSH_BREAKER_THRESHOLD,
+            cooldown=self.settings.SSH_BREAKER_COOLDOWN,
+        )
+
+        # Ping 逾時依各 IP 的 RTT 調整；連續 k-of-n 掉包才判定為不可達
+        self.ping_hedge = self.settings.PING_HEDGE
+        self.ping_loss_window = max(self.settings.PING_LOSS_WINDOW, 1)
+        self.ping_loss_threshold = min(max(self.settings.PING_LOSS_THRESHOLD, 1), self.ping_loss_window)
+        self._rtt: Dict[str, RttEstimator] = {}
+
+        # 每台設備一個 ControlMaster 連線，後續 session 不必重新 handshake
+        self.control_persist = self.settings.SSH_CONTROL_PERSIST
+        self.control_dir: Optional[Path] = None
+        self._master_locks: Dict[str, asyncio.Lock] = {}
+        if self.control_persist > 0:
+            self.control_dir = self._prepare_control_dir(self.settings.SSH_CONTROL_DIR)
+
+    @staticmethod
+    def _prepare_control_dir(directory: Optional[Path]) -> Optional[Path]:
+        """control socket 等同已登入的連線，目錄只允許自己存取"""
+        try:
+            if directory is None:
+                return Path(tempfile.mkdtemp(prefix="stlb-ssh-"))
+            directory.mkdir(parents=True, exist_ok=True)
+            directory.chmod(0o700)
+            return directory
+        except OSError as e:
+            logger.warning(f"SSH connection sharing disabled: {e}")
+            return None
+
+    def _control_path(self, machine: Machine) -> Optional[Path]:
+        if self.control_dir is None:
+            return None
+        # unix socket 路徑長度有限 (約 100 bytes)，只用序號與 IP
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", f"{machine.serial}-{machine.mgmt_ip}")
+        return self.control_dir / name
+
+    async def _ensure_master(
+        self, machine: Machine, username: str, password: str, timeout: float
+    ) -> list[str]:
+        """
+        確保設備的 master 連線存在，回傳 session 要加上的 ssh 選項。
+        master 無法建立時回傳空 list，session 會自行建立連線。
+        """
+        path = self._control_path(machine)
+        if path is None:
+            return []
+
+        lock = self._master_locks.setdefault(machine.serial, asyncio.Lock())
+        async with lock:
+            if not path.exists():
+                # -f: 認證完成後轉到背景，-N: 不執行指令，只提供連線給後續 session
+                cmd = [
+                    "sshpass", "-p", password, "ssh", *_SSH_OPTS,
+                    "-o", "ControlMaster=yes",
+                    "-o", f"ControlPath={path}",
+                    "-o", f"ControlPersist={self.control_persist}",
+                    "-M", "-N", "-f", f"{username}@{machine.mgmt_ip}",
+                ]
+                returncode = await self._run_quiet(cmd, timeout)
+                if returncode != 0 or not path.exists():
+                    logger.warning(
+                        f"[{machine.serial}] SSH master connection failed (rc={returncode}); "
+                        "using a direct session."
+                    )
+                    return []
+
+        # socket 失效時 ssh 會直接建立新連線，不會卡住 (之後由 _check_master 清除)
+        return ["-o", "ControlMaster=no", "-o", f"ControlPath={path}"]
+
+    async def _check_master(self, machine: Machine) -> None:
+        """session 無法使用 master 時確認其狀態，已失效就移除 socket，下一個 session 會重建"""
+        path = self._control_path(machine)
+        if path is None or not path.exists():
+            return
+        returncode = await self._run_quiet(
+            ["ssh", "-o", f"ControlPath={path}", "-O", "check", machine.mgmt_ip], timeout=5
+        )
+        if returncode != 0:
+            logger.info(f"[{machine.serial}] Removing stale SSH control socket.")
+            path.unlink(missing_ok=True)
+
+    async def close_master(self, machine: Machine) -> None:
+        """設備移除、位址變更或重啟後關閉其 master 連線"""
+        path = self._control_path(machine)
+        self._master_locks.pop(machine.serial, None)
+        if path is None or not path.exists():
+            return
+        await self._run_quiet(
+            ["ssh", "-o", f"ControlPath={path}", "-O", "exit", machine.mgmt_ip], timeout=5
+        )
+        path.unlink(missing_ok=True)
+
+    async def close(self) -> None:
+        """關閉所有 master 連線並移除 control socket 目錄 (shutdown 時呼叫)"""
+        if self.control_dir is None:
+            return
+        for path in self.control_dir.iterdir():
+            await self._run_quiet(
+                ["ssh", "-o", f"ControlPath={path}", "-O", "exit", "localhost"], timeout=5
+            )
+            path.unlink(missing_ok=True)
+        if self.settings.SSH_CONTROL_DIR is None:
+            shutil.rmtree(self.control_dir, ignore_errors=True)
+
+    @staticmethod
+    async def _run_quiet(cmd: list[str], timeout: float) -> Optional[int]:
+        """執行不需要輸出的指令，回傳 returncode；timeout 或無法執行時回傳 None"""
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.DEVNULL,
+                start_new_session=True,
+            )
+        except OSError as e:
+            logger.error(f"Failed to run {cmd[0]}: {e}")
+            return None
+        try:
+            return await asyncio.wait_for(proc.wait(), timeout)
+        except asyncio.TimeoutError:
+            try:
+                os.killpg(proc.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            await proc.wait()
+            return None
+
     def _get_auth(self, serial: str) -> Tuple[str, str]:
         cred = self.credentials.get(serial) or self.default_cred
         if not cred:
@@ -35,22 +203,93 @@ class DeviceConnector:
 
         return username, password
 
+    def rtt_estimator(self, ip: str) -> RttEstimator:
+        estimator = self._rtt.get(ip)
+        if estimator is None:
+            estimator = self._rtt[ip] = RttEstimator(
+                initial_timeout=self.settings.PING_INITIAL_TIMEOUT_MS / 1000,
+                min_timeout=self.settings.PING_MIN_TIMEOUT_MS / 1000,
+                max_timeout=self.settings.PING_MAX_TIMEOUT_MS / 1000,
+                loss_window=self.ping_loss_window,
+            )
+        return estimator
+
+    @staticmethod
+    async def _ping_once(ip: str, timeout: float) -> Optional[float]:
+        """送出一個 ICMP echo，回傳 RTT 秒數；逾時或失敗回傳 None"""
+        started = time.monotonic()
+        # -W 只接受整數秒 (舊版 iputils)，實際逾時由 asyncio.wait_for 控制
+        proc = await asyncio.create_subprocess_exec(
+            "ping", "-c", "1", "-W", str(max(1, math.ceil(timeout))), ip,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        try:
+            stdout, _ = await asyncio.wait_for(proc.communicate(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            if proc.returncode is None:
+                proc.kill()
+                await asyncio.shield(proc.wait())
+        if proc.returncode != 0:
+            return None
+        match = _PING_RTT_PATTERN.search(stdout.decode(errors="replace"))
+        return float(match.group(1)) / 1000 if match else time.monotonic() - started
+
+    async def _probe(self, ip: str, estimator: RttEstimator) -> Optional[float]:
+        """
+        一次探測：第一個封包超過 hedge_delay 仍未回應時再送一個，任一個回應即成功。
+        每個封包各自的逾時為 estimator.timeout。
+        """
+        pending = {asyncio.create_task(self._ping_once(ip, estimator.timeout))}
+        hedge_at: Optional[float] = estimator.hedge_delay if self.ping_hedge else None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=hedge_at, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    rtt = task.result()
+                    if rtt is not None:
+                        return rtt
+                if hedge_at is not None:
+                    hedge_at = None
+                    if pending:  # 第一個封包遲到
+                        pending.add(asyncio.create_task(self._ping_once(ip, estimator.timeout)))
+            return None
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
     async def is_reachable(self, ip: str) -> bool:
-        """非同步 Ping 檢查"""
-        # 使用 asyncio.create_subprocess_exec 進行真正的非同步呼叫
+        """
+        非同步 Ping 檢查。
+        逾時依該 IP 的 RTT 估計；最近 PING_LOSS_WINDOW 次中掉包達 PING_LOSS_THRESHOLD 次
+        才回傳 False，未達門檻前立即重試，偶發的掉包不會造成 UNREACHABLE。
+        """
+        estimator = self.rtt_estimator(ip)
+        # 逾時加倍只在這次檢查內有效，持續不通的主機每次仍以 RTO 開始
+        estimator.reset_backoff()
         try:
-            proc = await asyncio.create_subprocess_exec(
-                "ping", "-c", "1", "-W", "1", ip,
-                stdout=asyncio.subprocess.DEVNULL,
-                stderr=asyncio.subprocess.DEVNULL
-            )
-            await proc.wait()
-            return proc.returncode == 0
+            with timed("probe"):
+                while True:
+                    rtt = await self._probe(ip, estimator)
+                    if rtt is not None:
+                        estimator.observe(rtt)
+                        return True
+                    estimator.observe_loss()
+                    if estimator.losses >= self.ping_loss_threshold:
+                        return False
         except Exception as e:
             logger.error(f"Ping error for {ip}: {e}")
             return False
 
-    async def get_serial_via_ssh(self, machine: Machine) -> Optional[str]:
+    async def get_serial_via_ssh(
+        self, machine: Machine, priority: int = PRIORITY_VERIFY
+    ) -> Optional[str]:
         """透過 SSH 取得設備序號 (非阻塞)"""
         user, password = self._get_auth(machine.serial)
         if not password:
@@ -61,10 +300,13 @@ class DeviceConnector:
         if not cmd_list:
             return None
 
-        # 在 Thread Pool 中執行 Blocking 的 SSH 呼叫
-        output = await asyncio.to_thread(
-            self._ssh_exec, machine, user, password, cmd_list
-        )
+        # 讀到序號就提早結束連線；circuit open 時拋出 CircuitOpenError，不佔用 SSH slot
+        with self.breaker.guard(machine), timed("ssh"):
+            output = await self.ssh_pool.run(
+                self._ssh_exec, machine, user, password, cmd_list,
+                until=self._get_serial_stop_pattern(machine.vendor, machine.model),
+                priority=priority,
+            )
         
         if not output:
             return None
@@ -79,11 +321,16 @@ class DeviceConnector:
             restore_cmds = ["copy initial.cfg startup-config", "", "exit"]
             
             try:
-                output = await asyncio.to_thread(
-                    self._ssh_exec, machine, user, password, restore_cmds, timeout=8
-                )
+                with self.breaker.guard(machine), timed("ssh"):
+                    output = await self.ssh_pool.run(
+                        self._ssh_exec, machine, user, password, restore_cmds,
+                        timeout=8, priority=PRIORITY_RESET,
+                    )
                 logger.info(f"[{machine.serial}] Restore Config Output:\n{output}")
                 
+            except CircuitOpenError as e:
+                logger.warning(f"[{machine.serial}] Skipping reset: {e}")
+                return False
             except Exception as e:
                 logger.error(f"[{machine.serial}] Failed to restore config: {e}")
                 return False
@@ -91,14 +338,20 @@ class DeviceConnector:
             reload_cmds = ["reload", "y", ""]
             
             # N9K reload 會導致連線中斷，這是預期的
+            # 看到確認提示被回答或連線關閉 (EOF) 就視為成功，不必等到 timeout
             try:
-                await asyncio.to_thread(
-                    self._ssh_exec, machine, user, password, reload_cmds, timeout=8
-                )
-            except subprocess.TimeoutExpired:
-                # 這是成功路徑：因為指令送出後機器重啟，導致 SSH 卡住直到 Timeout
-                logger.info(f"[{machine.serial}] Reload command sent successfully (timeout expected).")
-                return True
+                with self.breaker.guard(machine), timed("ssh"):
+                    try:
+                        await self.ssh_pool.run(
+                            self._ssh_exec, machine, user, password, reload_cmds,
+                            timeout=8, until=_RELOAD_ACK_PATTERN, priority=PRIORITY_RESET,
+                        )
+                    except subprocess.TimeoutExpired:
+                        # 這是成功路徑：因為指令送出後機器重啟，導致 SSH 卡住直到 Timeout
+                        # (在 guard 內處理，不計為 circuit 失敗)
+                        logger.info(f"[{machine.serial}] Reload command sent successfully (timeout expected).")
+                        return True
+                logger.info(f"[{machine.serial}] Reload command acknowledged.")
             except Exception as e:
                 logger.error(f"[{machine.serial}] Reload failed: {e}")
                 return False
@@ -108,7 +361,15 @@ class DeviceConnector:
             
         return True
 
-    def _ssh_exec(self, machine: Machine, username: str, password: str, commands: list[str], timeout: int = 10) -> str:
+    async def _ssh_exec(
+        self,
+        machine: Machine,
+        username: str,
+        password: str,
+        commands: list[str],
+        timeout: int = 10,
+        until: Optional[Pattern[str]] = None,
+    ) -> str:
         """Execute the commands by using SSH to the machine
 
         Args:
@@ -117,51 +378,121 @@ class DeviceConnector:
             password (str): The SSH password
             commands (list[str]): The list of commands to execute
             timeout (int): Timeout in seconds for the SSH command
+            until (Pattern | None): Stop reading and close the session as soon
+                as this pattern matches the output received so far
 
         Returns:
             str: The output from the SSH command execution
         """
-        ssh_opts = [
-            "-o", "StrictHostKeyChecking=no",
-            "-o", "UserKnownHostsFile=/dev/null",
-            "-o", "HostKeyAlgorithms=+ssh-rsa",
-            "-o", "PubkeyAcceptedKeyTypes=+ssh-rsa",
-            "-o", "KexAlgorithms=+diffie-hellman-group14-sha1",
-        ]
+        # timeout 是整個指令的期限，建立 master 花掉的時間要從 session 的時間扣除
+        deadline = time.monotonic() + timeout
+        mux_opts = await self._ensure_master(machine, username, password, timeout)
+        ssh_opts = [*_SSH_OPTS, *mux_opts]
 
         # IOS-XR: 直接在命令行執行單個命令,不要用 -tt 和 stdin
         # 其他平台: 用 -tt + stdin 逐行送指令
         if machine.vendor.lower() == "cisco" and machine.model.lower() == "xrv":
             cmd = ["sshpass", "-p", password, "ssh", *ssh_opts,
                    f"{username}@{machine.mgmt_ip}", commands[0]]
-
-            result = subprocess.run(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                timeout=timeout,
-            )
+            input_text = None
         else:
             ssh_opts.append("-tt")
             cmd = ["sshpass", "-p", password, "ssh",
                    *ssh_opts, f"{username}@{machine.mgmt_ip}"]
             input_text = "\n".join(commands + [""])
 
-            result = subprocess.run(
-                cmd,
-                input=input_text,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                timeout=timeout,
-            )
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            # 不能拋出 TimeoutExpired：reload 會把它當成指令已送出
+            raise RuntimeError(f"SSH master setup used the whole {timeout}s timeout")
+        returncode, stdout, stderr = await self._stream_process(
+            cmd, input_text, remaining, until
+        )
 
-        if result.returncode != 0:
+        # ControlMaster=no 時 socket 失效只會印出錯誤並改為直接連線，master 不會自動重建
+        if mux_opts and (returncode == 255 or "Control socket connect" in stderr):
+            await self._check_master(machine)
+
+        if returncode not in (0, None):
             logger.warning("SSH returned %s, stderr=%s",
-                           result.returncode, result.stderr.strip())
+                           returncode, stderr.strip())
+
+        return stdout
+
+    @staticmethod
+    async def _stream_process(
+        cmd: list[str],
+        input_text: Optional[str],
+        timeout: float,
+        until: Optional[Pattern[str]] = None,
+    ) -> Tuple[Optional[int], str, str]:
+        """以串流方式讀取子行程輸出。
+
+        每收到一段 stdout 就比對 ``until``，一旦命中便立即結束連線，
+        不必等到 SSH session 結束或 timeout。提早結束時 returncode 為 ``None``。
+        超過 ``timeout`` 仍未結束則拋出 ``subprocess.TimeoutExpired``。
+        子行程在自己的 process group 中執行，提早結束、timeout 或呼叫端被取消時
+        整個 group (sshpass 與其 ssh 子行程) 都會被終止。
+        """
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.PIPE if input_text is not None else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=True,
+        )
+        stdout_chunks: list[str] = []
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        stderr_task = asyncio.ensure_future(proc.stderr.read())
 
-        return result.stdout
+        async def communicate() -> bool:
+            """寫入輸入並讀取輸出，回傳是否已命中 until"""
+            if input_text is not None:
+                try:
+                    proc.stdin.write(input_text.encode())
+                    await proc.stdin.drain()
+                    proc.stdin.close()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            while True:
+                data = await proc.stdout.read(4096)
+                if not data:
+                    break
+                stdout_chunks.append(decoder.decode(data))
+                if until is not None and until.search("".join(stdout_chunks)):
+                    return True
+
+            # 輸出已讀到 EOF，等待行程自然結束以取得 returncode
+            await proc.wait()
+            await stderr_task
+            return False
+
+        try:
+            # asyncio.timeout 需要 Python 3.11，這裡以 wait_for 支援 3.10
+            matched = await asyncio.wait_for(communicate(), timeout)
+        except asyncio.TimeoutError:
+            raise subprocess.TimeoutExpired(
+                cmd, timeout, output="".join(stdout_chunks)
+            ) from None
+        finally:
+            if proc.returncode is None:
+                try:
+                    os.killpg(proc.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                # 回收子行程，避免留下 zombie；被取消時也要等它結束
+                await asyncio.shield(proc.wait())
+            stderr_task.cancel()
+
+        stdout_chunks.append(decoder.decode(b"", final=True))
+        stderr = (
+            stderr_task.result().decode("utf-8", errors="replace")
+            if stderr_task.done() and not stderr_task.cancelled()
+            else ""
+        )
+        returncode = None if matched else proc.returncode
+        return returncode, "".join(stdout_chunks), stderr
 
     def _get_inventory_command(self, vendor: str, model: str) -> list[str]:
         mapping = {
@@ -172,33 +503,21 @@ class DeviceConnector:
         }
         return mapping.get((vendor.lower(), model.lower()), [])
 
-    def _parse_serial(self, vendor: str, model: str, output: str) -> str:
+    @staticmethod
+    def _get_serial_stop_pattern(vendor: str, model: str) -> Optional[Pattern[str]]:
+        """串流讀取時使用的序號比對：序號後面必須已經出現分隔字元，避免只讀到一半。"""
+        pattern = _SERIAL_PATTERNS.get((vendor, model))
+        if pattern is None:
+            return None
+        return re.compile(pattern.pattern + r"(?=[^A-Z0-9])", pattern.flags)
 
-        if vendor == "cisco" and model == "n9k":
-            m = re.search(
-                r'NAME:\s*"Chassis".*?SN:\s*([A-Z0-9]+)', output, re.I | re.S)
-            if m:
-                return m.group(1).strip()
-
-        elif vendor == "cisco" and model == "c8k":
-            m = re.search(
-                r'NAME:\s*"Chassis".*?SN:\s*([A-Z0-9]+)', output, re.I | re.S)
-            if m:
-                return m.group(1).strip()
-
-        elif vendor == "cisco" and model == "xrv":
-            m = re.search(
-                r'NAME:\s*"Rack 0".*?SN:\s*([A-Z0-9]+)', output, re.I | re.S)
-            if m:
-                return m.group(1).strip()
-
-        elif vendor == "hp" and model == "5945":
-            # Comware: display device manuinfo → DEVICE_SERIAL_NUMBER
-            m = re.search(r'DEVICE_SERIAL_NUMBER\s*:\s*([A-Z0-9]+)', output, re.I)
-            if m:
-                return m.group(1).strip()
-            
-        else:
+    def _parse_serial(self, vendor: str, model: str, output: str) -> str:
+        pattern = _SERIAL_PATTERNS.get((vendor, model))
+        if pattern is None:
             logger.warning(f"Serial parsing not implemented for {vendor}/{model}")
-            
+            return ""
+
+        m = pattern.search(output)
+        if m:
+            return m.group(1).strip()
         return ""
@@ -0,0 +1,57 @@
+import logging
+from collections import Counter
+from typing import Dict, Iterable
+
+from app.models.history import StatusTransition
+from app.models.machine import Machine, MachineStatus
+from app.models.summary import MachineSummary
+
+logger = logging.getLogger(__name__)
+
+# vendor → model → version → status → 數量
+Counts = Dict[str, Dict[str, Dict[str, Dict[str, int]]]]
+
+
+class MachineFacets:
+    """
+    依 vendor / model / version / status 分類的機器數量。
+    載入設定時重建一次，之後由狀態變更 listener 逐筆增減，查詢時不需走訪所有機器。
+    """
+
+    def __init__(self):
+        self._counts: Counts = {}
+        self._by_status: Counter = Counter()
+        self.total = 0
+
+    def rebuild(self, machines: Iterable[Machine]) -> None:
+        self._counts = {}
+        self._by_status = Counter()
+        self.total = 0
+        for machine in machines:
+            self.total += 1
+            self._add(machine.vendor, machine.model, machine.version, machine.status, 1)
+
+    def _add(self, vendor: str, model: str, version: str, status: MachineStatus, delta: int) -> None:
+        statuses = (
+            self._counts.setdefault(vendor, {}).setdefault(model, {}).setdefault(version, {})
+        )
+        count = statuses.get(status.value, 0) + delta
+        if count > 0:
+            statuses[status.value] = count
+        else:
+            statuses.pop(status.value, None)
+        self._by_status[status.value] += delta
+        if self._by_status[status.value] <= 0:
+            del self._by_status[status.value]
+
+    def on_transition(self, transition: StatusTransition) -> None:
+        pool = (transition.vendor, transition.model, transition.version)
+        self._add(*pool, transition.from_status, -1)
+        self._add(*pool, transition.to_status, 1)
+
+    def summary(self) -> MachineSummary:
+        return MachineSummary(
+            total=self.total,
+            by_status=dict(self._by_status),
+            vendors=self._counts,
+        )
@@ -0,0 +1,25 @@
+import asyncio
+import logging
+from typing import Optional
+
+from app.services.leader import LeaderElector
+from app.services.machine_manager import MachineManager
+
+logger = logging.getLogger(__name__)
+
+
+async def maintain_hot_spares(manager: MachineManager, elector: Optional[LeaderElector] = None):
+    """背景任務：定期補足各 pool 的已驗證 hot spare (僅 leader 執行)"""
+    INTERVAL = 30
+    logger.info("Hot spare maintainer started.")
+    while True:
+        try:
+            if elector is None or elector.is_leader:
+                await manager.maintain_hot_spares()
+            await asyncio.sleep(INTERVAL)
+        except asyncio.CancelledError:
+            logger.info("Hot spare maintainer stopped.")
+            break
+        except Exception as e:
+            logger.error(f"Hot spare maintainer error: {e}")
+            await asyncio.sleep(INTERVAL)
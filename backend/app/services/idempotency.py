@@ -0,0 +1,140 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Optional, Tuple
+
+from pydantic_core import to_jsonable_python
+
+from app.services.state_store import StateStore
+
+logger = logging.getLogger(__name__)
+
+
+class IdempotencyKeyConflict(Exception):
+    """同一個 Idempotency-Key 被用在不同的 request 上"""
+
+
+class _Entry:
+    __slots__ = ("fingerprint", "expires_at", "future")
+
+    def __init__(self, fingerprint: Hashable, expires_at: float, future: asyncio.Future):
+        self.fingerprint = fingerprint
+        self.expires_at = expires_at
+        self.future = future
+
+
+class IdempotencyCache:
+    """
+    以 Idempotency-Key 保存 reserve / release 的結果 (LRU + TTL，數量有上限)。
+    - 同一個 key 的重試直接回傳第一次的結果，不會再借出另一台機器
+    - 第一次還在執行中時，重試會等待同一個結果
+    - 失敗 (例外) 不保存，之後的重試會重新執行
+    StateStore 為共用 (多個 worker) 時，key 與結果 (JSON) 也登記在 store 中，
+    重試送到其他 worker 同樣回傳第一次的結果；第一次還在其他 worker 執行時輪詢等待。
+    """
+
+    PENDING_TTL = 300.0  # 執行中登記的保留秒數，執行的 process 當掉後重試可重新執行
+    POLL_INTERVAL = 0.2
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 3600, store: Optional[StateStore] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.store = store if store is not None and store.shared else None
+        self._owner = uuid.uuid4().hex
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+
+    def _evict(self, now: float) -> None:
+        # 依最後使用順序排列，從最舊的開始清掉過期或超過上限的項目
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if not entry.future.done():
+                break  # 執行中的項目不能丟，否則重試會重複執行
+            if entry.expires_at > now and len(self._entries) <= self.max_entries:
+                break
+            del self._entries[key]
+
+    async def run(
+        self,
+        key: str,
+        fingerprint: Hashable,
+        operation: Callable[[], Awaitable[Any]],
+    ) -> Tuple[Any, bool]:
+        """
+        執行 operation 或回傳先前的結果。
+        回傳 (result, replayed)；key 對應到不同 fingerprint 時拋出 IdempotencyKeyConflict。
+        """
+        now = time.monotonic()
+        entry = self._entries.get(key)
+        if entry is not None and entry.future.done() and entry.expires_at <= now:
+            del self._entries[key]
+            entry = None
+
+        if entry is not None:
+            if entry.fingerprint != fingerprint:
+                raise IdempotencyKeyConflict(key)
+            self._entries.move_to_end(key)
+            # shield: 重試的 client 斷線不應取消第一次的執行
+            return await asyncio.shield(entry.future), True
+
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._entries[key] = _Entry(fingerprint, now + self.ttl, future)
+        self._evict(now)
+        try:
+            if self.store is not None:
+                result, replayed = await self._run_shared(key, fingerprint, operation)
+            else:
+                result, replayed = await operation(), False
+        except BaseException as e:
+            self._entries.pop(key, None)
+            if isinstance(e, Exception):
+                future.set_exception(e)
+                # 沒有其他重試在等待時避免 "exception was never retrieved" 警告
+                future.exception()
+            else:
+                future.cancel()
+            raise
+        future.set_result(result)
+        # TTL 從完成時開始計算
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry.expires_at = time.monotonic() + self.ttl
+        return result, replayed
+
+    async def _run_shared(
+        self,
+        key: str,
+        fingerprint: Hashable,
+        operation: Callable[[], Awaitable[Any]],
+    ) -> Tuple[Any, bool]:
+        """在共用 store 登記 key 後執行；其他 worker 已執行過時回傳保存的結果 (JSON 解碼後)"""
+        token = repr(fingerprint)
+        while True:
+            state, response = await self.store.claim_idempotency_key(
+                key, token, self._owner, self.PENDING_TTL
+            )
+            if state == "claimed":
+                break
+            if state == "conflict":
+                raise IdempotencyKeyConflict(key)
+            if state == "done":
+                return json.loads(response), True
+            await asyncio.sleep(self.POLL_INTERVAL)
+
+        try:
+            result = await operation()
+        except BaseException:
+            try:
+                await self.store.abandon_idempotency_key(key, self._owner)
+            except Exception as e:
+                logger.error(f"Failed to release Idempotency-Key {key}: {e}")
+            raise
+        await self.store.complete_idempotency_key(
+            key, self._owner, json.dumps(to_jsonable_python(result)), self.ttl
+        )
+        return result, False
+
+    def __len__(self) -> int:
+        return len(self._entries)
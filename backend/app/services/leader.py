@@ -0,0 +1,74 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+
+from app.services.state_store import StateStore
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderElector:
+    """
+    以 StateStore 中的 lease 進行 leader election。
+    只有 leader 負責 ping / SSH 探測並寫回狀態，其他 process 只讀取共用狀態。
+    lease 每 ttl/3 續約一次，leader 停止續約後最多 ttl 秒就會被其他 process 接手。
+    """
+
+    LEASE_NAME = "monitor"
+
+    def __init__(self, store: StateStore, ttl: float = 15.0):
+        self.store = store
+        self.ttl = ttl
+        self.renew_interval = ttl / 3
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._valid_until = 0.0
+
+    @property
+    def is_leader(self) -> bool:
+        # 續約失敗時不能繼續認定自己是 leader，以 lease 到期時間自我隔離
+        return time.monotonic() < self._valid_until
+
+    async def acquire(self) -> bool:
+        """嘗試取得或續約 lease，回傳目前是否為 leader"""
+        was_leader = self.is_leader
+        started = time.monotonic()
+        try:
+            acquired = await asyncio.to_thread(
+                self.store.try_acquire_lease, self.LEASE_NAME, self.owner, self.ttl
+            )
+        except Exception as e:
+            logger.error(f"Leader lease renewal failed: {e}")
+            acquired = False
+
+        if acquired:
+            self._valid_until = started + self.ttl
+        elif not self.is_leader:
+            self._valid_until = 0.0
+
+        if acquired and not was_leader:
+            logger.info(f"Became leader ({self.owner}).")
+        elif was_leader and not self.is_leader:
+            logger.warning(f"Lost leadership ({self.owner}).")
+        return self.is_leader
+
+    async def run(self):
+        """背景任務：定期續約或競爭 lease"""
+        try:
+            while True:
+                await self.acquire()
+                await asyncio.sleep(self.renew_interval)
+        except asyncio.CancelledError:
+            await self.resign()
+            raise
+
+    async def resign(self) -> None:
+        if self._valid_until:
+            self._valid_until = 0.0
+            try:
+                await asyncio.to_thread(self.store.release_lease, self.LEASE_NAME, self.owner)
+            except Exception as e:
+                logger.error(f"Failed to release leader lease: {e}")
+            logger.info(f"Resigned leadership ({self.owner}).")
@@ -0,0 +1,69 @@
+import asyncio
+import heapq
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+from app.services.leader import LeaderElector
+
+logger = logging.getLogger(__name__)
+
+
+class LeaseSchedule:
+    """
+    依到期時間排序的 lease heap。
+    續約時直接推入新的到期時間，舊的項目在 pop 時以 lazy deletion 略過。
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[float, str]] = []
+        self._deadlines: Dict[str, float] = {}
+
+    def schedule(self, serial: str, expires_at: float) -> None:
+        if self._deadlines.get(serial) == expires_at:
+            return
+        self._deadlines[serial] = expires_at
+        heapq.heappush(self._heap, (expires_at, serial))
+
+    def cancel(self, serial: str) -> None:
+        self._deadlines.pop(serial, None)
+
+    def next_deadline(self) -> Optional[float]:
+        while self._heap and self._deadlines.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def pop_expired(self, now: float) -> List[str]:
+        expired = []
+        while self._heap and self._heap[0][0] <= now:
+            expires_at, serial = heapq.heappop(self._heap)
+            if self._deadlines.get(serial) == expires_at:
+                del self._deadlines[serial]
+                expired.append(serial)
+        return expired
+
+    def __len__(self) -> int:
+        return len(self._deadlines)
+
+
+async def reap_expired_leases(manager, elector: Optional[LeaderElector] = None):
+    """背景任務：釋放並重置 lease 已過期的機器 (僅 leader 執行)"""
+    INTERVAL = 5
+    logger.info("Lease reaper started.")
+    while True:
+        try:
+            if elector is None or elector.is_leader:
+                await manager.reap_expired_leases()
+
+            # 睡到下一個 lease 到期，但至少每 INTERVAL 秒同步一次其他 process 建立的 lease
+            delay = INTERVAL
+            deadline = manager.leases.next_deadline()
+            if deadline is not None:
+                delay = min(INTERVAL, max(deadline - time.time(), 0))
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            logger.info("Lease reaper stopped.")
+            break
+        except Exception as e:
+            logger.error(f"Lease reaper error: {e}")
+            await asyncio.sleep(INTERVAL)
@@ -1,17 +1,71 @@
+import ipaddress
 import logging
-from typing import Dict, List, Optional, Any
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Optional, Any
 import asyncio
 
 from app.core.config import get_settings
-from app.models.machine import Machine, MachineStatus, ReleaseResult
+from app.core.timing import timed
+from app.models.history import StatusTransition
+from app.models.machine import (
+    CircuitState,
+    LeaseResult,
+    Machine,
+    MachineStatus,
+    RefreshResult,
+    ReleaseResult,
+)
+from app.models.pool import HotSpareStatus, PoolSettings
+from app.models.reservation import ReservationQuery
+from app.models.summary import MachineSummary
+from app.services.allocator import get_policy
+from app.services.analytics import PoolAnalytics
 from app.services.device_connector import DeviceConnector
+from app.services.facets import MachineFacets
+from app.services.lease_reaper import LeaseSchedule
+from app.services.pool_index import PoolIndex
+from app.services.pools import PoolConfig
+from app.services.reboot_tracker import RebootTracker
+from app.services.state_store import LocalStateStore, StateStore
+from app.services.status_journal import StatusJournal
 
 logger = logging.getLogger(__name__)
 
 
 class MachineManager:
-    def __init__(self):
+    SUMMARY_SYNC_INTERVAL = 5.0  # 共用 store 時 summary 以 store 狀態重建的最短間隔 (秒)
+
+    def __init__(
+        self,
+        state_store: Optional[StateStore] = None,
+        reservation_ttl: float = 0,
+        max_reservation_ttl: float = 86400,
+        journal: Optional[StatusJournal] = None,
+        analytics: Optional[PoolAnalytics] = None,
+    ):
         self.connector = DeviceConnector()
+        self.reboot_tracker = RebootTracker()
+        self.state = state_store or LocalStateStore()
+        self.leases = LeaseSchedule()
+        self.pools = PoolConfig()
+        self.reservation_ttl = reservation_ttl  # 0 表示預設不設 lease 期限
+        self.max_reservation_ttl = max_reservation_ttl
+        self._transition_listeners: List[Callable[[StatusTransition], None]] = []
+        self._reserve_listeners: List[Callable[[str, str, str, bool], None]] = []
+        self._last_transition_at: Dict[str, float] = {}
+        self.journal = journal
+        if journal is not None:
+            self.add_transition_listener(journal.append)
+        self.pool_index = PoolIndex()
+        self.facets = MachineFacets()
+        self._facets_synced_at = 0.0
+        self.add_transition_listener(self.facets.on_transition)
+        self.analytics = analytics
+        if analytics is not None:
+            self.add_transition_listener(analytics.on_transition)
+            self.add_reserve_listener(analytics.record_reserve)
         self._machines: Dict[str, Machine] = {}
         self._lock = asyncio.Lock()  # 用於並發安全
 
@@ -61,7 +115,17 @@ class MachineManager:
                                 hostname=dev.get("hostname", ""),
                                 default_gateway=dev.get("default_gateway"),
                                 netmask=dev.get("netmask"),
-                                status=current_status
+                                status=current_status,
+                                expected_available_at=old_machine.expected_available_at if old_machine else None,
+                                lease_owner=old_machine.lease_owner if old_machine else None,
+                                lease_expires_at=old_machine.lease_expires_at if old_machine else None,
+                                lease_ttl=old_machine.lease_ttl if old_machine else None,
+                                last_reserved_at=old_machine.last_reserved_at if old_machine else None,
+                                reservation_count=old_machine.reservation_count if old_machine else 0,
+                                avg_reboot_seconds=old_machine.avg_reboot_seconds if old_machine else None,
+                                last_verified_at=old_machine.last_verified_at if old_machine else None,
+                                circuit_state=old_machine.circuit_state if old_machine else CircuitState.CLOSED,
+                                circuit_retry_at=old_machine.circuit_retry_at if old_machine else None,
                             )
                             parsed_machines[serial] = m
                         except KeyError as e:
@@ -71,10 +135,25 @@ class MachineManager:
                             
         return parsed_machines
     
+    @asynccontextmanager
+    async def _locked(self):
+        """取得 manager lock，等待時間計入 request timing 的 lock 階段"""
+        with timed("lock"):
+            await self._lock.acquire()
+        try:
+            yield
+        finally:
+            self._lock.release()
+
     def load_machines(self):
         """初始載入 (同步執行)"""
-        config = get_settings().load_device_config()
+        settings = get_settings()
+        config = settings.load_device_config()
+        self.pools = PoolConfig(settings.load_pool_config())
         self._machines = self._parse_config_to_machines(config)
+        self.state.attach(self._machines)
+        self.pool_index.rebuild(self._machines.values())
+        self.facets.rebuild(self._machines.values())
         logger.info(f"Loaded {len(self._machines)} machines from config.")
     
     async def reload_machines(self) -> int:
@@ -82,9 +161,14 @@ class MachineManager:
         動態重載設定檔 (Smart Reload)。
         保留現有機器的狀態 (Available/Unavailable)，僅更新屬性或新增/移除機器。
         """
-        async with self._lock:
-            # 1. 重新讀取設定檔 (config.py 會讀取最新檔案)
-            config = get_settings().load_device_config()
+        # 1. 重新讀取設定檔 (config.py 會讀取最新檔案)；檔案 I/O 與 YAML 解析在 thread 中執行，
+        #    不佔用 event loop 也不持有 lock
+        settings = get_settings()
+        config = await asyncio.to_thread(settings.load_device_config)
+        pool_config = await asyncio.to_thread(settings.load_pool_config)
+
+        async with self._locked():
+            self.pools = PoolConfig(pool_config)
             
             # 2. 解析新設定 (會自動在 _parse_config_to_machines 中繼承舊狀態)
             new_machine_map = self._parse_config_to_machines(config)
@@ -92,10 +176,24 @@ class MachineManager:
             # 3. 計算差異 (僅供 Log 參考)
             added = set(new_machine_map.keys()) - set(self._machines.keys())
             removed = set(self._machines.keys()) - set(new_machine_map.keys())
+            # 移除或管理 IP 變更的機器，其 SSH master 連線已不再適用
+            stale = [
+                old for serial, old in self._machines.items()
+                if serial in removed or old.mgmt_ip != new_machine_map[serial].mgmt_ip
+            ]
             
             # 4. 原子替換 (Atomic Replace)
             self._machines = new_machine_map
+            self.state.attach(self._machines)
+            self.pool_index.rebuild(self._machines.values())
+            self.facets.rebuild(self._machines.values())
             
+            for serial in removed:
+                self.reboot_tracker.discard(serial)
+                self.leases.cancel(serial)
+            for machine in stale:
+                await self.connector.close_master(machine)
+
             if added: logger.info(f"Machines added: {added}")
             if removed: logger.info(f"Machines removed: {removed}")
             logger.info(f"Reload complete. Total machines: {len(self._machines)}")
@@ -105,52 +203,289 @@ class MachineManager:
     async def initialize_status(self):
         """啟動時並行檢查所有機器狀態"""
         logger.info("Initializing machine statuses...")
-        tasks = [self.refresh_machine_status(m)
-                 for m in self._machines.values()]
+        await self.state.refresh(self._machines.values())
+        # 已被借出或正在重啟的機器 (可能由其他 worker 處理中) 不要覆蓋其狀態
+        tasks = [self._initialize_one(m)
+                 for m in self._machines.values()
+                 if m.status not in (MachineStatus.UNAVAILABLE, MachineStatus.REBOOTING)]
         await asyncio.gather(*tasks)
 
-    async def refresh_machine_status(self, machine: Machine):
-        """更新單台機器狀態 (Ping + Serial Check)"""
+    async def _initialize_one(self, machine: Machine):
+        # 單台設備的 SSH 逾時或 circuit open 不能中斷整個啟動檢查，狀態留給 monitor 處理
+        try:
+            await self.refresh_machine_status(machine)
+        except Exception as e:
+            logger.error(f"Initial check of {machine.serial} failed: {e}")
+
+    async def refresh_machine_status(self, machine: Machine) -> bool:
+        """
+        更新單台機器狀態 (Ping + Serial Check)。
+        檢查期間狀態被其他流程改變 (例如被其他 worker 借出) 時不寫回，回傳是否寫回。
+        """
+        return await self._refresh_checked(machine, "refresh")
+
+    async def refresh_if_unchanged(self, machine: Machine) -> bool:
+        """管理 API 的重新驗證，與 refresh_machine_status 相同的檢查，回傳是否寫回"""
+        return await self._refresh_checked(machine, "admin refresh")
+
+    async def _refresh_checked(self, machine: Machine, source: str) -> bool:
+        # 以檢查前的狀態做 compare-and-set：本地的 Machine 在 await 期間可能已過時，
+        # 直接覆寫會把其他 worker 剛寫入的借用 (lease) 欄位一併清掉
+        expected = machine.status
         if not await self.connector.is_reachable(machine.mgmt_ip):
-            machine.status = MachineStatus.UNREACHABLE
-            return
+            new, cause = MachineStatus.UNREACHABLE, f"{source}: ping failed"
+        else:
+            serial = await self.connector.get_serial_via_ssh(machine)
+            if serial == machine.serial:
+                machine.last_verified_at = datetime.now(timezone.utc)
+                new, cause = MachineStatus.AVAILABLE, f"{source}: serial verified"
+            else:
+                new, cause = MachineStatus.UNAVAILABLE, f"{source}: serial mismatch"
+                logger.warning(f"Machine {machine.serial} serial mismatch. (Expected: {machine.serial}, Got: {serial})")
 
-        # Check the serial via SSH
-        serial = await self.connector.get_serial_via_ssh(machine)
-        if serial == machine.serial:
-            machine.status = MachineStatus.AVAILABLE
-            logger.info(f"Machine {machine.serial} is AVAILABLE.")
+        if new == expected:
+            swapped = await self.state.compare_and_set(machine, expected, expected)
         else:
-            machine.status = MachineStatus.UNAVAILABLE
-            logger.warning(f"Machine {machine.serial} marked as UNAVAILABLE due to serial mismatch. (Expected: {machine.serial}, Got: {serial})")
+            swapped = await self.compare_and_set(machine, expected, new, cause=cause)
+        if swapped:
+            logger.info(f"Machine {machine.serial} is {new.value}.")
+        else:
+            logger.info(f"Machine {machine.serial} changed to {machine.status.value} during {source}, result discarded.")
+        return swapped
+
+    async def refresh_machines(
+        self, machines: Iterable[Machine], concurrency: int = 16
+    ) -> AsyncIterator[RefreshResult]:
+        """並行重新驗證多台機器 (最多 concurrency 台同時進行)，依完成順序逐台回傳結果"""
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def refresh(machine: Machine) -> RefreshResult:
+            async with semaphore:
+                previous = machine.status
+                result = RefreshResult(serial=machine.serial, previous_status=previous)
+                # 借出或重啟中的機器由 release / monitor 流程負責
+                if previous in (MachineStatus.UNAVAILABLE, MachineStatus.REBOOTING):
+                    result.status = previous
+                    result.skipped = True
+                    return result
+                started = time.monotonic()
+                try:
+                    await self.refresh_if_unchanged(machine)
+                except Exception as e:
+                    logger.error(f"Refresh of {machine.serial} failed: {e}")
+                    result.error = str(e)
+                result.duration_ms = round((time.monotonic() - started) * 1000, 1)
+                result.status = machine.status
+                result.changed = machine.status != previous
+                return result
+
+        tasks = [asyncio.create_task(refresh(m)) for m in machines]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # client 中斷時停止尚未完成的檢查
+            for task in tasks:
+                task.cancel()
 
-    def get_machines(self, vendor: Optional[str] = None, model: Optional[str] = None, version: Optional[str] = None, status: Optional[str] = None) -> List[Machine]:
+    def add_transition_listener(self, listener: Callable[[StatusTransition], None]):
+        """註冊狀態變更的 callback (例如 journal)，會在狀態寫入後同步呼叫"""
+        self._transition_listeners.append(listener)
+
+    def add_reserve_listener(self, listener: Callable[[str, str, str, bool], None]):
+        """註冊借用結果的 callback，參數為 (vendor, model, version, success)"""
+        self._reserve_listeners.append(listener)
+
+    def _notify_reserve(self, vendor: str, model: str, version: str, success: bool):
+        for listener in self._reserve_listeners:
+            try:
+                listener(vendor, model, version, success)
+            except Exception as e:
+                logger.error(f"Reserve listener failed: {e}")
+
+    def _record_transition(
+        self, machine: Machine, old: MachineStatus, new: MachineStatus, cause: str
+    ):
+        now = time.time()
+        previous = self._last_transition_at.get(machine.serial)
+        self._last_transition_at[machine.serial] = now
+        if not self._transition_listeners:
+            return
+
+        transition = StatusTransition(
+            timestamp=datetime.fromtimestamp(now, tz=timezone.utc),
+            serial=machine.serial,
+            vendor=machine.vendor,
+            model=machine.model,
+            version=machine.version,
+            from_status=old,
+            to_status=new,
+            cause=cause,
+            duration=now - previous if previous is not None else None,
+        )
+        for listener in self._transition_listeners:
+            try:
+                listener(transition)
+            except Exception as e:
+                logger.error(f"Transition listener failed: {e}")
+
+    async def set_status(self, machine: Machine, status: MachineStatus, cause: str = ""):
+        """所有狀態變更都經過這裡，以便寫入共用的 StateStore 並記錄變更"""
+        old = machine.status
+        await self.state.set_status(machine, status)
+        if old != status:
+            self._record_transition(machine, old, status, cause)
+
+    async def compare_and_set(
+        self, machine: Machine, expected: MachineStatus, new: MachineStatus, cause: str = ""
+    ) -> bool:
+        swapped = await self.state.compare_and_set(machine, expected, new)
+        if swapped and expected != new:
+            self._record_transition(machine, expected, new, cause)
+        return swapped
+
+    async def get_machines(self, vendor: Optional[str] = None, model: Optional[str] = None, version: Optional[str] = None, status: Optional[str] = None) -> List[Machine]:
         """過濾機器列表"""
-        return [
+        machines = [
             m for m in self._machines.values()
             if (not vendor or m.vendor == vendor)
             and (not model or m.model == model)
             and (not version or m.version == version)
-            and (not status or m.status == status)
         ]
+        if self.state.shared:
+            # 只同步符合靜態條件的機器，status 要以 store 的最新值過濾
+            await self.state.refresh(machines)
+        return [m for m in machines if not status or m.status == status]
+
+    async def machine_summary(self) -> MachineSummary:
+        """各分類的機器數量 (由狀態變更逐筆維護)"""
+        # 共用 store 時其他 process 的狀態變更不會經過本地 listener，定期以 store 的狀態重建
+        now = time.monotonic()
+        if self.state.shared and now - self._facets_synced_at >= self.SUMMARY_SYNC_INTERVAL:
+            self.facets.rebuild(await self.get_machines())
+            self._facets_synced_at = now
+        return self.facets.summary()
 
-    def get_machine(self, serial: str) -> Optional[Machine]:
-        return self._machines.get(serial)
+    async def get_machine(self, serial: str) -> Optional[Machine]:
+        machine = self._machines.get(serial)
+        if machine is not None and self.state.shared:
+            await self.state.refresh([machine])
+        return machine
 
-    async def reserve_machine(self, vendor: str, model: str, version: str) -> Optional[Machine]:
-        async with self._lock:  # 防止 race condition
-            candidates = self.get_machines(
+    def _grant_lease(self, machine: Machine, owner: Optional[str], ttl: Optional[float]):
+        """設定借用者與 lease 到期時間，ttl 為 0 時不會自動到期"""
+        ttl = self.reservation_ttl if ttl is None else ttl
+        ttl = min(max(ttl, 0), self.max_reservation_ttl)
+        if owner is not None:
+            machine.lease_owner = owner
+        machine.lease_ttl = ttl
+        if ttl:
+            expires_at = time.time() + ttl
+            machine.lease_expires_at = datetime.fromtimestamp(expires_at, tz=timezone.utc)
+            self.leases.schedule(machine.serial, expires_at)
+        else:
+            machine.lease_expires_at = None
+            self.leases.cancel(machine.serial)
+
+    def _clear_lease(self, machine: Machine):
+        machine.lease_owner = None
+        machine.lease_expires_at = None
+        machine.lease_ttl = None
+        self.leases.cancel(machine.serial)
+
+    async def reserve_machine(
+        self,
+        vendor: str,
+        model: str,
+        version: str,
+        owner: Optional[str] = None,
+        ttl: Optional[float] = None,
+    ) -> Optional[Machine]:
+        async with self._locked():  # 防止 race condition
+            candidates = await self.get_machines(
                 vendor, model, version, status=MachineStatus.AVAILABLE)
+            settings = self.pools.for_pool(vendor, model, version)
+
+            machine = await self._claim(self._order_candidates(settings, candidates), owner, ttl)
+            self._notify_reserve(vendor, model, version, machine is not None)
+            return machine
+
+    def _order_candidates(self, settings: PoolSettings, candidates: List[Machine]) -> List[Machine]:
+        """依 pool 的 allocation_policy 排序；有設定 hot spare 的 pool 先借出驗證仍有效的機器"""
+        ordered = get_policy(settings.allocation_policy).order(candidates)
+        if settings.hot_spares:
+            now = time.time()
+            # sort 是穩定的，同一組內維持 policy 的順序
+            ordered.sort(key=lambda m: not self._is_fresh_spare(m, settings.spare_max_age, now))
+        return ordered
+
+    async def _claim(
+        self, ordered: Iterable[Machine], owner: Optional[str], ttl: Optional[float]
+    ) -> Optional[Machine]:
+        """依序嘗試借出候選機器，回傳第一台佔住且確認可連線的機器 (需持有 lock)"""
+        for machine in ordered:
+            # 先以 compare-and-set 佔住機器，避免其他 worker 同時借出同一台；
+            # 確認可連線前還不算借出，狀態變更等結果確定後才記錄 (journal / analytics / webhook)
+            if not await self.state.compare_and_set(
+                machine, MachineStatus.AVAILABLE, MachineStatus.UNAVAILABLE
+            ):
+                continue
+
+            # 再次確認目前是否真的可連線 (Double check)
+            if await self.connector.is_reachable(machine.mgmt_ip):
+                machine.last_reserved_at = datetime.now(timezone.utc)
+                machine.reservation_count += 1
+                self._grant_lease(machine, owner, ttl)
+                await self.state.set_status(machine, MachineStatus.UNAVAILABLE)
+                self._record_transition(
+                    machine, MachineStatus.AVAILABLE, MachineStatus.UNAVAILABLE, "reserve"
+                )
+                logger.info(f"Reserved machine: {machine.serial} (owner={owner})")
+                return machine
+            else:
+                await self.state.set_status(machine, MachineStatus.UNREACHABLE)
+                self._record_transition(
+                    machine, MachineStatus.AVAILABLE, MachineStatus.UNREACHABLE, "reserve: ping failed"
+                )
+        return None
+
+    async def reserve_matching(
+        self,
+        query: ReservationQuery,
+        owner: Optional[str] = None,
+        ttl: Optional[float] = None,
+    ) -> Optional[Machine]:
+        """
+        依條件借用一台機器，在一次 lock 內從 pool 索引找出所有符合的 pool。
+        可用機器超出 hot spare 目標越多的 pool 優先 (保留稀缺的 pool 給指定版本的借用)，
+        相同時版本較新的優先；pool 內依該 pool 的 allocation_policy 排序。
+        """
+        network = ipaddress.ip_network(query.subnet, strict=False) if query.subnet else None
+        async with self._locked():
+            matched = list(self.pool_index.match(query))
+            if self.state.shared:
+                await self.state.refresh([m for _, members in matched for m in members])
+
+            ranked = []
+            for key, members in matched:
+                candidates = [
+                    m for m in members
+                    if m.status == MachineStatus.AVAILABLE and PoolIndex.accepts(m, query, network)
+                ]
+                if candidates:
+                    settings = self.pools.for_pool(*key)
+                    surplus = len(candidates) - settings.hot_spares
+                    ranked.append((surplus, self.pool_index.version_key(key[2]), key, settings, candidates))
+            ranked.sort(key=lambda item: item[:2], reverse=True)
 
-            for machine in candidates:
-                # 再次確認目前是否真的可連線 (Double check)
-                if await self.connector.is_reachable(machine.mgmt_ip):
-                    machine.status = MachineStatus.UNAVAILABLE
-                    logger.info(f"Reserved machine: {machine.serial}")
+            for _, _, key, settings, candidates in ranked:
+                machine = await self._claim(self._order_candidates(settings, candidates), owner, ttl)
+                if machine is not None:
+                    self._notify_reserve(*key, True)
                     return machine
-                else:
-                    machine.status = MachineStatus.UNREACHABLE
 
+            for key, _ in matched:
+                self._notify_reserve(*key, False)
             return None
 
     async def release_machine(self, serial: str) -> ReleaseResult:
@@ -158,22 +493,208 @@ class MachineManager:
         釋放機器並執行重置。
         回傳 ReleaseResult Enum 以便 API 層判斷 HTTP 狀態碼。
         """
-        machine = self.get_machine(serial)
+        machine = await self.get_machine(serial)
         if not machine:
             return ReleaseResult.NOT_FOUND
         
-        if machine.status == MachineStatus.UNAVAILABLE:
+        # 以 compare-and-set 取得重置權，避免同一台機器被重複 release
+        if await self.compare_and_set(
+            machine, MachineStatus.UNAVAILABLE, MachineStatus.REBOOTING, cause="release"
+        ):
             # 非同步執行重置
             success = await self.connector.reset_device(machine)
             
             if success:
-                machine.status = MachineStatus.REBOOTING
+                # 設備重啟後舊的 SSH master 連線已失效，下次連線重新建立
+                await self.connector.close_master(machine)
+                self._clear_lease(machine)
+                self.reboot_tracker.start(machine)
+                await self.set_status(machine, MachineStatus.REBOOTING)
                 logger.info(f"Machine {serial} reset initiated. Status set to REBOOTING.")
                 return ReleaseResult.SUCCESS
             else:
+                self.reboot_tracker.discard(serial)
+                await self.set_status(machine, MachineStatus.UNAVAILABLE, cause="release: reset failed")
                 logger.error(f"Failed to release/reset {serial}")
                 return ReleaseResult.FAILED
         else:
             logger.info(f"Machine {serial} is {machine.status}.")
             return ReleaseResult.FAILED
-        
\ No newline at end of file
+
+    async def renew_lease(
+        self, serial: str, owner: Optional[str] = None, ttl: Optional[float] = None
+    ) -> LeaseResult:
+        """Heartbeat：延長借用中機器的 lease"""
+        machine = await self.get_machine(serial)
+        if not machine:
+            return LeaseResult.NOT_FOUND
+        if machine.status != MachineStatus.UNAVAILABLE:
+            return LeaseResult.NOT_RESERVED
+        if owner is not None and machine.lease_owner not in (None, owner):
+            return LeaseResult.OWNER_MISMATCH
+
+        # 未指定 ttl 時沿用借用時的 lease 秒數，避免 heartbeat 把 lease 改成不會到期
+        self._grant_lease(machine, owner, machine.lease_ttl if ttl is None else ttl)
+        await self.set_status(machine, MachineStatus.UNAVAILABLE)
+        return LeaseResult.SUCCESS
+
+    async def _sync_leases(self):
+        """把其他 process 建立或續約的 lease 放進本地 heap"""
+        for machine in await self.get_machines(status=MachineStatus.UNAVAILABLE):
+            if machine.lease_expires_at is not None:
+                self.leases.schedule(machine.serial, machine.lease_expires_at.timestamp())
+
+    async def reap_expired_leases(self) -> List[str]:
+        """釋放並重置 lease 已過期的機器，回傳被回收的序號"""
+        if self.state.shared:
+            await self._sync_leases()
+
+        now = time.time()
+        reaped = []
+        for serial in self.leases.pop_expired(now):
+            machine = await self.get_machine(serial)
+            # heap 中的項目可能已過時 (已 release 或在其他 process 續約)，以目前狀態為準
+            if (
+                machine is None
+                or machine.status != MachineStatus.UNAVAILABLE
+                or machine.lease_expires_at is None
+            ):
+                continue
+            if machine.lease_expires_at.timestamp() > now:
+                self.leases.schedule(serial, machine.lease_expires_at.timestamp())
+                continue
+
+            logger.warning(
+                f"Lease for {serial} (owner={machine.lease_owner}) expired; releasing."
+            )
+            result = await self.release_machine(serial)
+            if result != ReleaseResult.SUCCESS:
+                # 重置失敗時清掉 lease 避免每輪重試，機器保持 UNAVAILABLE 等待人工處理
+                logger.error(f"Failed to reset {serial} after lease expiry.")
+                self._clear_lease(machine)
+                await self.set_status(machine, machine.status)
+            reaped.append(serial)
+        return reaped
+
+    async def _pools(self) -> Dict[tuple, List[Machine]]:
+        pools: Dict[tuple, List[Machine]] = {}
+        for machine in await self.get_machines():
+            pools.setdefault((machine.vendor, machine.model, machine.version), []).append(machine)
+        return pools
+
+    def _is_fresh_spare(self, machine: Machine, max_age: float, now: float) -> bool:
+        return (
+            machine.status == MachineStatus.AVAILABLE
+            and machine.last_verified_at is not None
+            and now - machine.last_verified_at.timestamp() <= max_age
+        )
+
+    async def hot_spare_report(self) -> List[HotSpareStatus]:
+        """列出有設定 hot_spares 的 pool 目前的驗證狀況，deficit > 0 代表 pool 不足"""
+        now = time.time()
+        report = []
+        for (vendor, model, version), machines in (await self._pools()).items():
+            settings = self.pools.for_pool(vendor, model, version)
+            if not settings.hot_spares:
+                continue
+            fresh = [m for m in machines if self._is_fresh_spare(m, settings.spare_max_age, now)]
+            report.append(HotSpareStatus(
+                vendor=vendor,
+                model=model,
+                version=version,
+                target=settings.hot_spares,
+                verified=len(fresh),
+                available=sum(m.status == MachineStatus.AVAILABLE for m in machines),
+                deficit=max(settings.hot_spares - len(fresh), 0),
+                oldest_verified_at=min((m.last_verified_at for m in fresh), default=None),
+            ))
+        return report
+
+    async def _verify_spare(self, machine: Machine, auto_reset: bool) -> bool:
+        """
+        重新驗證閒置機器。只有在機器仍為 AVAILABLE 時才寫回結果，
+        避免覆蓋驗證期間被借出的狀態。
+        """
+        if not await self.connector.is_reachable(machine.mgmt_ip):
+            await self.compare_and_set(
+                machine, MachineStatus.AVAILABLE, MachineStatus.UNREACHABLE,
+                cause="hot spare: ping failed",
+            )
+            return False
+
+        try:
+            serial = await self.connector.get_serial_via_ssh(machine)
+        except Exception as e:
+            # SSH 逾時、連線錯誤或 circuit open 不代表設備不對，保持 AVAILABLE 下一輪再驗證
+            logger.warning(f"Spare verification of {machine.serial} skipped: {e}")
+            return False
+        if serial is None:
+            logger.warning(f"Spare verification of {machine.serial} skipped: serial not readable.")
+            return False
+
+        if serial == machine.serial:
+            machine.last_verified_at = datetime.now(timezone.utc)
+            return await self.state.compare_and_set(
+                machine, MachineStatus.AVAILABLE, MachineStatus.AVAILABLE
+            )
+
+        logger.warning(f"Idle machine {machine.serial} failed verification (got serial {serial}).")
+        # 驗證失敗的機器不能再被借出或計入 hot spare，也不在下一輪重複驗證
+        machine.last_verified_at = None
+        if not auto_reset:
+            await self.compare_and_set(
+                machine, MachineStatus.AVAILABLE, MachineStatus.UNAVAILABLE,
+                cause="hot spare: verification failed",
+            )
+        elif await self.compare_and_set(
+            machine, MachineStatus.AVAILABLE, MachineStatus.REBOOTING,
+            cause="hot spare: pre-reset",
+        ):
+            if await self.connector.reset_device(machine):
+                await self.connector.close_master(machine)
+                logger.info(f"Idle machine {machine.serial} pre-reset; status set to REBOOTING.")
+                self.reboot_tracker.start(machine)
+                await self.set_status(machine, MachineStatus.REBOOTING)
+            else:
+                # 與 release 重置失敗相同，保持 UNAVAILABLE 等待人工處理
+                logger.error(f"Failed to pre-reset idle machine {machine.serial}.")
+                await self.set_status(machine, MachineStatus.UNAVAILABLE, cause="hot spare: pre-reset failed")
+        return False
+
+    async def maintain_hot_spares(self) -> List[HotSpareStatus]:
+        """
+        讓每個設定 hot_spares 的 pool 保持足夠的已驗證機器：
+        驗證過期的 AVAILABLE 機器依最舊的優先重新驗證，直到達到目標數量。
+        """
+        now = time.time()
+        tasks = []
+        for (vendor, model, version), machines in (await self._pools()).items():
+            settings = self.pools.for_pool(vendor, model, version)
+            if not settings.hot_spares:
+                continue
+            fresh = sum(self._is_fresh_spare(m, settings.spare_max_age, now) for m in machines)
+            stale = sorted(
+                (
+                    m for m in machines
+                    if m.status == MachineStatus.AVAILABLE
+                    and not self._is_fresh_spare(m, settings.spare_max_age, now)
+                ),
+                key=lambda m: m.last_verified_at.timestamp() if m.last_verified_at else 0.0,
+            )
+            needed = settings.hot_spares - fresh
+            tasks.extend(
+                self._verify_spare(m, settings.spare_auto_reset) for m in stale[:max(needed, 0)]
+            )
+
+        if tasks:
+            await asyncio.gather(*tasks)
+
+        report = await self.hot_spare_report()
+        for pool in report:
+            if pool.deficit:
+                logger.warning(
+                    f"Hot spare pool {pool.vendor}/{pool.model}/{pool.version} depleted: "
+                    f"{pool.verified}/{pool.target} verified."
+                )
+        return report
+
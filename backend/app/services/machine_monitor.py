@@ -1,38 +1,111 @@
 import asyncio
 import logging
+from datetime import datetime, timezone
+from typing import Optional
+from app.services.leader import LeaderElector
 from app.services.machine_manager import MachineManager
-from app.models.machine import MachineStatus
+from app.services.topology import GatewayProber, group_key
+from app.models.machine import Machine, MachineStatus
 
 logger = logging.getLogger(__name__)
 
-async def monitor_machines(manager: MachineManager):
-    """背景任務：定期檢查機器是否可以連線"""
+async def _is_ssh_ready(manager: MachineManager, machine: Machine) -> bool:
+    """SSH 可以登入且序號相符才算真正開機完成"""
+    try:
+        serial = await manager.connector.get_serial_via_ssh(machine)
+    except Exception as e:
+        logger.debug(f"SSH check for {machine.serial} failed: {e}")
+        return False
+    return serial == machine.serial
+
+async def monitor_machines(
+    manager: MachineManager,
+    elector: Optional[LeaderElector] = None,
+    gateway_min_group: int = 2,
+):
+    """
+    背景任務：定期檢查機器是否可以連線 (僅 leader 執行探測)。
+    同一網段有 gateway_min_group 台以上機器時先探測 gateway，gateway 斷線的網段不逐台 ping。
+    """
     INTERVAL = 10
+    prober = GatewayProber(manager.connector, gateway_min_group)
     logger.info("Background monitor started.")
     while True:
         try:
-            unreachable = manager.get_machines(status=MachineStatus.UNREACHABLE)
+            if elector is not None and not elector.is_leader:
+                # Follower 不做探測，狀態由 leader 寫入共用 StateStore
+                await asyncio.sleep(INTERVAL)
+                continue
+
+            unreachable = await manager.get_machines(status=MachineStatus.UNREACHABLE)
+            available = await manager.get_machines(status=MachineStatus.AVAILABLE)
+            rebooting = await manager.get_machines(status=MachineStatus.REBOOTING)
+            down = await prober.down_groups([*unreachable, *available, *rebooting])
+            # gateway 斷線：可借用的機器直接標成 UNREACHABLE，其餘維持原狀等 gateway 恢復
+            behind_down_gateway = {m.serial for members in down.values() for m in members}
+            for machine in available:
+                key = group_key(machine)
+                if key in down:
+                    logger.info(f"Machine {machine.serial} unreachable: gateway {key[0]} down.")
+                    # 探測 gateway 期間可能已被借出，只改仍是 AVAILABLE 的機器
+                    await manager.compare_and_set(
+                        machine,
+                        MachineStatus.AVAILABLE,
+                        MachineStatus.UNREACHABLE,
+                        cause=f"monitor: gateway {key[0]} down",
+                    )
+
             for machine in unreachable:
+                if machine.serial in behind_down_gateway:
+                    continue
                 # 如果 Ping 通了，改回 Available
                 if await manager.connector.is_reachable(machine.mgmt_ip):
+                    cause = "monitor: ping recovered"
+                    if manager.reboot_tracker.is_tracking(machine.serial):
+                        # 重啟後 ICMP 通了不代表 SSH 已可登入，確認讀得到序號才放回 pool
+                        if not await _is_ssh_ready(manager, machine):
+                            logger.info(f"Machine {machine.serial} answers ping but SSH is not ready yet.")
+                            continue
+                        machine.last_verified_at = datetime.now(timezone.utc)
+                        duration = manager.reboot_tracker.complete(machine)
+                        logger.info(f"Machine {machine.serial} is back after reboot ({duration:.0f}s).")
+                        cause = "monitor: ssh ready after reboot"
                     logger.info(f"Machine {machine.serial} recovered.")
-                    machine.status = MachineStatus.AVAILABLE
+                    await manager.compare_and_set(
+                        machine, MachineStatus.UNREACHABLE, MachineStatus.AVAILABLE, cause=cause
+                    )
                 else:
                     logger.debug(f"Machine {machine.serial} still unreachable.")
             
-            available = manager.get_machines(status=MachineStatus.AVAILABLE)
             for machine in available:
+                if machine.serial in behind_down_gateway:
+                    continue
                 # 如果不可達，改成 Unreachable
                 if not await manager.connector.is_reachable(machine.mgmt_ip):
                     logger.info(f"Machine {machine.serial} became unreachable.")
-                    machine.status = MachineStatus.UNREACHABLE
-            rebooting = manager.get_machines(status=MachineStatus.REBOOTING)
+                    # ping 期間可能已被其他 worker 借出，只改仍是 AVAILABLE 的機器 (不覆寫 lease 欄位)
+                    await manager.compare_and_set(
+                        machine,
+                        MachineStatus.AVAILABLE,
+                        MachineStatus.UNREACHABLE,
+                        cause="monitor: ping failed",
+                    )
             for machine in rebooting:
+                if not manager.reboot_tracker.is_tracking(machine.serial):
+                    # 由其他 process release 的機器，從這裡開始追蹤重啟時間
+                    manager.reboot_tracker.start(machine)
+                if machine.serial in behind_down_gateway:
+                    continue  # 無法分辨是重啟中還是網路斷線
                 # 如果 Ping 通 -> 代表還在關機過程中，或者剛重啟完還沒死透 -> 保持 REBOOTING 不變，不做任何事
                 # 如果 Ping 不通 -> 代表終於關機成功了 -> 轉為 UNREACHABLE (等待下次啟動被上面的邏輯1捕獲)
                 if not await manager.connector.is_reachable(machine.mgmt_ip):
                     logger.info(f"Machine {machine.serial} finally went down (Reboot confirmed).")
-                    machine.status = MachineStatus.UNREACHABLE
+                    await manager.compare_and_set(
+                        machine,
+                        MachineStatus.REBOOTING,
+                        MachineStatus.UNREACHABLE,
+                        cause="monitor: reboot confirmed",
+                    )
                 else:
                     logger.debug(f"Machine {machine.serial} is still rebooting (Pingable)...")
             await asyncio.sleep(INTERVAL)
@@ -0,0 +1,75 @@
+import fnmatch
+import ipaddress
+import re
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from app.models.machine import Machine
+from app.models.reservation import ReservationQuery
+
+PoolKey = Tuple[str, str, str]
+Network = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+_VERSION_TOKEN = re.compile(r"\d+|[A-Za-z]+")
+
+
+def version_key(version: str) -> Tuple[Tuple[int, Union[int, str]], ...]:
+    """
+    版本字串的比較用 key：數字依數值比較，字母排在數字之後。
+    例如 "9.3" < "9.3(13)" < "10.2(1)"，"17.09.05e" 與 "17.9.5e" 相同。
+    """
+    return tuple(
+        (0, int(token)) if token.isdigit() else (1, token.lower())
+        for token in _VERSION_TOKEN.findall(version)
+    )
+
+
+class PoolIndex:
+    """
+    依 (vendor, model, version) 分組的機器索引，載入設定時建立。
+    條件查詢只需走訪 pool (數量遠少於機器)，再從符合的 pool 中篩選機器。
+    """
+
+    def __init__(self):
+        self._pools: Dict[PoolKey, List[Machine]] = {}
+        self._version_keys: Dict[str, tuple] = {}
+
+    def rebuild(self, machines: Iterable[Machine]) -> None:
+        pools: Dict[PoolKey, List[Machine]] = {}
+        for machine in machines:
+            pools.setdefault((machine.vendor, machine.model, machine.version), []).append(machine)
+        self._pools = pools
+        self._version_keys = {version: version_key(version) for _, _, version in pools}
+
+    def version_key(self, version: str) -> tuple:
+        key = self._version_keys.get(version)
+        return key if key is not None else version_key(version)
+
+    def match(self, query: ReservationQuery) -> Iterator[Tuple[PoolKey, List[Machine]]]:
+        """符合 vendor / model / version glob 與版本範圍的 pool (依設定檔順序)"""
+        lower = version_key(query.min_version) if query.min_version else None
+        upper = version_key(query.max_version) if query.max_version else None
+        for key, members in self._pools.items():
+            vendor, model, version = key
+            if not (
+                fnmatch.fnmatchcase(vendor, query.vendor)
+                and fnmatch.fnmatchcase(model, query.model)
+                and fnmatch.fnmatchcase(version, query.version)
+            ):
+                continue
+            current = self._version_keys[version]
+            if (lower is not None and current < lower) or (upper is not None and current > upper):
+                continue
+            yield key, members
+
+    @staticmethod
+    def accepts(machine: Machine, query: ReservationQuery, network: Optional[Network]) -> bool:
+        """機器屬性條件 (hostname 前綴、網段)"""
+        if query.hostname_prefix and not machine.hostname.startswith(query.hostname_prefix):
+            return False
+        if network is not None:
+            try:
+                if ipaddress.ip_address(machine.mgmt_ip) not in network:
+                    return False
+            except ValueError:
+                return False
+        return True
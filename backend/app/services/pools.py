@@ -0,0 +1,53 @@
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+from app.models.pool import PoolSettings
+from app.services.allocator import get_policy
+
+logger = logging.getLogger(__name__)
+
+
+class PoolConfig:
+    """
+    解析 pools.yaml，提供每個 pool 的調度設定。
+    格式:
+        default:
+          allocation_policy: first
+        pools:
+          cisco/n9k: {allocation_policy: fastest_reset}
+          "cisco/n9k/9.3(13)": {allocation_policy: least_recently_used}
+    pools 的 key 可以是 vendor、vendor/model 或 vendor/model/version，越精確的優先。
+    """
+
+    def __init__(self, data: Optional[Dict[str, Any]] = None):
+        data = data or {}
+        self.default = PoolSettings(**(data.get("default") or {}))
+        self._overrides: Dict[Tuple[str, ...], Dict[str, Any]] = {}
+        self._cache: Dict[Tuple[str, str, str], PoolSettings] = {}
+
+        pools = data.get("pools") or {}
+        if not isinstance(pools, dict):
+            raise ValueError("pools.yaml 'pools' must be a mapping")
+        for key, values in pools.items():
+            parts = tuple(str(key).split("/"))
+            if not 1 <= len(parts) <= 3 or not all(parts):
+                raise ValueError(f"Invalid pool key '{key}', expected vendor[/model[/version]]")
+            # 先驗證一次，避免設定錯誤到借用時才發現
+            PoolSettings(**{**self.default.model_dump(), **(values or {})})
+            self._overrides[parts] = values or {}
+
+        for settings in [self.default, *map(self._resolve_key, self._overrides)]:
+            get_policy(settings.allocation_policy)
+
+    def _resolve_key(self, key: Tuple[str, ...]) -> PoolSettings:
+        merged = self.default.model_dump()
+        for depth in range(1, len(key) + 1):
+            merged.update(self._overrides.get(key[:depth], {}))
+        return PoolSettings(**merged)
+
+    def for_pool(self, vendor: str, model: str, version: str) -> PoolSettings:
+        key = (vendor, model, version)
+        settings = self._cache.get(key)
+        if settings is None:
+            settings = self._cache[key] = self._resolve_key(key)
+        return settings
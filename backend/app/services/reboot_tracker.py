@@ -0,0 +1,71 @@
+import logging
+import statistics
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Deque, Dict, Optional, Tuple
+
+from app.models.machine import Machine
+
+logger = logging.getLogger(__name__)
+
+
+class RebootTracker:
+    """
+    追蹤機器重置後的重啟過程。
+    記錄每個 (vendor, model) 的歷史重啟時間，用來估算 expected_available_at。
+    """
+
+    # 單機平均重啟時間 (EWMA) 的平滑係數
+    SMOOTHING = 0.3
+
+    def __init__(self, history_size: int = 50):
+        self._history_size = history_size
+        self._started: Dict[str, float] = {}
+        self._durations: Dict[Tuple[str, str], Deque[float]] = {}
+
+    def start(self, machine: Machine, started_at: Optional[float] = None) -> None:
+        """標記機器開始重啟，並依歷史資料設定預估可用時間"""
+        started = started_at if started_at is not None else time.time()
+        self._started[machine.serial] = started
+        estimate = self.estimate(machine.vendor, machine.model)
+        if estimate is None:
+            machine.expected_available_at = None
+        else:
+            machine.expected_available_at = datetime.fromtimestamp(
+                started + estimate, tz=timezone.utc
+            )
+
+    def is_tracking(self, serial: str) -> bool:
+        return serial in self._started
+
+    def complete(self, machine: Machine, finished_at: Optional[float] = None) -> Optional[float]:
+        """機器重新可登入，記錄本次重啟花費的秒數"""
+        started = self._started.pop(machine.serial, None)
+        machine.expected_available_at = None
+        if started is None:
+            return None
+
+        finished = finished_at if finished_at is not None else time.time()
+        duration = max(finished - started, 0.0)
+        key = (machine.vendor, machine.model)
+        history = self._durations.get(key)
+        if history is None:
+            history = self._durations[key] = deque(maxlen=self._history_size)
+        history.append(duration)
+
+        if machine.avg_reboot_seconds is None:
+            machine.avg_reboot_seconds = duration
+        else:
+            machine.avg_reboot_seconds += self.SMOOTHING * (duration - machine.avg_reboot_seconds)
+        return duration
+
+    def discard(self, serial: str) -> None:
+        self._started.pop(serial, None)
+
+    def estimate(self, vendor: str, model: str) -> Optional[float]:
+        """以歷史重啟時間的中位數作為估計值，沒有資料時回傳 None"""
+        history = self._durations.get((vendor, model))
+        if not history:
+            return None
+        return statistics.median(history)
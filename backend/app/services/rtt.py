@@ -0,0 +1,64 @@
+from collections import deque
+from typing import Deque, Optional
+
+
+class RttEstimator:
+    """
+    單一 IP 的 RTT 估計 (TCP RTO 的算法，RFC 6298)：
+    SRTT / RTTVAR 以 EWMA 更新，逾時 = SRTT + 4 * RTTVAR，限制在 [min_timeout, max_timeout]。
+    掉包時逾時加倍，但只在同一次檢查內有效 (reset_backoff)，已知不通的主機不會每次都等到上限。
+    另外保留最近 loss_window 次探測的結果，用來判斷 k-of-n 掉包。
+    """
+
+    ALPHA = 1 / 8
+    BETA = 1 / 4
+    K = 4
+
+    def __init__(
+        self,
+        initial_timeout: float = 1.0,
+        min_timeout: float = 0.2,
+        max_timeout: float = 3.0,
+        loss_window: int = 3,
+    ):
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.srtt: Optional[float] = None
+        self.rttvar: Optional[float] = None
+        self.rto = min(max(initial_timeout, min_timeout), max_timeout)
+        self.timeout = self.rto
+        self.outcomes: Deque[bool] = deque(maxlen=loss_window)
+
+    def _clamp(self, value: float) -> float:
+        return min(max(value, self.min_timeout), self.max_timeout)
+
+    def observe(self, rtt: float) -> None:
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+        self.rto = self._clamp(self.srtt + self.K * self.rttvar)
+        self.timeout = self.rto
+        self.outcomes.append(True)
+
+    def observe_loss(self) -> None:
+        # 與 TCP 相同，逾時後加倍 (下一個成功的樣本或 reset_backoff 會恢復)
+        self.timeout = self._clamp(self.timeout * 2)
+        self.outcomes.append(False)
+
+    def reset_backoff(self) -> None:
+        """每次檢查開始時呼叫：逾時回到由最近成功樣本算出的 RTO"""
+        self.timeout = self.rto
+
+    @property
+    def hedge_delay(self) -> float:
+        """超過此秒數仍未回應就送出第二個探測；沒有樣本時為逾時的一半"""
+        if self.srtt is None:
+            return self.timeout / 2
+        return min(max(self.srtt + 2 * self.rttvar, self.min_timeout / 2), self.timeout)
+
+    @property
+    def losses(self) -> int:
+        return sum(1 for ok in self.outcomes if not ok)
@@ -0,0 +1,96 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Any, Awaitable, Callable, List, Tuple
+
+from app.models.ssh import SSHPoolStats
+
+logger = logging.getLogger(__name__)
+
+# 數字越小越優先：重置 (使用者在等機器回到 pool) 排在背景驗證之前
+PRIORITY_RESET = 0
+PRIORITY_VERIFY = 10
+
+
+class SSHExecutor:
+    """
+    限制同時進行的 SSH session 數量。
+    超過 max_workers 的呼叫依 (priority, 送出順序) 排隊；SSH 本身以 asyncio subprocess 執行，
+    不佔用任何執行緒，呼叫端被取消時由 _stream_process 終止子行程。
+    """
+
+    def __init__(self, max_workers: int = 16):
+        self.max_workers = max_workers
+        self._running = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self.submitted = 0
+        self.started = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    async def _acquire(self, priority: int) -> None:
+        if self._running < self.max_workers and not self._queued():
+            self._running += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), waiter))
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            # 已經被分配到 slot 才取消，要把 slot 交給下一個
+            if waiter.done() and not waiter.cancelled():
+                self._release()
+            raise
+
+    def _release(self) -> None:
+        while self._waiters:
+            _, _, waiter = heapq.heappop(self._waiters)
+            if not waiter.done():
+                waiter.set_result(None)  # slot 直接交給下一個等待者
+                return
+        self._running -= 1
+
+    def _queued(self) -> int:
+        return sum(1 for _, _, waiter in self._waiters if not waiter.done())
+
+    async def run(
+        self, func: Callable[..., Awaitable[Any]], *args, priority: int = PRIORITY_VERIFY, **kwargs
+    ) -> Any:
+        """取得 slot 後執行 await func(*args, **kwargs)"""
+        self.submitted += 1
+        queued_at = time.monotonic()
+        try:
+            await self._acquire(priority)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        waited = time.monotonic() - queued_at
+        self.started += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+
+        try:
+            return await func(*args, **kwargs)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        finally:
+            self.completed += 1
+            self._release()
+
+    def stats(self) -> SSHPoolStats:
+        return SSHPoolStats(
+            max_workers=self.max_workers,
+            running=self._running,
+            queued=self._queued(),
+            submitted=self.submitted,
+            completed=self.completed,
+            cancelled=self.cancelled,
+            mean_wait_ms=round(self.total_wait / self.started * 1000, 2) if self.started else 0.0,
+            max_wait_ms=round(self.max_wait * 1000, 2),
+        )
@@ -0,0 +1,439 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from app.core.config import Settings
+from app.models.machine import Machine, MachineStatus
+
+logger = logging.getLogger(__name__)
+
+# 使用率統計的增量: (minute, vendor, model, version, metric, value)
+PoolCounter = Tuple[int, str, str, str, str, float]
+
+
+class StateStore:
+    """
+    機器動態狀態 (status 等) 的儲存介面。
+    設定檔中的靜態屬性仍由 MachineManager 解析，這裡只負責會變動的部分。
+    """
+
+    # 是否與其他 worker / replica 共用；共用時讀取前需要先 refresh
+    shared: bool = False
+
+    def attach(self, machines: Dict[str, Machine]) -> None:
+        """載入或重載設定後呼叫，讓 store 與目前的機器清單同步"""
+
+    async def refresh(self, machines: Iterable[Machine]) -> None:
+        """把 store 中的最新狀態套用到 Machine 物件上"""
+
+    async def set_status(self, machine: Machine, status: MachineStatus) -> None:
+        """寫入狀態，同時保存 Machine 上其他會變動的欄位 (預估可用時間、lease 等)"""
+        machine.status = status
+
+    async def compare_and_set(
+        self, machine: Machine, expected: MachineStatus, new: MachineStatus
+    ) -> bool:
+        """
+        只有在目前狀態為 expected 時才改成 new (連同其他欄位一起寫入)，回傳是否成功。
+        失敗時 machine 會同步成 store 中的最新狀態。
+        """
+        if machine.status != expected:
+            return False
+        machine.status = new
+        return True
+
+    def try_acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """取得或續約具名 lease；被其他 owner 持有且尚未過期時回傳 False"""
+        return True
+
+    async def claim_idempotency_key(
+        self, key: str, fingerprint: str, owner: str, pending_ttl: float
+    ) -> Tuple[str, Optional[str]]:
+        """
+        跨 process 登記 Idempotency-Key，回傳 (state, response)：
+        - "claimed": 由呼叫端執行，完成後呼叫 complete_idempotency_key
+        - "pending": 其他 process 正在執行
+        - "done": 已完成，response 為保存的 JSON
+        - "conflict": key 已用於不同的 request
+        """
+        return "claimed", None
+
+    async def complete_idempotency_key(self, key: str, owner: str, response: str, ttl: float) -> None:
+        """保存執行結果，ttl 秒內的重試直接回傳"""
+
+    async def abandon_idempotency_key(self, key: str, owner: str) -> None:
+        """執行失敗時移除登記，之後的重試會重新執行"""
+
+    async def add_pool_counters(self, counters: Sequence[PoolCounter], oldest_minute: int) -> None:
+        """累加各 worker 的使用率統計，並刪除早於 oldest_minute 的資料"""
+
+    async def pool_counters(self, since_minute: int) -> List[PoolCounter]:
+        """讀取 since_minute 之後所有 worker 的統計合計，依 minute 排序"""
+        return []
+
+    def release_lease(self, name: str, owner: str) -> None:
+        """主動釋放 lease，讓其他 process 可以立即接手"""
+
+
+class LocalStateStore(StateStore):
+    """單一 process 使用：Machine 物件本身就是狀態來源"""
+
+
+class SQLiteStateStore(StateStore):
+    """
+    以 SQLite 檔案在多個 worker / replica 之間共用狀態。
+    compare_and_set 以單一條件式 UPDATE 完成，確保同一台機器不會被重複借出。
+    查詢在專用的執行緒執行 (等待其他 process 的寫入鎖時不會卡住 event loop)；
+    refresh 以 PRAGMA data_version 判斷其他連線是否寫入過，只重新讀取可能過時的列。
+    """
+
+    shared = True
+
+    # status 以外會隨狀態一起保存的 Machine 欄位 -> 欄位型別
+    # TIMESTAMP 以 epoch 秒數 (REAL) 保存，讀回時轉為 UTC datetime
+    _FIELDS: Dict[str, str] = {
+        "expected_available_at": "TIMESTAMP",
+        "lease_owner": "TEXT",
+        "lease_expires_at": "TIMESTAMP",
+        "lease_ttl": "REAL",
+        "last_reserved_at": "TIMESTAMP",
+        "reservation_count": "INTEGER NOT NULL DEFAULT 0",
+        "avg_reboot_seconds": "REAL",
+        "last_verified_at": "TIMESTAMP",
+    }
+
+    def __init__(self, path: Path, timeout: float = 5.0):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        # 單一執行緒：查詢依呼叫順序完成，結果也依序套用到 Machine 物件
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="state-store")
+        # serial -> 上次讀取該列時的 data_version
+        self._synced: Dict[str, int] = {}
+        self._conn = sqlite3.connect(
+            str(path), timeout=timeout, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS machine_state (
+                serial TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        # 舊版資料庫缺少的欄位逐一補上
+        columns = {
+            row[1] for row in self._conn.execute("PRAGMA table_info(machine_state)")
+        }
+        for field, column_type in self._FIELDS.items():
+            if field not in columns:
+                self._conn.execute(
+                    f"ALTER TABLE machine_state ADD COLUMN {field} "
+                    f"{'REAL' if column_type == 'TIMESTAMP' else column_type}"
+                )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS idempotency (
+                key TEXT PRIMARY KEY,
+                fingerprint TEXT NOT NULL,
+                owner TEXT NOT NULL,
+                response TEXT,
+                expires_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idempotency_expires_at ON idempotency (expires_at)"
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pool_analytics (
+                minute INTEGER NOT NULL,
+                vendor TEXT NOT NULL,
+                model TEXT NOT NULL,
+                version TEXT NOT NULL,
+                metric TEXT NOT NULL,
+                value REAL NOT NULL,
+                PRIMARY KEY (minute, vendor, model, version, metric)
+            )
+            """
+        )
+
+    @staticmethod
+    def _to_timestamp(value: Optional[datetime]) -> Optional[float]:
+        return value.timestamp() if value is not None else None
+
+    @staticmethod
+    def _from_timestamp(value: Optional[float]) -> Optional[datetime]:
+        if value is None:
+            return None
+        return datetime.fromtimestamp(value, tz=timezone.utc)
+
+    def _row_values(self, machine: Machine, status: MachineStatus) -> tuple:
+        values = [machine.serial, status.value, time.time()]
+        for field, column_type in self._FIELDS.items():
+            value = getattr(machine, field)
+            values.append(self._to_timestamp(value) if column_type == "TIMESTAMP" else value)
+        return tuple(values)
+
+    @property
+    def _column_list(self) -> str:
+        return ", ".join(["serial", "status", "updated_at", *self._FIELDS])
+
+    async def _run(self, func: Callable[..., Any], *args: Any) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _apply(self, machine: Machine, row: tuple) -> None:
+        machine.status = MachineStatus(row[0])
+        for (field, column_type), value in zip(self._FIELDS.items(), row[1:]):
+            if column_type == "TIMESTAMP":
+                value = self._from_timestamp(value)
+            setattr(machine, field, value)
+
+    def _read_rows(self, serials: Sequence[str], force: bool = False) -> Dict[str, tuple]:
+        """讀取自上次讀取後可能被其他連線改過的列 (force 時全部重新讀取)"""
+        fields = ", ".join(self._FIELDS)
+        rows: Dict[str, tuple] = {}
+        with self._lock:
+            # data_version 只在其他連線 commit 後改變，本連線的寫入已直接反映在 Machine 上
+            version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            stale = [s for s in serials if force or self._synced.get(s) != version]
+            for start in range(0, len(stale), 500):
+                chunk = stale[start:start + 500]
+                for row in self._conn.execute(
+                    f"SELECT serial, status, {fields} FROM machine_state "
+                    f"WHERE serial IN ({', '.join('?' * len(chunk))})",
+                    chunk,
+                ):
+                    rows[row[0]] = row[1:]
+            for serial in stale:
+                self._synced[serial] = version
+        return rows
+
+    def attach(self, machines: Dict[str, Machine]) -> None:
+        placeholders = ", ".join("?" * (3 + len(self._FIELDS)))
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # 新機器以目前狀態寫入，已存在的機器保留 store 中的狀態
+                self._conn.executemany(
+                    f"INSERT OR IGNORE INTO machine_state ({self._column_list}) "
+                    f"VALUES ({placeholders})",
+                    [self._row_values(m, m.status) for m in machines.values()],
+                )
+                existing = {
+                    row[0]
+                    for row in self._conn.execute("SELECT serial FROM machine_state")
+                }
+                removed = existing - set(machines)
+                self._conn.executemany(
+                    "DELETE FROM machine_state WHERE serial = ?",
+                    [(serial,) for serial in removed],
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        # 只在啟動與重載時呼叫，直接在目前的執行緒讀取
+        self._synced.clear()
+        rows = self._read_rows(list(machines), force=True)
+        for serial, machine in machines.items():
+            if serial in rows:
+                self._apply(machine, rows[serial])
+
+    async def refresh(self, machines: Iterable[Machine]) -> None:
+        machines = list(machines)
+        if not machines:
+            return
+        rows = await self._run(self._read_rows, [m.serial for m in machines])
+        for machine in machines:
+            row = rows.get(machine.serial)
+            if row is not None:
+                self._apply(machine, row)
+
+    def _upsert(self, values: tuple) -> None:
+        placeholders = ", ".join("?" * (3 + len(self._FIELDS)))
+        updates = ", ".join(
+            f"{column} = excluded.{column}"
+            for column in ("status", "updated_at", *self._FIELDS)
+        )
+        with self._lock:
+            self._conn.execute(
+                f"INSERT INTO machine_state ({self._column_list}) VALUES ({placeholders}) "
+                f"ON CONFLICT(serial) DO UPDATE SET {updates}",
+                values,
+            )
+
+    async def set_status(self, machine: Machine, status: MachineStatus) -> None:
+        # 欄位值在 event loop 上取出，背景執行緒不碰 Machine 物件
+        await self._run(self._upsert, self._row_values(machine, status))
+        machine.status = status
+
+    def _swap(self, values: tuple, expected: MachineStatus) -> Tuple[bool, Optional[tuple]]:
+        assignments = ", ".join(
+            f"{column} = ?" for column in ("status", "updated_at", *self._FIELDS)
+        )
+        serial = values[0]
+        with self._lock:
+            cursor = self._conn.execute(
+                f"UPDATE machine_state SET {assignments} WHERE serial = ? AND status = ?",
+                (*values[1:], serial, expected.value),
+            )
+            swapped = cursor.rowcount == 1
+        if swapped:
+            return True, None
+        return False, self._read_rows([serial], force=True).get(serial)
+
+    async def compare_and_set(
+        self, machine: Machine, expected: MachineStatus, new: MachineStatus
+    ) -> bool:
+        swapped, row = await self._run(self._swap, self._row_values(machine, new), expected)
+        if swapped:
+            machine.status = new
+        elif row is not None:
+            self._apply(machine, row)
+        return swapped
+
+    def try_acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT owner, expires_at FROM leases WHERE name = ?", (name,)
+                ).fetchone()
+                acquired = row is None or row[0] == owner or row[1] <= now
+                if acquired:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO leases VALUES (?, ?, ?)",
+                        (name, owner, now + ttl),
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return acquired
+
+    def release_lease(self, name: str, owner: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner)
+            )
+
+    def _claim_key(
+        self, key: str, fingerprint: str, owner: str, pending_ttl: float
+    ) -> Tuple[str, Optional[str]]:
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # 過期的結果，以及執行中 process 已消失的登記一併清除
+                self._conn.execute("DELETE FROM idempotency WHERE expires_at <= ?", (now,))
+                row = self._conn.execute(
+                    "SELECT fingerprint, response FROM idempotency WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    self._conn.execute(
+                        "INSERT INTO idempotency VALUES (?, ?, ?, NULL, ?)",
+                        (key, fingerprint, owner, now + pending_ttl),
+                    )
+                    result: Tuple[str, Optional[str]] = ("claimed", None)
+                elif row[0] != fingerprint:
+                    result = ("conflict", None)
+                elif row[1] is None:
+                    result = ("pending", None)
+                else:
+                    result = ("done", row[1])
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return result
+
+    async def claim_idempotency_key(
+        self, key: str, fingerprint: str, owner: str, pending_ttl: float
+    ) -> Tuple[str, Optional[str]]:
+        return await self._run(self._claim_key, key, fingerprint, owner, pending_ttl)
+
+    def _complete_key(self, key: str, owner: str, response: str, ttl: float) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE idempotency SET response = ?, expires_at = ? WHERE key = ? AND owner = ?",
+                (response, time.time() + ttl, key, owner),
+            )
+
+    async def complete_idempotency_key(self, key: str, owner: str, response: str, ttl: float) -> None:
+        await self._run(self._complete_key, key, owner, response, ttl)
+
+    def _abandon_key(self, key: str, owner: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM idempotency WHERE key = ? AND owner = ? AND response IS NULL",
+                (key, owner),
+            )
+
+    async def abandon_idempotency_key(self, key: str, owner: str) -> None:
+        await self._run(self._abandon_key, key, owner)
+
+    def _add_counters(self, counters: Sequence[PoolCounter], oldest_minute: int) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO pool_analytics VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(minute, vendor, model, version, metric) "
+                    "DO UPDATE SET value = value + excluded.value",
+                    counters,
+                )
+                self._conn.execute("DELETE FROM pool_analytics WHERE minute < ?", (oldest_minute,))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    async def add_pool_counters(self, counters: Sequence[PoolCounter], oldest_minute: int) -> None:
+        await self._run(self._add_counters, counters, oldest_minute)
+
+    def _read_counters(self, since_minute: int) -> List[PoolCounter]:
+        with self._lock:
+            return list(self._conn.execute(
+                "SELECT minute, vendor, model, version, metric, value FROM pool_analytics "
+                "WHERE minute >= ? ORDER BY minute",
+                (since_minute,),
+            ))
+
+    async def pool_counters(self, since_minute: int) -> List[PoolCounter]:
+        return await self._run(self._read_counters, since_minute)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            self._conn.close()
+
+
+def create_state_store(settings: Settings) -> StateStore:
+    """依 STATE_BACKEND 設定建立對應的 StateStore"""
+    backend = settings.STATE_BACKEND
+    if backend == "memory":
+        return LocalStateStore()
+    if backend == "sqlite":
+        logger.info(f"Using shared SQLite state store at {settings.STATE_DB_PATH}")
+        return SQLiteStateStore(settings.STATE_DB_PATH)
+    raise ValueError(f"Unknown STATE_BACKEND: {backend}")
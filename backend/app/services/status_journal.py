@@ -0,0 +1,289 @@
+import bisect
+import heapq
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from app.models.history import StatusTransition
+from app.models.machine import MachineStatus
+
+logger = logging.getLogger(__name__)
+
+
+class _SegmentIndex:
+    """單一 segment 檔案的稀疏時間索引：每 INDEX_EVERY 筆記錄一次 (timestamp, byte offset)"""
+
+    INDEX_EVERY = 64
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.indexed_bytes = 0
+        self.count = 0
+        self.first_ts: Optional[float] = None
+        self.last_ts: Optional[float] = None
+        self.timestamps: List[float] = []
+        self.offsets: List[int] = []
+
+    def update(self) -> None:
+        """讀取上次索引之後新增的內容 (可能由其他 process 寫入)"""
+        try:
+            size = self.path.stat().st_size
+        except FileNotFoundError:
+            return
+        if size <= self.indexed_bytes:
+            return
+
+        with open(self.path, "rb") as f:
+            f.seek(self.indexed_bytes)
+            offset = self.indexed_bytes
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # 寫到一半的最後一行，下次再索引
+                try:
+                    ts = json.loads(line)["t"]
+                except (ValueError, KeyError):
+                    offset += len(line)
+                    continue
+                if self.count % self.INDEX_EVERY == 0:
+                    self.timestamps.append(ts)
+                    self.offsets.append(offset)
+                if self.first_ts is None:
+                    self.first_ts = ts
+                self.last_ts = ts
+                self.count += 1
+                offset += len(line)
+        self.indexed_bytes = offset
+
+    def updated(self) -> "_SegmentIndex":
+        """
+        回傳包含新內容的索引；檔案有新增時建立新的物件再更新，
+        其他查詢仍在使用的舊索引不會被修改。
+        """
+        try:
+            if self.path.stat().st_size <= self.indexed_bytes:
+                return self
+        except FileNotFoundError:
+            return self
+        clone = _SegmentIndex(self.path)
+        clone.indexed_bytes = self.indexed_bytes
+        clone.count = self.count
+        clone.first_ts = self.first_ts
+        clone.last_ts = self.last_ts
+        clone.timestamps = list(self.timestamps)
+        clone.offsets = list(self.offsets)
+        clone.update()
+        return clone
+
+    def seek_offset(self, start: float) -> int:
+        """回傳第一筆 timestamp >= start 的記錄之前最近的索引位置"""
+        i = bisect.bisect_left(self.timestamps, start)
+        return self.offsets[max(i - 1, 0)] if self.offsets else 0
+
+
+class StatusJournal:
+    """
+    Append-only 的狀態變更紀錄。
+    以 JSON lines 寫入 segment 檔案，超過大小就換新檔並刪除最舊的 segment。
+    每個 process 寫自己的 segment，查詢時透過記憶體中的稀疏時間索引讀取所有 segment。
+    append 只把記錄放進佇列，由背景執行緒批次寫入，不在 event loop 上做檔案 I/O。
+    """
+
+    def __init__(self, directory: Path, segment_bytes: int = 4 * 1024 * 1024, max_segments: int = 50):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments
+        self._writer_id = f"{os.getpid()}"
+        self._sequence = 0
+        self._lock = threading.Lock()  # 保護 writer 執行緒的啟動與索引的替換
+        self._queue: "queue.Queue[Optional[bytes]]" = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+        self._file = None  # 只由 writer 執行緒使用
+        self._current: Optional[Path] = None
+        self._indexes: Dict[Path, _SegmentIndex] = {}
+        directory.mkdir(parents=True, exist_ok=True)
+
+    # 寫入 -----------------------------------------------------------------
+
+    @staticmethod
+    def _encode(t: StatusTransition) -> bytes:
+        record = {
+            "t": t.timestamp.timestamp(),
+            "s": t.serial,
+            "p": f"{t.vendor}/{t.model}/{t.version}",
+            "f": t.from_status.value,
+            "to": t.to_status.value,
+            "c": t.cause,
+        }
+        if t.duration is not None:
+            record["d"] = round(t.duration, 3)
+        return (json.dumps(record, separators=(",", ":")) + "\n").encode()
+
+    @staticmethod
+    def _decode(line: bytes) -> StatusTransition:
+        record = json.loads(line)
+        vendor, model, version = record["p"].split("/", 2)
+        return StatusTransition(
+            timestamp=datetime.fromtimestamp(record["t"], tz=timezone.utc),
+            serial=record["s"],
+            vendor=vendor,
+            model=model,
+            version=version,
+            from_status=MachineStatus(record["f"]),
+            to_status=MachineStatus(record["to"]),
+            cause=record.get("c", ""),
+            duration=record.get("d"),
+        )
+
+    def _rotate(self) -> None:
+        if self._file is not None:
+            self._file.close()
+        self._sequence += 1
+        name = (
+            f"segment-{int(time.time() * 1000):015d}-{self._writer_id}-{self._sequence:06d}.jsonl"
+        )
+        self._current = self.directory / name
+        self._file = open(self._current, "ab")
+
+        segments = sorted(self.directory.glob("segment-*.jsonl"))
+        for old in segments[: max(len(segments) - self.max_segments, 0)]:
+            try:
+                old.unlink()
+            except OSError as e:
+                logger.warning(f"Failed to remove journal segment {old}: {e}")
+
+    def _write(self, data: bytes) -> None:
+        if self._file is None or self._file.tell() + len(data) > self.segment_bytes:
+            self._rotate()
+        self._file.write(data)
+
+    def _run_writer(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            try:
+                for data in batch:
+                    if data is not None:
+                        self._write(data)
+                if self._file is not None:
+                    # 一批只 flush 一次
+                    self._file.flush()
+                    if stop:
+                        self._file.close()
+                        self._file = None
+            except OSError as e:
+                logger.error(f"Failed to write status journal: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if stop:
+                return
+
+    def append(self, transition: StatusTransition) -> None:
+        """在呼叫端 (event loop) 只做編碼與放入佇列"""
+        if self._writer is None:
+            with self._lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(
+                        target=self._run_writer, name="status-journal", daemon=True
+                    )
+                    self._writer.start()
+        self._queue.put(self._encode(transition))
+
+    def flush(self) -> None:
+        """等待佇列中的記錄寫入檔案"""
+        self._queue.join()
+
+    def close(self) -> None:
+        """寫完佇列中的記錄後停止背景執行緒"""
+        with self._lock:
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            self._queue.put(None)
+            writer.join()
+
+    # 查詢 -----------------------------------------------------------------
+
+    def _refresh_index(self) -> List[_SegmentIndex]:
+        # 讀檔與建立索引不持有 lock，完成後才替換 (同時進行的查詢各自建立，最後一個生效)
+        with self._lock:
+            current = dict(self._indexes)
+        indexes: Dict[Path, _SegmentIndex] = {}
+        for path in self.directory.glob("segment-*.jsonl"):
+            index = current.get(path)
+            if index is None:
+                index = _SegmentIndex(path)
+                index.update()
+            else:
+                index = index.updated()
+            indexes[path] = index
+        with self._lock:
+            self._indexes = indexes
+        return list(indexes.values())
+
+    @staticmethod
+    def _scan(index: _SegmentIndex, start: float, end: float) -> Iterator[Tuple[float, bytes]]:
+        try:
+            f = open(index.path, "rb")
+        except FileNotFoundError:
+            return  # 查詢期間 segment 被輪替刪除
+        with f:
+            f.seek(index.seek_offset(start))
+            read = f.tell()
+            for line in f:
+                read += len(line)
+                if read > index.indexed_bytes:
+                    break
+                try:
+                    ts = json.loads(line)["t"]
+                except (ValueError, KeyError):
+                    continue
+                if ts < start:
+                    continue
+                if ts > end:
+                    break
+                yield ts, line
+
+    def query(
+        self,
+        start: datetime,
+        end: datetime,
+        serial: Optional[str] = None,
+        pool: Optional[Tuple[Optional[str], Optional[str], Optional[str]]] = None,
+        limit: int = 1000,
+    ) -> List[StatusTransition]:
+        """
+        查詢 [start, end] 區間的狀態變更，依時間排序。
+        pool 為 (vendor, model, version)，None 的欄位不過濾。
+        """
+        start_ts, end_ts = start.timestamp(), end.timestamp()
+        self.flush()  # 包含本 process 剛記錄的變更
+        indexes = [
+            i for i in self._refresh_index()
+            if i.first_ts is not None and i.last_ts >= start_ts and i.first_ts <= end_ts
+        ]
+
+        results = []
+        for _, line in heapq.merge(*(self._scan(i, start_ts, end_ts) for i in indexes)):
+            transition = self._decode(line)
+            if serial and transition.serial != serial:
+                continue
+            if pool and any(
+                want and want != have
+                for want, have in zip(pool, (transition.vendor, transition.model, transition.version))
+            ):
+                continue
+            results.append(transition)
+            if len(results) >= limit:
+                break
+        return results
@@ -0,0 +1,76 @@
+import asyncio
+import ipaddress
+import logging
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.models.machine import Machine
+
+logger = logging.getLogger(__name__)
+
+# (default gateway, 所在網段)
+GroupKey = Tuple[str, str]
+
+
+def group_key(machine: Machine) -> Optional[GroupKey]:
+    """依 default_gateway 與 mgmt_ip/netmask 算出的網段分組；沒有 gateway 的機器不分組"""
+    if not machine.default_gateway:
+        return None
+    network = ""
+    if machine.netmask:
+        try:
+            network = str(ipaddress.ip_interface(f"{machine.mgmt_ip}/{machine.netmask}").network)
+        except ValueError:
+            pass
+    return machine.default_gateway, network
+
+
+class GatewayProber:
+    """
+    先探測各網段的 gateway，gateway 不通的網段不需要逐台 ping。
+    gateway 不回應時再 ping 網段中的一台機器 (輪流) 確認：
+    有些 gateway 會擋 ICMP，代表機器通了就不把 gateway 視為斷線。
+    """
+
+    def __init__(self, connector, min_group_size: int = 2):
+        self.connector = connector
+        # 機器數少於此值的網段直接逐台探測 (多探一次 gateway 不划算)；0 表示停用
+        self.min_group_size = min_group_size
+        self._rotation: Dict[GroupKey, int] = defaultdict(int)
+
+    def _groups(self, machines: Iterable[Machine]) -> Dict[GroupKey, List[Machine]]:
+        groups: Dict[GroupKey, List[Machine]] = defaultdict(list)
+        for machine in machines:
+            key = group_key(machine)
+            if key is not None:
+                groups[key].append(machine)
+        return {key: members for key, members in groups.items() if len(members) >= self.min_group_size}
+
+    async def down_groups(self, machines: Iterable[Machine]) -> Dict[GroupKey, List[Machine]]:
+        """回傳 gateway 與代表機器都不通的網段及其機器"""
+        if self.min_group_size <= 0:
+            return {}
+        groups = self._groups(machines)
+        if not groups:
+            return {}
+
+        gateways = sorted({gateway for gateway, _ in groups})
+        results = await asyncio.gather(*(self.connector.is_reachable(gw) for gw in gateways))
+        down_gateways = {gw for gw, reachable in zip(gateways, results) if not reachable}
+
+        down: Dict[GroupKey, List[Machine]] = {}
+        for key, members in groups.items():
+            if key[0] not in down_gateways:
+                continue
+            index = self._rotation[key] % len(members)
+            self._rotation[key] += 1
+            representative = members[index]
+            if await self.connector.is_reachable(representative.mgmt_ip):
+                logger.debug(
+                    f"Gateway {key[0]} does not answer ping but {representative.serial} does; "
+                    f"probing {key[1] or key[0]} per device."
+                )
+                continue
+            logger.info(f"Gateway {key[0]} is down; skipping {len(members)} devices in {key[1] or key[0]}.")
+            down[key] = members
+        return down
@@ -0,0 +1,352 @@
+import asyncio
+import fnmatch
+import json
+import logging
+import os
+import random
+import re
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from app.models.history import StatusTransition
+from app.models.webhook import WebhookStats, WebhookSubscription
+
+logger = logging.getLogger(__name__)
+
+_INFLIGHT = ".inflight-"
+
+
+def parse_subscriptions(data: Optional[Dict[str, Any]]) -> List[WebhookSubscription]:
+    """
+    解析 webhooks.yaml。
+    格式:
+        subscriptions:
+          - name: scheduler
+            url: http://scheduler.lab/hooks/pools
+            pools: ["cisco/n9k/*"]
+            statuses: [available]
+            headers: {Authorization: "Bearer ..."}
+    """
+    items = (data or {}).get("subscriptions") or []
+    if not isinstance(items, list):
+        raise ValueError("webhooks.yaml 'subscriptions' must be a list")
+    subscriptions = [WebhookSubscription(**(item or {})) for item in items]
+    names = [s.name for s in subscriptions]
+    duplicates = {name for name in names if names.count(name) > 1}
+    if duplicates:
+        raise ValueError(f"Duplicate webhook subscription names: {sorted(duplicates)}")
+    return subscriptions
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class _Spool:
+    """
+    單一訂閱的磁碟佇列，每個批次一個 JSON 檔，依檔名 (時間) 先進先出。
+    送出前以 rename 取得檔案，多個 process 共用目錄時不會重複送出。
+    所有方法都會做檔案 I/O，需在 event loop 以外的執行緒呼叫。
+    """
+
+    def __init__(self, directory: Path, max_batches: int):
+        self.directory = directory
+        self.max_batches = max_batches
+        self._sequence = 0
+
+    def _batches(self) -> List[Path]:
+        try:
+            return sorted(self.directory.glob("*.json"))
+        except OSError:
+            return []
+
+    def count(self) -> int:
+        return len(self._batches())
+
+    def recover(self) -> None:
+        """把已結束的 process 留下、送到一半的批次放回佇列"""
+        if not self.directory.is_dir():
+            return
+        for path in self.directory.glob(f"*.json{_INFLIGHT}*"):
+            original, _, pid = path.name.rpartition(_INFLIGHT)
+            if pid.isdigit() and (int(pid) == os.getpid() or not _pid_alive(int(pid))):
+                try:
+                    path.rename(self.directory / original)
+                except OSError:
+                    pass
+
+    def put(self, events: List[Dict[str, Any]]) -> int:
+        """寫入一個批次，回傳因超過上限而丟棄的事件數"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._sequence += 1
+        name = f"{time.time_ns():020d}-{os.getpid()}-{self._sequence:06d}.json"
+        tmp = self.directory / f".{name}.tmp"
+        tmp.write_text(json.dumps(events), encoding="utf-8")
+        os.replace(tmp, self.directory / name)
+
+        dropped = 0
+        batches = self._batches()
+        for path in batches[: max(len(batches) - self.max_batches, 0)]:
+            try:
+                dropped += len(json.loads(path.read_text(encoding="utf-8")))
+                path.unlink()
+            except (OSError, ValueError):
+                continue
+        return dropped
+
+    def claim(self) -> Optional[Tuple[Path, List[Dict[str, Any]]]]:
+        for path in self._batches():
+            claimed = path.with_name(f"{path.name}{_INFLIGHT}{os.getpid()}")
+            try:
+                path.rename(claimed)
+            except OSError:
+                continue  # 其他 process 已取走
+            try:
+                return claimed, json.loads(claimed.read_text(encoding="utf-8"))
+            except (OSError, ValueError) as e:
+                logger.error(f"Discarding unreadable webhook batch {path}: {e}")
+                claimed.unlink(missing_ok=True)
+        return None
+
+    @staticmethod
+    def ack(claimed: Path) -> None:
+        claimed.unlink(missing_ok=True)
+
+    @staticmethod
+    def release(claimed: Path) -> None:
+        original = claimed.name.rpartition(_INFLIGHT)[0]
+        try:
+            claimed.rename(claimed.with_name(original))
+        except OSError:
+            pass
+
+
+class _Subscriber:
+    def __init__(self, dispatcher: "WebhookDispatcher", subscription: WebhookSubscription):
+        self.dispatcher = dispatcher
+        self.subscription = subscription
+        self.queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(maxsize=dispatcher.buffer_size)
+        directory = re.sub(r"[^A-Za-z0-9_.-]", "_", subscription.name)
+        self.spool = _Spool(dispatcher.queue_dir / directory, dispatcher.queue_max)
+        self.spooled = 0
+        self.delivered = 0
+        self.failed_attempts = 0
+        self.dropped = 0
+        self.last_error: Optional[str] = None
+        self._overflow_logged = False
+
+    def matches(self, transition: StatusTransition) -> bool:
+        sub = self.subscription
+        if sub.statuses and transition.to_status not in sub.statuses:
+            return False
+        if sub.pools:
+            pool = f"{transition.vendor}/{transition.model}/{transition.version}"
+            return any(fnmatch.fnmatchcase(pool, pattern) for pattern in sub.pools)
+        return True
+
+    def offer(self, event: Dict[str, Any]) -> None:
+        try:
+            self.queue.put_nowait(event)
+            self._overflow_logged = False
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if not self._overflow_logged:
+                logger.warning(f"Webhook '{self.subscription.name}' buffer full; dropping events.")
+                self._overflow_logged = True
+
+    async def _collect(self, batch: List[Dict[str, Any]]) -> None:
+        """第一個事件到達後等待 batch_window 秒，合併成一個批次"""
+        deadline = time.monotonic() + self.dispatcher.batch_window
+        while len(batch) < self.dispatcher.batch_max:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+
+    async def _post(self, events: List[Dict[str, Any]]) -> bool:
+        """送出一個批次，可重試的錯誤以指數退避重試；回傳 False 表示應暫存到磁碟"""
+        sub = self.subscription
+        payload = {"subscription": sub.name, "events": events}
+        retries = self.dispatcher.max_retries
+        for attempt in range(retries + 1):
+            try:
+                response = await self.dispatcher.client.post(sub.url, json=payload, headers=sub.headers)
+            except httpx.HTTPError as e:
+                error = f"{type(e).__name__}: {e}"
+            else:
+                if response.status_code < 300:
+                    self.delivered += len(events)
+                    self.last_error = None
+                    return True
+                error = f"HTTP {response.status_code}"
+                if 400 <= response.status_code < 500 and response.status_code not in (408, 429):
+                    # 對方拒絕這個內容，重送也不會成功
+                    logger.error(f"Webhook '{sub.name}' rejected {len(events)} events: {error}")
+                    self.dropped += len(events)
+                    self.last_error = error
+                    return True
+            self.failed_attempts += 1
+            self.last_error = error
+            if attempt < retries:
+                delay = min(self.dispatcher.retry_base * 2 ** attempt, self.dispatcher.retry_max)
+                await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+        logger.warning(f"Webhook '{sub.name}' unreachable after {retries + 1} attempts: {self.last_error}")
+        return False
+
+    async def _spool(self, events: List[Dict[str, Any]]) -> None:
+        try:
+            self.dropped += await asyncio.to_thread(self.spool.put, events)
+        except OSError as e:
+            logger.error(f"Cannot spool webhook batch for '{self.subscription.name}': {e}")
+            self.dropped += len(events)
+        self.spooled = await asyncio.to_thread(self.spool.count)
+
+    async def _drain_spool(self) -> bool:
+        """依序送出磁碟上的批次；回傳 False 表示對方仍無法連線"""
+        while True:
+            claimed = await asyncio.to_thread(self.spool.claim)
+            if claimed is None:
+                self.spooled = 0
+                return True
+            path, events = claimed
+            if not await self._post(events):
+                await asyncio.to_thread(self.spool.release, path)
+                self.spooled = await asyncio.to_thread(self.spool.count)
+                return False
+            await asyncio.to_thread(self.spool.ack, path)
+
+    async def run(self) -> None:
+        await asyncio.to_thread(self.spool.recover)
+        self.spooled = await asyncio.to_thread(self.spool.count)
+        batch: List[Dict[str, Any]] = []
+        try:
+            while True:
+                try:
+                    # 有暫存的批次時定期重試，否則等新事件
+                    idle = self.dispatcher.retry_max if self.spooled else None
+                    try:
+                        batch = [await asyncio.wait_for(self.queue.get(), idle)]
+                    except asyncio.TimeoutError:
+                        await self._drain_spool()
+                        continue
+                    await self._collect(batch)
+                    # 先送舊的批次以維持順序；對方仍無法連線時新批次也直接暫存
+                    if not await self._drain_spool() or not await self._post(batch):
+                        await self._spool(batch)
+                    batch = []
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Webhook '{self.subscription.name}' worker error: {e}")
+                    await asyncio.sleep(self.dispatcher.retry_base)
+        except asyncio.CancelledError:
+            leftover = batch + [self.queue.get_nowait() for _ in range(self.queue.qsize())]
+            if leftover:
+                # 關閉時把還沒送出的事件留在磁碟上，下次啟動再送
+                try:
+                    self.spool.put(leftover)
+                except OSError as e:
+                    logger.error(f"Lost {len(leftover)} webhook events for '{self.subscription.name}': {e}")
+            raise
+
+    def stats(self) -> WebhookStats:
+        return WebhookStats(
+            name=self.subscription.name,
+            url=self.subscription.url,
+            buffered=self.queue.qsize(),
+            spooled=self.spooled,
+            delivered_events=self.delivered,
+            failed_attempts=self.failed_attempts,
+            dropped_events=self.dropped,
+            last_error=self.last_error,
+        )
+
+
+class WebhookDispatcher:
+    """
+    狀態變更的 webhook 通知。
+    on_transition 只把事件放進各訂閱的記憶體佇列 (不做 I/O，不會拖慢 MachineManager)；
+    每個訂閱有自己的背景 task，在 batch_window 秒內合併事件，透過共用的 httpx.AsyncClient 送出。
+    送不出去的批次暫存在 queue_dir (每個訂閱最多 queue_max 個批次，超過時丟棄最舊的)，
+    之後依序重送。transport 供測試替換成本地的 HTTP stand-in。
+    """
+
+    def __init__(
+        self,
+        subscriptions: List[WebhookSubscription],
+        queue_dir: Path,
+        batch_window: float = 2.0,
+        batch_max: int = 100,
+        max_retries: int = 5,
+        retry_base: float = 1.0,
+        retry_max: float = 60.0,
+        timeout: float = 5.0,
+        queue_max: int = 1000,
+        buffer_size: int = 10000,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.queue_dir = queue_dir
+        self.batch_window = batch_window
+        self.batch_max = batch_max
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.timeout = timeout
+        self.queue_max = queue_max
+        self.buffer_size = buffer_size
+        self.transport = transport
+        self.client: Optional[httpx.AsyncClient] = None
+        self._subscribers = [_Subscriber(self, s) for s in subscriptions]
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def subscriptions(self) -> List[WebhookSubscription]:
+        return [s.subscription for s in self._subscribers]
+
+    def on_transition(self, transition: StatusTransition) -> None:
+        event = None
+        for subscriber in self._subscribers:
+            if subscriber.matches(transition):
+                if event is None:
+                    event = transition.model_dump(mode="json")
+                subscriber.offer(event)
+
+    async def start(self) -> None:
+        if self._tasks or not self._subscribers:
+            return
+        self.client = httpx.AsyncClient(timeout=self.timeout, transport=self.transport)
+        self._tasks = [
+            asyncio.create_task(subscriber.run(), name=f"webhook-{subscriber.subscription.name}")
+            for subscriber in self._subscribers
+        ]
+        logger.info(f"Webhook dispatcher started with {len(self._subscribers)} subscriptions.")
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                logger.error(f"Webhook task failed: {e}")
+        self._tasks = []
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    def stats(self) -> List[WebhookStats]:
+        return [subscriber.stats() for subscriber in self._subscribers]
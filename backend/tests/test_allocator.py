@@ -0,0 +1,101 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from app.models.machine import Machine
+from app.services.allocator import POLICIES, AllocationPolicy, get_policy
+from app.services.pools import PoolConfig
+
+
+def make_machine(serial, **kwargs):
+    return Machine(
+        vendor="cisco",
+        model="n9k",
+        version="1.0",
+        mgmt_ip="10.0.0.1",
+        serial=serial,
+        hostname="lab",
+        **kwargs,
+    )
+
+
+@pytest.fixture
+def machines():
+    return [
+        make_machine(
+            "A",
+            last_reserved_at=datetime(2024, 1, 3, tzinfo=timezone.utc),
+            reservation_count=7,
+            avg_reboot_seconds=300,
+        ),
+        make_machine("B", reservation_count=2),
+        make_machine(
+            "C",
+            last_reserved_at=datetime(2024, 1, 1, tzinfo=timezone.utc),
+            reservation_count=4,
+            avg_reboot_seconds=120,
+        ),
+    ]
+
+
+def order(policy, machines):
+    return [m.serial for m in get_policy(policy).order(machines)]
+
+
+def test_first_keeps_config_order(machines):
+    assert order("first", machines) == ["A", "B", "C"]
+
+
+def test_least_recently_used_prefers_never_used(machines):
+    assert order("least_recently_used", machines) == ["B", "C", "A"]
+
+
+def test_fewest_reservations(machines):
+    assert order("fewest_reservations", machines) == ["B", "C", "A"]
+
+
+def test_fastest_reset_puts_unknown_last(machines):
+    assert order("fastest_reset", machines) == ["C", "A", "B"]
+
+
+def test_random_returns_permutation(machines):
+    assert sorted(order("random", machines)) == ["A", "B", "C"]
+
+
+def test_get_policy_rejects_unknown():
+    with pytest.raises(ValueError):
+        get_policy("bogus")
+    assert "first" in POLICIES
+
+
+def test_incomplete_policy_cannot_be_instantiated():
+    class Incomplete(AllocationPolicy):
+        name = "incomplete"
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_pool_config_prefers_most_specific_key():
+    pools = PoolConfig(
+        {
+            "default": {"allocation_policy": "random"},
+            "pools": {
+                "cisco": {"allocation_policy": "least_recently_used"},
+                "cisco/n9k/9.3(13)": {"allocation_policy": "fastest_reset"},
+            },
+        }
+    )
+
+    assert pools.for_pool("hp", "5945", "1.0").allocation_policy == "random"
+    assert pools.for_pool("cisco", "c8k", "17").allocation_policy == "least_recently_used"
+    assert pools.for_pool("cisco", "n9k", "9.3(13)").allocation_policy == "fastest_reset"
+
+
+def test_pool_config_validates_entries():
+    with pytest.raises(ValueError):
+        PoolConfig({"pools": {"cisco": {"allocation_policy": "bogus"}}})
+    with pytest.raises(ValueError):
+        PoolConfig({"pools": {"a/b/c/d": {}}})
+    with pytest.raises(ValueError):
+        PoolConfig({"default": {"unknown_key": 1}})
@@ -0,0 +1,142 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+from app.models.history import StatusTransition
+from app.models.machine import Machine, MachineStatus
+from app.services import analytics as analytics_module
+from app.services.analytics import PoolAnalytics, sample_pool_analytics
+from app.services.state_store import SQLiteStateStore
+
+
+def make_machine(serial="S1", status=MachineStatus.AVAILABLE):
+    return Machine(
+        vendor="cisco",
+        model="n9k",
+        version="1.0",
+        mgmt_ip="10.0.0.1",
+        serial=serial,
+        hostname="lab",
+        status=status,
+    )
+
+
+def transition(ts, from_status, to_status, serial="S1"):
+    return StatusTransition(
+        timestamp=datetime.fromtimestamp(ts, tz=timezone.utc),
+        serial=serial,
+        vendor="cisco",
+        model="n9k",
+        version="1.0",
+        from_status=from_status,
+        to_status=to_status,
+    )
+
+
+def test_sample_accumulates_status_time_and_occupancy():
+    analytics = PoolAnalytics()
+    machines = [make_machine("S1", MachineStatus.UNAVAILABLE), make_machine("S2")]
+
+    analytics.sample(machines, now=600)
+    analytics.sample(machines, now=630)
+    machines[1].status = MachineStatus.UNREACHABLE
+    analytics.sample(machines, now=640)
+
+    [pool] = analytics.summarize(window_minutes=5, now=650)
+    assert pool.machine_seconds == 80
+    assert pool.occupancy == 0.5
+    assert pool.unreachable_seconds == 10
+    assert pool.status_seconds == {"unavailable": 40, "available": 30, "unreachable": 10}
+
+
+def test_sample_caps_gap_between_samples():
+    analytics = PoolAnalytics()
+    machines = [make_machine()]
+
+    analytics.sample(machines, now=0)
+    analytics.sample(machines, now=3600, max_gap=60)
+
+    [pool] = analytics.summarize(window_minutes=5, now=3600)
+    assert pool.machine_seconds == 60
+
+
+def test_reserve_outcomes_and_window():
+    analytics = PoolAnalytics()
+    analytics.record_reserve("cisco", "n9k", "1.0", True, now=0)
+    analytics.record_reserve("cisco", "n9k", "1.0", False, now=600)
+    analytics.record_reserve("cisco", "n9k", "1.0", True, now=610)
+
+    [recent] = analytics.summarize(window_minutes=1, now=620)
+    assert recent.reserve_requests == 2
+    assert recent.reserve_not_found == 1
+    assert recent.reserve_success_rate == 0.5
+
+    [all_time] = analytics.summarize(window_minutes=60, now=620)
+    assert all_time.reserve_requests == 3
+
+
+def test_mean_time_to_available_after_release():
+    analytics = PoolAnalytics()
+    analytics.on_transition(transition(100, MachineStatus.UNAVAILABLE, MachineStatus.REBOOTING))
+    analytics.on_transition(transition(160, MachineStatus.REBOOTING, MachineStatus.UNREACHABLE))
+    analytics.on_transition(transition(280, MachineStatus.UNREACHABLE, MachineStatus.AVAILABLE))
+    # 沒有經過重啟的恢復不計入
+    analytics.on_transition(transition(300, MachineStatus.UNREACHABLE, MachineStatus.AVAILABLE, serial="S2"))
+
+    [pool] = analytics.summarize(window_minutes=10, now=300)
+    assert pool.recoveries == 1
+    assert pool.mean_time_to_available == 180
+
+
+def test_retention_drops_old_buckets():
+    analytics = PoolAnalytics(retention_minutes=2)
+    for minute in range(5):
+        analytics.record_reserve("cisco", "n9k", "1.0", True, now=minute * 60)
+
+    [pool] = analytics.summarize(window_minutes=10, now=4 * 60)
+    assert pool.reserve_requests == 2
+
+
+@pytest.mark.asyncio
+async def test_shared_store_combines_workers(tmp_path):
+    path = tmp_path / "state.db"
+    leader = PoolAnalytics(store=SQLiteStateStore(path))
+    follower = PoolAnalytics(store=SQLiteStateStore(path))
+    machines = [make_machine("S1", MachineStatus.UNAVAILABLE)]
+    # 寫入 store 時會刪除超過保留期限的資料，使用接近目前的時間
+    base = int(time.time() // 60) * 60
+
+    leader.sample(machines, now=base + 0)
+    leader.sample(machines, now=base + 30)
+    leader.record_reserve("cisco", "n9k", "1.0", True, now=base + 30)
+    follower.record_reserve("cisco", "n9k", "1.0", False, now=base + 40)
+    await follower.flush()
+
+    for analytics in (leader, follower):
+        [pool] = await analytics.report(window_minutes=5, now=base + 50)
+        assert pool.reserve_requests == 2
+        assert pool.reserve_success == 1
+        assert pool.machine_seconds == 30
+
+
+@pytest.mark.asyncio
+async def test_sampler_skips_status_time_on_followers(monkeypatch):
+    class Follower:
+        is_leader = False
+
+    class Manager:
+        async def get_machines(self):
+            raise AssertionError("followers must not sample")
+
+    analytics = PoolAnalytics()
+    analytics._last_sample = 0.0
+
+    async def stop(_interval):
+        raise asyncio.CancelledError
+
+    monkeypatch.setattr(analytics_module.asyncio, "sleep", stop)
+    await sample_pool_analytics(Manager(), analytics, Follower())
+
+    assert analytics._last_sample is None
@@ -1,10 +1,23 @@
+import fnmatch
+import json
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
 import pytest
 import pytest_asyncio
 from httpx import ASGITransport, AsyncClient
 
-from app.api.deps import get_machine_manager
+from app.api.deps import get_idempotency_cache, get_machine_manager, get_webhook_dispatcher
 from app.main import app
-from app.models.machine import Machine, MachineStatus, ReleaseResult
+from app.models.machine import LeaseResult, Machine, MachineStatus, RefreshResult, ReleaseResult
+from app.models.history import StatusTransition
+from app.models.pool import HotSpareStatus
+from app.services.analytics import PoolAnalytics
+from app.services.facets import MachineFacets
+from app.services.idempotency import IdempotencyCache
+from app.services.ssh_executor import SSHExecutor
+from app.services.status_journal import StatusJournal
+from app.services.webhooks import WebhookDispatcher, parse_subscriptions
 
 pytestmark = pytest.mark.asyncio
 
@@ -42,11 +55,13 @@ class FakeMachineManager:
         }
         self.release_outcomes = {}
         self.reload_should_raise = False
+        self.journal = None
+        self.analytics = None
 
     async def initialize_status(self):
         return None
 
-    def get_machines(
+    async def get_machines(
         self,
         vendor=None,
         model=None,
@@ -62,17 +77,44 @@ class FakeMachineManager:
             and (status is None or m.status == status)
         ]
 
-    def get_machine(self, serial):
+    async def get_machine(self, serial):
         return self.machines.get(serial)
 
-    async def reserve_machine(self, vendor, model, version):
-        for machine in self.get_machines(
+    async def machine_summary(self):
+        facets = MachineFacets()
+        facets.rebuild(self.machines.values())
+        return facets.summary()
+
+    async def reserve_machine(self, vendor, model, version, owner=None, ttl=None):
+        for machine in await self.get_machines(
             vendor=vendor, model=model, version=version, status=MachineStatus.AVAILABLE
         ):
             machine.status = MachineStatus.UNAVAILABLE
+            machine.lease_owner = owner
             return machine
         return None
 
+    async def reserve_matching(self, query, owner=None, ttl=None):
+        self.last_query = query
+        for machine in await self.get_machines(status=MachineStatus.AVAILABLE):
+            if fnmatch.fnmatchcase(machine.vendor, query.vendor) and (
+                not query.hostname_prefix or machine.hostname.startswith(query.hostname_prefix)
+            ):
+                machine.status = MachineStatus.UNAVAILABLE
+                machine.lease_owner = owner
+                return machine
+        return None
+
+    async def renew_lease(self, serial, owner=None, ttl=None):
+        machine = self.machines.get(serial)
+        if machine is None:
+            return LeaseResult.NOT_FOUND
+        if machine.status != MachineStatus.UNAVAILABLE:
+            return LeaseResult.NOT_RESERVED
+        if owner is not None and machine.lease_owner not in (None, owner):
+            return LeaseResult.OWNER_MISMATCH
+        return LeaseResult.SUCCESS
+
     async def release_machine(self, serial):
         machine = self.machines.get(serial)
         if machine is None:
@@ -83,6 +125,25 @@ class FakeMachineManager:
             machine.status = MachineStatus.REBOOTING
         return outcome
 
+    async def hot_spare_report(self):
+        return [
+            HotSpareStatus(
+                vendor="cisco", model="n9k", version="9.3",
+                target=2, verified=1, available=1, deficit=1,
+            )
+        ]
+
+    async def refresh_machines(self, machines, concurrency=16):
+        for machine in machines:
+            previous = machine.status
+            machine.status = MachineStatus.AVAILABLE
+            yield RefreshResult(
+                serial=machine.serial,
+                previous_status=previous,
+                status=machine.status,
+                changed=previous != machine.status,
+            )
+
     async def reload_machines(self):
         if self.reload_should_raise:
             raise RuntimeError("reload failed")
@@ -110,12 +171,19 @@ def auth_headers(api_token):
 
 
 @pytest_asyncio.fixture
-async def client(fake_manager, auth_headers):
+async def client(fake_manager, auth_headers, tmp_path):
     original_overrides = app.dependency_overrides.copy()
     async def override_get_manager():
         return fake_manager
 
     app.dependency_overrides[get_machine_manager] = override_get_manager
+    idempotency_cache = IdempotencyCache()
+    app.dependency_overrides[get_idempotency_cache] = lambda: idempotency_cache
+    webhooks = WebhookDispatcher(
+        parse_subscriptions({"subscriptions": [{"name": "bot", "url": "http://bot.test/hook"}]}),
+        queue_dir=tmp_path / "webhooks",
+    )
+    app.dependency_overrides[get_webhook_dispatcher] = lambda: webhooks
 
     transport = ASGITransport(app=app)
     async with AsyncClient(
@@ -152,6 +220,18 @@ async def test_list_machines_filters_by_status(client):
     assert [m["serial"] for m in machines] == ["S2"]
 
 
+async def test_machine_summary_counts_by_pool_and_status(client):
+    response = await client.get("/machines/summary")
+    assert response.status_code == 200
+    payload = response.json()
+    assert payload["total"] == 3
+    assert payload["vendors"]["cisco"]["n9k"]["9.3"] == {
+        MachineStatus.AVAILABLE.value: 1,
+        MachineStatus.UNAVAILABLE.value: 1,
+    }
+    assert payload["by_status"][MachineStatus.UNREACHABLE.value] == 1
+
+
 async def test_reserve_machine_success(client, fake_manager):
     response = await client.post("/reserve/cisco/n9k/9.3")
     assert response.status_code == 200
@@ -168,6 +248,60 @@ async def test_reserve_machine_returns_404_when_unavailable(client, fake_manager
     assert response.json()["detail"] == "No available machines found"
 
 
+async def test_reserve_machine_passes_owner(client, fake_manager):
+    response = await client.post("/reserve/cisco/n9k/9.3", params={"owner": "job-1", "ttl": 60})
+    assert response.status_code == 200
+    assert response.json()["lease_owner"] == "job-1"
+
+
+async def test_reserve_machine_rejects_negative_ttl(client):
+    response = await client.post("/reserve/cisco/n9k/9.3", params={"ttl": -1})
+    assert response.status_code == 422
+
+
+async def test_reserve_matching_passes_query(client, fake_manager):
+    response = await client.post(
+        "/reserve",
+        json={"vendor": "cis*", "min_version": "9.0", "hostname_prefix": "leaf-"},
+        params={"owner": "job-1"},
+    )
+    assert response.status_code == 200
+    assert response.json()["serial"] == "S1"
+    assert response.json()["lease_owner"] == "job-1"
+    assert fake_manager.last_query.min_version == "9.0"
+
+
+async def test_reserve_matching_returns_404_when_nothing_matches(client):
+    response = await client.post("/reserve", json={"hostname_prefix": "spine-"})
+    assert response.status_code == 404
+
+
+async def test_reserve_matching_rejects_invalid_query(client):
+    assert (await client.post("/reserve", json={"subnet": "not-a-network"})).status_code == 422
+    assert (await client.post("/reserve", json={"serial": "S1"})).status_code == 422
+
+
+async def test_heartbeat_success(client, fake_manager):
+    response = await client.post("/reservations/S2/heartbeat", params={"ttl": 60})
+    assert response.status_code == 200
+    assert response.json()["serial"] == "S2"
+
+
+async def test_heartbeat_not_found(client):
+    response = await client.post("/reservations/UNKNOWN/heartbeat")
+    assert response.status_code == 404
+
+
+async def test_heartbeat_conflicts(client, fake_manager):
+    response = await client.post("/reservations/S1/heartbeat")
+    assert response.status_code == 409
+    assert response.json()["detail"] == "Machine S1 is not reserved"
+
+    fake_manager.machines["S2"].lease_owner = "job-1"
+    response = await client.post("/reservations/S2/heartbeat", params={"owner": "job-2"})
+    assert response.status_code == 409
+
+
 async def test_release_machine_success(client, fake_manager):
     fake_manager.machines["S2"].status = MachineStatus.UNAVAILABLE
     response = await client.post("/release/S2")
@@ -202,6 +336,159 @@ async def test_release_machine_unknown_error(client, fake_manager):
     assert response.json()["detail"] == "Unknown error"
 
 
+async def test_reserve_retry_with_idempotency_key_returns_same_machine(client, fake_manager):
+    headers = {"Idempotency-Key": "job-42"}
+    first = await client.post("/reserve/cisco/n9k/9.3", headers=headers)
+    retry = await client.post("/reserve/cisco/n9k/9.3", headers=headers)
+
+    assert first.status_code == retry.status_code == 200
+    assert retry.json()["serial"] == first.json()["serial"]
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    # 只有一台可借，沒有 key 的重試會得到 404
+    assert await fake_manager.get_machines(status=MachineStatus.AVAILABLE) == []
+
+
+async def test_idempotency_key_reused_for_other_request_is_rejected(client):
+    headers = {"Idempotency-Key": "job-42"}
+    await client.post("/reserve/cisco/n9k/9.3", headers=headers)
+    response = await client.post("/release/S1", headers=headers)
+    assert response.status_code == 422
+
+
+async def test_release_retry_with_idempotency_key_replays_response(client, fake_manager):
+    headers = {"Idempotency-Key": "release-1"}
+    fake_manager.machines["S2"].status = MachineStatus.UNAVAILABLE
+    first = await client.post("/release/S2", headers=headers)
+    fake_manager.release_outcomes["S2"] = ReleaseResult.FAILED
+    retry = await client.post("/release/S2", headers=headers)
+
+    assert retry.status_code == 200
+    assert retry.json() == first.json()
+
+
+async def test_bulk_refresh_streams_ndjson(client):
+    response = await client.post(
+        "/admin/refresh", params={"serial": ["S3", "NOPE"], "concurrency": 2}
+    )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines[0] == {**lines[0], "serial": "NOPE", "error": "not found"}
+    assert lines[1]["serial"] == "S3"
+    assert lines[1]["changed"] is True
+
+
+async def test_bulk_refresh_filters_by_vendor(client):
+    response = await client.post("/admin/refresh", params={"vendor": "cisco"})
+    serials = [json.loads(line)["serial"] for line in response.text.splitlines()]
+    assert serials == ["S1", "S2"]
+
+
+async def test_list_hot_spares(client):
+    response = await client.get("/pools/hot-spares")
+    assert response.status_code == 200
+    pool = response.json()["pools"][0]
+    assert pool["deficit"] == 1
+    assert pool["target"] == 2
+
+
+async def test_history_requires_journal(client):
+    response = await client.get("/history")
+    assert response.status_code == 503
+
+
+async def test_history_returns_transitions(client, fake_manager, tmp_path):
+    fake_manager.journal = StatusJournal(tmp_path)
+    now = datetime.now(timezone.utc)
+    for serial in ("S1", "S2"):
+        fake_manager.journal.append(
+            StatusTransition(
+                timestamp=now,
+                serial=serial,
+                vendor="cisco",
+                model="n9k",
+                version="9.3",
+                from_status=MachineStatus.AVAILABLE,
+                to_status=MachineStatus.UNAVAILABLE,
+                cause="reserve",
+            )
+        )
+
+    response = await client.get("/history", params={"serial": "S2"})
+    assert response.status_code == 200
+    transitions = response.json()["transitions"]
+    assert [t["serial"] for t in transitions] == ["S2"]
+    assert transitions[0]["to_status"] == MachineStatus.UNAVAILABLE.value
+
+
+async def test_history_rejects_inverted_range(client, fake_manager, tmp_path):
+    fake_manager.journal = StatusJournal(tmp_path)
+    response = await client.get(
+        "/history",
+        params={"start": "2024-01-02T00:00:00Z", "end": "2024-01-01T00:00:00Z"},
+    )
+    assert response.status_code == 400
+
+
+async def test_pool_analytics_requires_analytics(client):
+    response = await client.get("/analytics/pools")
+    assert response.status_code == 503
+
+
+async def test_pool_analytics_reports_reserve_outcomes(client, fake_manager):
+    fake_manager.analytics = PoolAnalytics(retention_minutes=60)
+    fake_manager.analytics.record_reserve("cisco", "n9k", "9.3", True)
+    fake_manager.analytics.record_reserve("cisco", "n9k", "9.3", False)
+
+    response = await client.get("/analytics/pools", params={"window": 5})
+    assert response.status_code == 200
+    pool = response.json()["pools"][0]
+    assert pool["reserve_requests"] == 2
+    assert pool["reserve_success_rate"] == 0.5
+    assert pool["window_minutes"] == 5
+
+
+async def test_responses_carry_server_timing_and_admin_timings(client):
+    response = await client.get("/machines")
+    assert "total;dur=" in response.headers["server-timing"]
+
+    response = await client.get("/admin/timings")
+    assert response.status_code == 200
+    routes = {(r["method"], r["route"]) for r in response.json()["routes"]}
+    assert ("GET", "/machines") in routes
+
+
+async def test_admin_profile_returns_collapsed_stacks(client):
+    response = await client.get("/admin/profile", params={"seconds": 0.05, "interval_ms": 5})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in response.text.splitlines())
+
+
+async def test_admin_ssh_pool_stats(client, fake_manager):
+    fake_manager.connector = SimpleNamespace(ssh_pool=SSHExecutor(max_workers=3))
+
+    response = await client.get("/admin/ssh-pool")
+    assert response.status_code == 200
+    assert response.json()["ssh_pool"]["max_workers"] == 3
+    assert response.json()["ssh_pool"]["queued"] == 0
+
+
+async def test_admin_webhooks_lists_subscription_stats(client):
+    response = await client.get("/admin/webhooks")
+    assert response.status_code == 200
+    [stats] = response.json()["subscriptions"]
+    assert stats["name"] == "bot"
+    assert stats["delivered_events"] == 0
+
+
+async def test_admin_loop_lag(client):
+    response = await client.get("/admin/loop-lag")
+    assert response.status_code == 200
+    assert "max_lag_ms" in response.json()["event_loop"]
+
+
 async def test_reload_configuration_success(client):
     response = await client.post("/admin/reload")
     assert response.status_code == 200
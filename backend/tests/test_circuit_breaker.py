@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+
+from app.models.machine import CircuitState, Machine
+from app.services import circuit_breaker
+from app.services.circuit_breaker import CircuitBreaker, CircuitOpenError
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(circuit_breaker.time, "monotonic", fake.monotonic)
+    return fake
+
+
+def make_machine():
+    return Machine(
+        vendor="cisco",
+        model="n9k",
+        version="9.3",
+        mgmt_ip="10.0.0.1",
+        serial="S1",
+        hostname="leaf1",
+    )
+
+
+def fail(breaker, machine):
+    with pytest.raises(RuntimeError):
+        with breaker.guard(machine):
+            raise RuntimeError("ssh timeout")
+
+
+def test_opens_after_threshold_and_fails_fast(clock):
+    breaker = CircuitBreaker(failure_threshold=2, cooldown=30)
+    machine = make_machine()
+
+    fail(breaker, machine)
+    assert machine.circuit_state == CircuitState.CLOSED
+    fail(breaker, machine)
+    assert machine.circuit_state == CircuitState.OPEN
+
+    with pytest.raises(CircuitOpenError):
+        with breaker.guard(machine):
+            pytest.fail("should not run while open")
+
+
+def test_half_open_allows_single_trial(clock):
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=30)
+    machine = make_machine()
+    fail(breaker, machine)
+
+    clock.now += 30
+    assert breaker.state("S1") == CircuitState.HALF_OPEN
+
+    with breaker.guard(machine):
+        # 試探進行中，其他呼叫直接失敗
+        with pytest.raises(CircuitOpenError):
+            with breaker.guard(machine):
+                pass
+    assert machine.circuit_state == CircuitState.CLOSED
+    assert machine.circuit_retry_at is None
+
+
+def test_failed_trial_reopens(clock):
+    breaker = CircuitBreaker(failure_threshold=3, cooldown=30)
+    machine = make_machine()
+    for _ in range(3):
+        fail(breaker, machine)
+
+    clock.now += 30
+    fail(breaker, machine)
+
+    assert breaker.state("S1") == CircuitState.OPEN
+
+
+def test_cancellation_is_not_counted_as_failure(clock):
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=30)
+    machine = make_machine()
+
+    with pytest.raises(asyncio.CancelledError):
+        with breaker.guard(machine):
+            raise asyncio.CancelledError
+
+    assert breaker.state("S1") == CircuitState.CLOSED
+
+
+def test_disabled_breaker_never_opens(clock):
+    breaker = CircuitBreaker(failure_threshold=0)
+    machine = make_machine()
+    for _ in range(5):
+        fail(breaker, machine)
+
+    assert breaker.state("S1") == CircuitState.CLOSED
@@ -103,3 +103,75 @@ def test_get_settings_returns_settings(monkeypatch, tmp_path):
     settings = get_settings()
 
     assert isinstance(settings, Settings)
+
+
+def test_state_backend_defaults_and_overrides(monkeypatch, tmp_path):
+    monkeypatch.setenv("CONFIG_DIR", str(tmp_path))
+    monkeypatch.delenv("STATE_BACKEND", raising=False)
+    monkeypatch.delenv("STATE_DB_PATH", raising=False)
+
+    settings = Settings()
+    assert settings.STATE_BACKEND == "memory"
+    assert settings.STATE_DB_PATH.name == "state.db"
+
+    monkeypatch.setenv("STATE_BACKEND", "SQLite")
+    monkeypatch.setenv("STATE_DB_PATH", str(tmp_path / "shared.db"))
+    settings = Settings()
+    assert settings.STATE_BACKEND == "sqlite"
+    assert settings.STATE_DB_PATH == tmp_path / "shared.db"
+
+
+def test_load_pool_config_is_optional(monkeypatch, tmp_path):
+    monkeypatch.setenv("CONFIG_DIR", str(tmp_path))
+    settings = Settings()
+    assert settings.load_pool_config() == {}
+
+    (tmp_path / "pools.yaml").write_text(
+        "default:\n  allocation_policy: random\n", encoding="utf-8"
+    )
+    assert settings.load_pool_config()["default"]["allocation_policy"] == "random"
+
+    (tmp_path / "pools.yaml").write_text("- bad\n", encoding="utf-8")
+    with pytest.raises(ValueError):
+        settings.load_pool_config()
+
+
+def test_device_snapshot_paths_prefer_data_dir_then_config_dir(monkeypatch, tmp_path):
+    monkeypatch.setenv("CONFIG_DIR", str(tmp_path))
+    monkeypatch.delenv("DEVICE_SNAPSHOT_DIR", raising=False)
+    monkeypatch.delenv("DEVICE_SNAPSHOT", raising=False)
+
+    settings = Settings()
+    paths = settings.device_snapshot_paths()
+
+    assert paths == [
+        settings.BASE_DIR / "data" / ".device.yaml.snapshot",
+        tmp_path / ".device.yaml.snapshot",
+    ]
+
+    monkeypatch.setenv("DEVICE_SNAPSHOT", "false")
+    assert Settings().device_snapshot_paths() == []
+
+
+def test_load_device_config_merges_fragments(monkeypatch, tmp_path):
+    (tmp_path / "device.yaml").write_text(
+        "cisco:\n  n9k:\n    '9.3':\n      - {serial: S1, mgmt_ip: 10.0.0.1}\n", encoding="utf-8"
+    )
+    fragments = tmp_path / "devices.d"
+    fragments.mkdir()
+    (fragments / "lab-b.yaml").write_text(
+        "cisco:\n  n9k:\n    '9.3':\n      - {serial: S2, mgmt_ip: 10.0.0.2}\n", encoding="utf-8"
+    )
+    monkeypatch.setenv("CONFIG_DIR", str(tmp_path))
+    monkeypatch.delenv("DEVICE_FRAGMENTS_DIR", raising=False)
+    monkeypatch.setenv("INVENTORY_PARSE_WORKERS", "1")
+
+    data = Settings().load_device_config()
+
+    assert [d["serial"] for d in data["cisco"]["n9k"]["9.3"]] == ["S1", "S2"]
+
+    (fragments / "lab-c.yaml").write_text(
+        "hp:\n  '5945':\n    '1.0':\n      - {serial: S1, mgmt_ip: 10.0.0.3}\n", encoding="utf-8"
+    )
+    with pytest.raises(ValueError, match="Duplicate serial S1"):
+        Settings().load_device_config()
@@ -5,15 +5,27 @@ from fastapi import HTTPException
 from fastapi.security import HTTPAuthorizationCredentials
 
 from app.api import deps
+from app.services.state_store import LocalStateStore
 
 
 @pytest.mark.asyncio
-async def test_get_machine_manager_caches_instance(monkeypatch):
+async def test_get_machine_manager_caches_instance(monkeypatch, tmp_path):
     class DummyManager:
-        pass
+        def __init__(self, **kwargs):
+            self.kwargs = kwargs
+
+    class DummySettings:
+        STATE_BACKEND = "memory"
+        RESERVATION_TTL = 0
+        RESERVATION_MAX_TTL = 3600
+        JOURNAL_DIR = tmp_path / "journal"
+        JOURNAL_SEGMENT_BYTES = 1024
+        JOURNAL_MAX_SEGMENTS = 2
+        ANALYTICS_RETENTION_MINUTES = 60
 
     deps._manager_instance = None
     monkeypatch.setattr(deps, "MachineManager", DummyManager)
+    monkeypatch.setattr(deps, "get_settings", lambda: DummySettings())
 
     first = await deps.get_machine_manager()
     second = await deps.get_machine_manager()
@@ -22,6 +34,26 @@ async def test_get_machine_manager_caches_instance(monkeypatch):
     assert first is second
 
 
+@pytest.mark.asyncio
+async def test_get_idempotency_cache_uses_settings(monkeypatch):
+    class DummySettings:
+        IDEMPOTENCY_TTL = 60
+        IDEMPOTENCY_MAX_KEYS = 5
+
+    class DummyManager:
+        state = LocalStateStore()
+
+    monkeypatch.setattr(deps, "_idempotency_cache", None)
+    monkeypatch.setattr(deps, "_manager_instance", DummyManager())
+    monkeypatch.setattr(deps, "get_settings", lambda: DummySettings())
+
+    cache = await deps.get_idempotency_cache()
+
+    assert cache is await deps.get_idempotency_cache()
+    assert (cache.ttl, cache.max_entries) == (60, 5)
+    assert cache.store is None  # 單一 process 的 store 不另外登記
+
+
 @pytest.mark.asyncio
 async def test_verify_bearer_token_missing_env_logs_error(monkeypatch, caplog):
     monkeypatch.delenv("API_BEARER_TOKEN", raising=False)
@@ -1,14 +1,29 @@
 import asyncio
 import subprocess
+import time
 
 import pytest
 
-from app.models.machine import Machine
+from app.models.machine import CircuitState, Machine
 from app.services import device_connector
+from app.services.circuit_breaker import CircuitOpenError
+from app.services.ssh_executor import PRIORITY_RESET, PRIORITY_VERIFY
 
 
-def make_connector(monkeypatch, credentials, default_cred):
+def make_connector(monkeypatch, credentials, default_cred, control_persist=0, control_dir=None):
     class DummySettings:
+        SSH_MAX_WORKERS = 2
+        SSH_CONTROL_PERSIST = control_persist
+        SSH_CONTROL_DIR = control_dir
+        PING_INITIAL_TIMEOUT_MS = 1000
+        PING_MIN_TIMEOUT_MS = 200
+        PING_MAX_TIMEOUT_MS = 3000
+        PING_LOSS_THRESHOLD = 2
+        PING_LOSS_WINDOW = 3
+        PING_HEDGE = True
+        SSH_BREAKER_THRESHOLD = 3
+        SSH_BREAKER_COOLDOWN = 60
+
         def load_credentials(self):
             return credentials, default_cred
 
@@ -69,8 +84,8 @@ async def test_is_reachable_returncode(monkeypatch, returncode, expected):
         def __init__(self, rc):
             self.returncode = rc
 
-        async def wait(self):
-            return None
+        async def communicate(self):
+            return b"64 bytes from 10.0.0.1: icmp_seq=1 ttl=64 time=0.5 ms\n", b""
 
     async def fake_exec(*args, **kwargs):
         return DummyProc(returncode)
@@ -80,6 +95,71 @@ async def test_is_reachable_returncode(monkeypatch, returncode, expected):
     assert await connector.is_reachable("10.0.0.1") is expected
 
 
+@pytest.mark.asyncio
+async def test_is_reachable_sends_hedged_probe_when_first_is_late(monkeypatch):
+    connector = make_connector(monkeypatch, credentials={}, default_cred={})
+    connector.rtt_estimator("10.0.0.1").observe(0.01)
+    calls = []
+
+    async def fake_ping(ip, timeout):
+        calls.append(timeout)
+        if len(calls) == 1:
+            await asyncio.sleep(timeout)  # 第一個封包遺失
+            return None
+        return 0.02
+
+    connector._ping_once = fake_ping
+
+    assert await connector.is_reachable("10.0.0.1") is True
+    assert len(calls) == 2
+    assert connector.rtt_estimator("10.0.0.1").losses == 0
+
+
+@pytest.mark.asyncio
+async def test_is_reachable_requires_k_of_n_losses(monkeypatch):
+    connector = make_connector(monkeypatch, credentials={}, default_cred={})
+    connector.ping_hedge = False
+    results = [None, 0.01, 0.01, 0.01, None, None, None]
+    calls = []
+
+    async def fake_ping(ip, timeout):
+        calls.append(ip)
+        return results[len(calls) - 1]
+
+    connector._ping_once = fake_ping
+
+    # 偶發掉包：立即重試成功
+    assert await connector.is_reachable("10.0.0.1") is True
+    assert len(calls) == 2
+    assert await connector.is_reachable("10.0.0.1") is True
+    assert await connector.is_reachable("10.0.0.1") is True
+    # 最近 3 次中掉包 2 次才判定不可達
+    assert await connector.is_reachable("10.0.0.1") is False
+    assert len(calls) == 6
+    # 之後每次只需要一個探測
+    assert await connector.is_reachable("10.0.0.1") is False
+    assert len(calls) == 7
+
+
+@pytest.mark.asyncio
+async def test_is_reachable_backoff_does_not_carry_over_for_dead_host(monkeypatch):
+    connector = make_connector(monkeypatch, credentials={}, default_cred={})
+    connector.ping_hedge = False
+    timeouts = []
+
+    async def fake_ping(ip, timeout):
+        timeouts.append(timeout)
+        return None
+
+    connector._ping_once = fake_ping
+
+    for _ in range(3):
+        assert await connector.is_reachable("10.0.0.1") is False
+    # 每次檢查都從 RTO 開始，加倍只發生在同一次檢查的重試
+    rto = connector.rtt_estimator("10.0.0.1").rto
+    assert timeouts == [rto, rto * 2, rto, rto]
+
+
 @pytest.mark.asyncio
 async def test_is_reachable_handles_exception(monkeypatch):
     connector = make_connector(
@@ -133,11 +213,11 @@ async def test_get_serial_via_ssh_returns_none_when_no_output(monkeypatch):
     )
     machine = make_machine()
 
-    async def fake_to_thread(func, *args, **kwargs):
+    async def fake_run(func, *args, **kwargs):
         return ""
 
     monkeypatch.setattr(connector, "_get_inventory_command", lambda vendor, model: ["cmd"])
-    monkeypatch.setattr(device_connector.asyncio, "to_thread", fake_to_thread)
+    monkeypatch.setattr(connector.ssh_pool, "run", fake_run)
 
     assert await connector.get_serial_via_ssh(machine) is None
 
@@ -151,11 +231,11 @@ async def test_get_serial_via_ssh_parses_output(monkeypatch):
     )
     machine = make_machine()
 
-    async def fake_to_thread(func, *args, **kwargs):
+    async def fake_run(func, *args, **kwargs):
         return 'NAME: "Chassis"\nSN: ABC123\n'
 
     monkeypatch.setattr(connector, "_get_inventory_command", lambda vendor, model: ["cmd"])
-    monkeypatch.setattr(device_connector.asyncio, "to_thread", fake_to_thread)
+    monkeypatch.setattr(connector.ssh_pool, "run", fake_run)
 
     assert await connector.get_serial_via_ssh(machine) == "ABC123"
 
@@ -211,13 +291,13 @@ async def test_reset_device_returns_false_on_restore_failure(monkeypatch):
     machine = make_machine()
     effects = [RuntimeError("restore failed")]
 
-    async def fake_to_thread(func, *args, **kwargs):
+    async def fake_run(func, *args, **kwargs):
         effect = effects.pop(0)
         if isinstance(effect, BaseException):
             raise effect
         return effect
 
-    monkeypatch.setattr(device_connector.asyncio, "to_thread", fake_to_thread)
+    monkeypatch.setattr(connector.ssh_pool, "run", fake_run)
 
     assert await connector.reset_device(machine) is False
 
@@ -232,16 +312,48 @@ async def test_reset_device_returns_true_on_timeout(monkeypatch):
     machine = make_machine()
     effects = ["restore output", subprocess.TimeoutExpired(cmd="ssh", timeout=8)]
 
-    async def fake_to_thread(func, *args, **kwargs):
+    async def fake_run(func, *args, **kwargs):
         effect = effects.pop(0)
         if isinstance(effect, BaseException):
             raise effect
         return effect
 
-    monkeypatch.setattr(device_connector.asyncio, "to_thread", fake_to_thread)
+    monkeypatch.setattr(connector.ssh_pool, "run", fake_run)
 
     assert await connector.reset_device(machine) is True
 
+    assert connector.breaker.state(machine.serial) == CircuitState.CLOSED
+
+
+@pytest.mark.asyncio
+async def test_ssh_circuit_opens_after_repeated_timeouts(monkeypatch):
+    connector = make_connector(
+        monkeypatch,
+        credentials={"S1": {"username": "user", "password": "pass"}},
+        default_cred={},
+    )
+    machine = make_machine()
+    calls = []
+
+    async def fake_run(func, *args, **kwargs):
+        calls.append(args)
+        raise subprocess.TimeoutExpired(cmd="ssh", timeout=10)
+
+    monkeypatch.setattr(connector, "_get_inventory_command", lambda vendor, model: ["cmd"])
+    monkeypatch.setattr(connector.ssh_pool, "run", fake_run)
+
+    for _ in range(3):
+        with pytest.raises(subprocess.TimeoutExpired):
+            await connector.get_serial_via_ssh(machine)
+    assert machine.circuit_state == CircuitState.OPEN
+    assert machine.circuit_retry_at is not None
+
+    # open 時不再連線，reset 也直接失敗
+    with pytest.raises(CircuitOpenError):
+        await connector.get_serial_via_ssh(machine)
+    assert await connector.reset_device(machine) is False
+    assert len(calls) == 3
+
 
 @pytest.mark.asyncio
 async def test_reset_device_returns_false_on_reload_failure(monkeypatch):
@@ -253,13 +365,13 @@ async def test_reset_device_returns_false_on_reload_failure(monkeypatch):
     machine = make_machine()
     effects = ["restore output", RuntimeError("reload failed")]
 
-    async def fake_to_thread(func, *args, **kwargs):
+    async def fake_run(func, *args, **kwargs):
         effect = effects.pop(0)
         if isinstance(effect, BaseException):
             raise effect
         return effect
 
-    monkeypatch.setattr(device_connector.asyncio, "to_thread", fake_to_thread)
+    monkeypatch.setattr(connector.ssh_pool, "run", fake_run)
 
     assert await connector.reset_device(machine) is False
 
@@ -274,13 +386,13 @@ async def test_reset_device_returns_true_on_success(monkeypatch):
     machine = make_machine()
     effects = ["restore output", "reload output"]
 
-    async def fake_to_thread(func, *args, **kwargs):
+    async def fake_run(func, *args, **kwargs):
         effect = effects.pop(0)
         if isinstance(effect, BaseException):
             raise effect
         return effect
 
-    monkeypatch.setattr(device_connector.asyncio, "to_thread", fake_to_thread)
+    monkeypatch.setattr(connector.ssh_pool, "run", fake_run)
 
     assert await connector.reset_device(machine) is True
 
@@ -297,7 +409,8 @@ async def test_reset_device_returns_false_for_unsupported_model(monkeypatch):
     assert await connector.reset_device(machine) is False
 
 
-def test_ssh_exec_xrv_uses_single_command(monkeypatch):
+@pytest.mark.asyncio
+async def test_ssh_exec_xrv_uses_single_command(monkeypatch):
     connector = make_connector(
         monkeypatch,
         credentials={"S1": {"username": "user", "password": "pass"}},
@@ -306,26 +419,23 @@ def test_ssh_exec_xrv_uses_single_command(monkeypatch):
     machine = make_machine(vendor="cisco", model="xrv")
     captured = {}
 
-    class DummyResult:
-        def __init__(self, returncode, stdout, stderr):
-            self.returncode = returncode
-            self.stdout = stdout
-            self.stderr = stderr
-
-    def fake_run(cmd, **kwargs):
+    async def fake_stream(cmd, input_text, timeout, until=None):
         captured["cmd"] = cmd
-        return DummyResult(0, "ok", "")
+        captured["input"] = input_text
+        return 0, "ok", ""
 
-    monkeypatch.setattr(device_connector.subprocess, "run", fake_run)
+    monkeypatch.setattr(connector, "_stream_process", fake_stream)
 
-    output = connector._ssh_exec(machine, "user", "pass", ["show inventory"])
+    output = await connector._ssh_exec(machine, "user", "pass", ["show inventory"])
 
     assert output == "ok"
     assert "-tt" not in captured["cmd"]
     assert "show inventory" in captured["cmd"]
+    assert captured["input"] is None
 
 
-def test_ssh_exec_other_vendor_adds_tty_and_warns(monkeypatch):
+@pytest.mark.asyncio
+async def test_ssh_exec_other_vendor_adds_tty_and_warns(monkeypatch, caplog):
     connector = make_connector(
         monkeypatch,
         credentials={"S1": {"username": "user", "password": "pass"}},
@@ -334,21 +444,277 @@ def test_ssh_exec_other_vendor_adds_tty_and_warns(monkeypatch):
     machine = make_machine(vendor="cisco", model="n9k")
     captured = {}
 
-    class DummyResult:
-        def __init__(self, returncode, stdout, stderr):
-            self.returncode = returncode
-            self.stdout = stdout
-            self.stderr = stderr
-
-    def fake_run(cmd, **kwargs):
+    async def fake_stream(cmd, input_text, timeout, until=None):
         captured["cmd"] = cmd
-        captured["input"] = kwargs.get("input")
-        return DummyResult(1, "output", "stderr")
+        captured["input"] = input_text
+        return 1, "output", "stderr"
 
-    monkeypatch.setattr(device_connector.subprocess, "run", fake_run)
+    monkeypatch.setattr(connector, "_stream_process", fake_stream)
 
-    output = connector._ssh_exec(machine, "user", "pass", ["cmd1", "cmd2"])
+    with caplog.at_level("WARNING"):
+        output = await connector._ssh_exec(machine, "user", "pass", ["cmd1", "cmd2"])
 
     assert output == "output"
     assert "-tt" in captured["cmd"]
     assert "cmd1" in captured["input"]
+    assert "SSH returned 1" in caplog.text
+
+
+def make_mux_connector(monkeypatch, tmp_path, calls):
+    connector = make_connector(
+        monkeypatch,
+        credentials={"S1": {"username": "user", "password": "pass"}},
+        default_cred={},
+        control_persist=30,
+        control_dir=tmp_path / "ssh",
+    )
+
+    async def fake_run_quiet(cmd, timeout):
+        calls.append(cmd)
+        if "-M" in cmd:
+            # 模擬 master 建立 control socket
+            path = next(opt.split("=", 1)[1] for opt in cmd if opt.startswith("ControlPath="))
+            open(path, "w").close()
+        return 0
+
+    async def fake_stream(cmd, input_text, timeout, until=None):
+        calls.append(cmd)
+        return 0, "ok", ""
+
+    monkeypatch.setattr(connector, "_run_quiet", fake_run_quiet)
+    monkeypatch.setattr(connector, "_stream_process", fake_stream)
+    return connector
+
+
+@pytest.mark.asyncio
+async def test_ssh_exec_reuses_master_connection(monkeypatch, tmp_path):
+    calls = []
+    connector = make_mux_connector(monkeypatch, tmp_path, calls)
+    machine = make_machine()
+
+    await connector._ssh_exec(machine, "user", "pass", ["show inventory"])
+    await connector._ssh_exec(machine, "user", "pass", ["reload"])
+
+    master, first, second = calls
+    assert "-M" in master and "ControlPersist=30" in master
+    control_path = f"ControlPath={connector._control_path(machine)}"
+    for session in (first, second):
+        assert "ControlMaster=no" in session
+        assert control_path in session
+    assert (tmp_path / "ssh").stat().st_mode & 0o777 == 0o700
+
+
+@pytest.mark.asyncio
+async def test_ssh_exec_falls_back_when_master_fails(monkeypatch, tmp_path):
+    calls = []
+    connector = make_mux_connector(monkeypatch, tmp_path, calls)
+
+    async def failing_master(cmd, timeout):
+        calls.append(cmd)
+        return 255
+
+    monkeypatch.setattr(connector, "_run_quiet", failing_master)
+
+    await connector._ssh_exec(make_machine(), "user", "pass", ["show inventory"])
+
+    assert not any(opt.startswith("ControlPath=") for opt in calls[-1])
+
+
+@pytest.mark.asyncio
+async def test_ssh_exec_session_gets_only_remaining_time(monkeypatch, tmp_path):
+    calls = []
+    connector = make_mux_connector(monkeypatch, tmp_path, calls)
+    create_master = connector._run_quiet
+    timeouts = []
+
+    async def slow_master(cmd, timeout):
+        await asyncio.sleep(0.05)
+        return await create_master(cmd, timeout)
+
+    async def fake_stream(cmd, input_text, timeout, until=None):
+        timeouts.append(timeout)
+        return 0, "ok", ""
+
+    monkeypatch.setattr(connector, "_run_quiet", slow_master)
+    monkeypatch.setattr(connector, "_stream_process", fake_stream)
+
+    await connector._ssh_exec(make_machine(), "user", "pass", ["show inventory"], timeout=10)
+
+    assert timeouts[0] <= 10 - 0.05
+
+
+@pytest.mark.asyncio
+async def test_ssh_exec_replaces_stale_control_socket(monkeypatch, tmp_path):
+    calls = []
+    connector = make_mux_connector(monkeypatch, tmp_path, calls)
+    machine = make_machine()
+    path = connector._control_path(machine)
+    path.touch()  # 上一個 master 已結束，只留下 socket 檔
+    create_master = connector._run_quiet
+
+    async def run_quiet(cmd, timeout):
+        if "check" in cmd:
+            calls.append(cmd)
+            return 255
+        return await create_master(cmd, timeout)
+
+    async def fake_stream(cmd, input_text, timeout, until=None):
+        calls.append(cmd)
+        return 0, "ok", f"Control socket connect({path}): Connection refused\n"
+
+    monkeypatch.setattr(connector, "_run_quiet", run_quiet)
+    monkeypatch.setattr(connector, "_stream_process", fake_stream)
+
+    await connector._ssh_exec(machine, "user", "pass", ["show inventory"])
+    assert calls[-1][-2:] == ["check", machine.mgmt_ip]
+    assert not path.exists()
+
+    assert not any("-M" in cmd for cmd in calls)
+
+    await connector._ssh_exec(machine, "user", "pass", ["show inventory"])
+    assert any("-M" in cmd for cmd in calls)
+
+
+@pytest.mark.asyncio
+async def test_close_master_exits_and_removes_socket(monkeypatch, tmp_path):
+    calls = []
+    connector = make_mux_connector(monkeypatch, tmp_path, calls)
+    machine = make_machine()
+    await connector._ssh_exec(machine, "user", "pass", ["show inventory"])
+
+    await connector.close_master(machine)
+
+    assert calls[-1][-2:] == ["exit", machine.mgmt_ip]
+    assert not connector._control_path(machine).exists()
+
+
+@pytest.mark.asyncio
+async def test_stream_process_stops_as_soon_as_pattern_matches():
+    connector_cls = device_connector.DeviceConnector
+    pattern = connector_cls._get_serial_stop_pattern("cisco", "n9k")
+    cmd = [
+        "sh", "-c",
+        "printf 'NAME: \"Chassis\"\\nSN: ABC'; sleep 0.2; printf '123\\n'; sleep 5",
+    ]
+
+    started = time.monotonic()
+    returncode, stdout, _ = await connector_cls._stream_process(cmd, None, 10, pattern)
+
+    assert time.monotonic() - started < 3
+    assert returncode is None
+    assert "SN: ABC123" in stdout
+
+
+@pytest.mark.asyncio
+async def test_stream_process_returns_on_eof_and_feeds_stdin():
+    returncode, stdout, stderr = await device_connector.DeviceConnector._stream_process(
+        ["sh", "-c", "cat; echo oops >&2"], "line1\nline2\n", 5
+    )
+
+    assert returncode == 0
+    assert stdout == "line1\nline2\n"
+    assert stderr == "oops\n"
+
+
+@pytest.mark.asyncio
+async def test_stream_process_raises_on_timeout():
+    with pytest.raises(subprocess.TimeoutExpired):
+        await device_connector.DeviceConnector._stream_process(["sleep", "5"], None, 0.2)
+
+
+def _is_running(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
+@pytest.mark.asyncio
+async def test_stream_process_kills_process_group_when_cancelled(tmp_path):
+    pid_file = tmp_path / "child.pid"
+    # 模擬 sshpass → ssh：背景子行程與父行程在同一個 process group
+    cmd = ["sh", "-c", f"sleep 30 & echo $! > {pid_file}; wait"]
+    task = asyncio.create_task(
+        device_connector.DeviceConnector._stream_process(cmd, None, 30)
+    )
+    for _ in range(100):
+        if pid_file.exists() and pid_file.read_text().strip():
+            break
+        await asyncio.sleep(0.02)
+    child = int(pid_file.read_text())
+
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    for _ in range(50):
+        if not _is_running(child):
+            break
+        await asyncio.sleep(0.02)
+    assert not _is_running(child)
+
+
+@pytest.mark.asyncio
+async def test_reset_device_runs_ahead_of_verification(monkeypatch):
+    connector = make_connector(
+        monkeypatch,
+        credentials={"S1": {"username": "user", "password": "pass"}},
+        default_cred={},
+    )
+    priorities = []
+
+    async def fake_run(func, *args, priority, **kwargs):
+        priorities.append(priority)
+        return ""
+
+    monkeypatch.setattr(connector.ssh_pool, "run", fake_run)
+
+    await connector.reset_device(make_machine())
+    await connector.get_serial_via_ssh(make_machine())
+
+    assert priorities == [PRIORITY_RESET, PRIORITY_RESET, PRIORITY_VERIFY]
+
+
+@pytest.mark.asyncio
+async def test_get_serial_via_ssh_passes_stop_pattern(monkeypatch):
+    connector = make_connector(
+        monkeypatch,
+        credentials={"S1": {"username": "user", "password": "pass"}},
+        default_cred={},
+    )
+    machine = make_machine()
+    captured = {}
+
+    async def fake_run(func, *args, **kwargs):
+        captured.update(kwargs)
+        return 'NAME: "Chassis"\nSN: ABC123\n'
+
+    monkeypatch.setattr(connector.ssh_pool, "run", fake_run)
+
+    assert await connector.get_serial_via_ssh(machine) == "ABC123"
+    assert captured["until"].search('NAME: "Chassis" SN: ABC') is None
+    assert captured["until"].search('NAME: "Chassis" SN: ABC123\r\n')
+
+
+@pytest.mark.asyncio
+async def test_close_removes_private_control_dir(monkeypatch):
+    connector = make_connector(
+        monkeypatch,
+        credentials={"S1": {"username": "user", "password": "pass"}},
+        default_cred={},
+        control_persist=30,
+    )
+    (connector.control_dir / "S1-10.0.0.1").touch()
+    calls = []
+
+    async def fake_run_quiet(cmd, timeout):
+        calls.append(cmd)
+        return 0
+
+    monkeypatch.setattr(connector, "_run_quiet", fake_run_quiet)
+
+    await connector.close()
+
+    assert calls and calls[0][-2] == "exit"
+    assert not connector.control_dir.exists()
@@ -0,0 +1,56 @@
+from datetime import datetime, timezone
+
+from app.models.history import StatusTransition
+from app.models.machine import Machine, MachineStatus
+from app.services.facets import MachineFacets
+
+
+def make_machine(serial, vendor="cisco", model="n9k", version="9.3", status=MachineStatus.AVAILABLE):
+    return Machine(
+        vendor=vendor,
+        model=model,
+        version=version,
+        mgmt_ip="10.0.0.1",
+        serial=serial,
+        hostname=serial.lower(),
+        status=status,
+    )
+
+
+def make_transition(from_status, to_status, vendor="cisco", model="n9k", version="9.3"):
+    return StatusTransition(
+        timestamp=datetime.now(timezone.utc),
+        serial="S1",
+        vendor=vendor,
+        model=model,
+        version=version,
+        from_status=from_status,
+        to_status=to_status,
+    )
+
+
+def test_rebuild_counts_nested_by_pool_and_status():
+    facets = MachineFacets()
+    facets.rebuild([
+        make_machine("S1"),
+        make_machine("S2", status=MachineStatus.UNREACHABLE),
+        make_machine("H1", vendor="hp", model="5945", version="1.0"),
+    ])
+
+    summary = facets.summary()
+    assert summary.total == 3
+    assert summary.by_status == {"available": 2, "unreachable": 1}
+    assert summary.vendors["cisco"]["n9k"]["9.3"] == {"available": 1, "unreachable": 1}
+    assert summary.vendors["hp"]["5945"]["1.0"] == {"available": 1}
+
+
+def test_transition_moves_one_count_and_drops_empty_statuses():
+    facets = MachineFacets()
+    facets.rebuild([make_machine("S1")])
+
+    facets.on_transition(make_transition(MachineStatus.AVAILABLE, MachineStatus.UNAVAILABLE))
+
+    summary = facets.summary()
+    assert summary.total == 1
+    assert summary.by_status == {"unavailable": 1}
+    assert summary.vendors["cisco"]["n9k"]["9.3"] == {"unavailable": 1}
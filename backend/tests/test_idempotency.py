@@ -0,0 +1,128 @@
+import asyncio
+
+import pytest
+
+from app.services.idempotency import IdempotencyCache, IdempotencyKeyConflict
+from app.services.state_store import SQLiteStateStore
+
+pytestmark = pytest.mark.asyncio
+
+
+async def test_replays_result_for_same_key():
+    cache = IdempotencyCache()
+    calls = []
+
+    async def operation():
+        calls.append(1)
+        return "S1"
+
+    assert await cache.run("k", ("reserve",), operation) == ("S1", False)
+    assert await cache.run("k", ("reserve",), operation) == ("S1", True)
+    assert len(calls) == 1
+
+
+async def test_concurrent_retry_waits_for_first_attempt():
+    cache = IdempotencyCache()
+    gate = asyncio.Event()
+    calls = []
+
+    async def operation():
+        calls.append(1)
+        await gate.wait()
+        return "S1"
+
+    first = asyncio.create_task(cache.run("k", "fp", operation))
+    await asyncio.sleep(0)
+    retry = asyncio.create_task(cache.run("k", "fp", operation))
+    await asyncio.sleep(0)
+    gate.set()
+
+    assert await first == ("S1", False)
+    assert await retry == ("S1", True)
+    assert len(calls) == 1
+
+
+async def test_failures_are_not_cached():
+    cache = IdempotencyCache()
+    results = [RuntimeError("no machine"), "S1"]
+
+    async def operation():
+        result = results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    with pytest.raises(RuntimeError):
+        await cache.run("k", "fp", operation)
+    assert await cache.run("k", "fp", operation) == ("S1", False)
+
+
+async def test_key_reused_for_different_request_conflicts():
+    cache = IdempotencyCache()
+
+    async def operation():
+        return "S1"
+
+    await cache.run("k", ("reserve", "cisco"), operation)
+    with pytest.raises(IdempotencyKeyConflict):
+        await cache.run("k", ("reserve", "hp"), operation)
+
+
+async def test_expired_and_least_recently_used_entries_are_evicted(monkeypatch):
+    cache = IdempotencyCache(max_entries=2, ttl=10)
+    now = [0.0]
+    monkeypatch.setattr("app.services.idempotency.time.monotonic", lambda: now[0])
+    calls = []
+
+    async def operation():
+        calls.append(1)
+        return len(calls)
+
+    await cache.run("a", "fp", operation)
+    await cache.run("b", "fp", operation)
+    await cache.run("a", "fp", operation)  # a 變成最近使用
+    await cache.run("c", "fp", operation)  # 超過上限，移除最久未使用的 b
+    assert len(cache) == 2
+    assert await cache.run("b", "fp", operation) == (4, False)
+
+    now[0] = 100
+    assert await cache.run("a", "fp", operation) == (5, False)
+
+
+async def test_shared_store_replays_result_across_workers(tmp_path):
+    stores = [SQLiteStateStore(tmp_path / "state.db") for _ in range(2)]
+    first, second = (IdempotencyCache(store=store) for store in stores)
+    calls = []
+
+    async def operation():
+        calls.append(1)
+        return {"serial_number": "S1"}
+
+    try:
+        assert await first.run("k", ("reserve",), operation) == ({"serial_number": "S1"}, False)
+        assert await second.run("k", ("reserve",), operation) == ({"serial_number": "S1"}, True)
+        assert len(calls) == 1
+        with pytest.raises(IdempotencyKeyConflict):
+            await second.run("k", ("release", "S1"), operation)
+    finally:
+        for store in stores:
+            store.close()
+
+
+async def test_shared_store_failure_lets_other_worker_retry(tmp_path):
+    stores = [SQLiteStateStore(tmp_path / "state.db") for _ in range(2)]
+    first, second = (IdempotencyCache(store=store) for store in stores)
+
+    async def failing():
+        raise RuntimeError("boom")
+
+    async def operation():
+        return "S2"
+
+    try:
+        with pytest.raises(RuntimeError):
+            await first.run("k", ("reserve",), failing)
+        assert await second.run("k", ("reserve",), operation) == ("S2", False)
+    finally:
+        for store in stores:
+            store.close()
@@ -0,0 +1,125 @@
+import os
+
+import pytest
+
+from app.core import inventory
+from app.core.inventory import FragmentCache, load_device_inventory, merge_inventories
+
+
+DEVICE_YAML = """
+cisco:
+  n9k:
+    9.3:
+      - serial: S1
+        mgmt_ip: 10.0.0.1
+"""
+
+
+def test_parses_yaml_and_stringifies_version_keys(tmp_path):
+    source = tmp_path / "device.yaml"
+    source.write_text(DEVICE_YAML, encoding="utf-8")
+
+    data = load_device_inventory(source)
+
+    assert data == {"cisco": {"n9k": {"9.3": [{"serial": "S1", "mgmt_ip": "10.0.0.1"}]}}}
+
+
+def test_reuses_snapshot_until_source_changes(tmp_path, monkeypatch):
+    source = tmp_path / "device.yaml"
+    source.write_text(DEVICE_YAML, encoding="utf-8")
+    snapshot = tmp_path / ".device.yaml.snapshot"
+
+    first = load_device_inventory(source, [snapshot])
+    assert snapshot.exists()
+
+    def fail(_):
+        raise AssertionError("YAML should not be parsed while the snapshot is valid")
+
+    monkeypatch.setattr(inventory, "load_yaml", fail)
+    assert load_device_inventory(source, [snapshot]) == first
+
+    source.write_text(DEVICE_YAML.replace("S1", "S2"), encoding="utf-8")
+    with pytest.raises(AssertionError):
+        load_device_inventory(source, [snapshot])
+
+
+def test_falls_back_to_next_snapshot_location_when_not_writable(tmp_path):
+    source = tmp_path / "device.yaml"
+    source.write_text(DEVICE_YAML, encoding="utf-8")
+    blocker = tmp_path / "not-a-dir"
+    blocker.write_text("", encoding="utf-8")
+    unwritable = blocker / ".device.yaml.snapshot"
+    fallback = tmp_path / "data" / ".device.yaml.snapshot"
+
+    load_device_inventory(source, [unwritable, fallback])
+
+    assert fallback.exists()
+
+
+def test_skips_snapshot_for_values_json_cannot_round_trip(tmp_path):
+    source = tmp_path / "device.yaml"
+    source.write_text("cisco:\n  added: 2024-01-01\n", encoding="utf-8")
+    snapshot = tmp_path / ".device.yaml.snapshot"
+
+    data = load_device_inventory(source, [snapshot])
+
+    assert str(data["cisco"]["added"]) == "2024-01-01"
+    assert not snapshot.exists()
+
+
+def write_fragment(directory, name, serial, vendor="cisco"):
+    path = directory / name
+    path.write_text(
+        f"{vendor}:\n  n9k:\n    '9.3':\n      - serial: {serial}\n        mgmt_ip: 10.0.0.1\n",
+        encoding="utf-8",
+    )
+    return path
+
+
+def test_merge_inventories_concatenates_devices_per_version():
+    merged = merge_inventories([
+        ("a.yaml", {"cisco": {"n9k": {"9.3": [{"serial": "S1"}]}}}),
+        ("b.yaml", {"cisco": {"n9k": {"9.3": [{"serial": "S2"}]}}, "hp": {"5945": {"1.0": []}}}),
+    ])
+
+    assert merged["cisco"]["n9k"]["9.3"] == [{"serial": "S1"}, {"serial": "S2"}]
+    assert merged["hp"] == {"5945": {"1.0": []}}
+
+
+def test_merge_inventories_rejects_duplicate_serials():
+    with pytest.raises(ValueError, match="S1 in a.yaml and b.yaml"):
+        merge_inventories([
+            ("a.yaml", {"cisco": {"n9k": {"9.3": [{"serial": "S1"}]}}}),
+            ("b.yaml", {"hp": {"5945": {"1.0": [{"serial": "S1"}]}}}),
+        ])
+
+
+def test_fragment_cache_reparses_only_changed_fragments(tmp_path):
+    touched = write_fragment(tmp_path, "a.yaml", "S1")
+    write_fragment(tmp_path, "b.yaml", "S2", vendor="hp")
+    cache = FragmentCache()
+
+    assert [name for name, _ in cache.load(tmp_path, max_workers=1)] == ["a.yaml", "b.yaml"]
+    assert cache.parsed == 2
+
+    os.utime(touched, ns=(0, 0))  # mtime 改變但內容相同，不需要重新解析
+    cache.load(tmp_path, max_workers=1)
+    assert cache.parsed == 2
+
+    write_fragment(tmp_path, "b.yaml", "S30", vendor="hp")
+    fragments = dict(cache.load(tmp_path, max_workers=1))
+    assert cache.parsed == 3
+    assert fragments["b.yaml"]["hp"]["n9k"]["9.3"][0]["serial"] == "S30"
+
+    (tmp_path / "a.yaml").unlink()
+    assert [name for name, _ in cache.load(tmp_path, max_workers=1)] == ["b.yaml"]
+    assert cache.parsed == 3
+
+
+def test_fragment_cache_parses_in_process_pool(tmp_path):
+    for i in range(3):
+        write_fragment(tmp_path, f"lab{i}.yaml", f"S{i}")
+
+    fragments = FragmentCache().load(tmp_path, max_workers=2)
+
+    assert [data["cisco"]["n9k"]["9.3"][0]["serial"] for _, data in fragments] == ["S0", "S1", "S2"]
@@ -0,0 +1,72 @@
+import pytest
+
+from app.services import leader as leader_module
+from app.services.leader import LeaderElector
+from app.services.state_store import LocalStateStore, SQLiteStateStore
+
+
+@pytest.mark.asyncio
+async def test_local_store_is_always_leader():
+    elector = LeaderElector(LocalStateStore(), ttl=3)
+    assert await elector.acquire() is True
+    assert elector.is_leader
+
+
+@pytest.mark.asyncio
+async def test_only_one_process_holds_the_lease(tmp_path):
+    path = tmp_path / "state.db"
+    first = LeaderElector(SQLiteStateStore(path), ttl=30)
+    second = LeaderElector(SQLiteStateStore(path), ttl=30)
+
+    assert await first.acquire() is True
+    assert await second.acquire() is False
+    # 續約仍然成功
+    assert await first.acquire() is True
+
+
+@pytest.mark.asyncio
+async def test_follower_takes_over_after_resign(tmp_path):
+    path = tmp_path / "state.db"
+    first = LeaderElector(SQLiteStateStore(path), ttl=30)
+    second = LeaderElector(SQLiteStateStore(path), ttl=30)
+    await first.acquire()
+
+    await first.resign()
+
+    assert first.is_leader is False
+    assert await second.acquire() is True
+
+
+@pytest.mark.asyncio
+async def test_follower_takes_over_after_lease_expires(tmp_path, monkeypatch):
+    path = tmp_path / "state.db"
+    first = LeaderElector(SQLiteStateStore(path), ttl=30)
+    second = LeaderElector(SQLiteStateStore(path), ttl=30)
+    await first.acquire()
+
+    now = leader_module.time.time()
+    monkeypatch.setattr("app.services.state_store.time.time", lambda: now + 31)
+
+    assert await second.acquire() is True
+
+
+@pytest.mark.asyncio
+async def test_leader_steps_down_when_renewal_fails(monkeypatch):
+    class FlakyStore(LocalStateStore):
+        def __init__(self):
+            self.fail = False
+
+        def try_acquire_lease(self, name, owner, ttl):
+            if self.fail:
+                raise RuntimeError("db locked")
+            return True
+
+    store = FlakyStore()
+    elector = LeaderElector(store, ttl=30)
+    await elector.acquire()
+
+    store.fail = True
+    clock = leader_module.time.monotonic()
+    monkeypatch.setattr(leader_module.time, "monotonic", lambda: clock + 31)
+
+    assert await elector.acquire() is False
@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+
+from app.services import lease_reaper
+from app.services.lease_reaper import LeaseSchedule
+
+
+def test_schedule_pops_in_expiry_order():
+    schedule = LeaseSchedule()
+    schedule.schedule("B", 20)
+    schedule.schedule("A", 10)
+    schedule.schedule("C", 30)
+
+    assert schedule.next_deadline() == 10
+    assert schedule.pop_expired(25) == ["A", "B"]
+    assert len(schedule) == 1
+
+
+def test_schedule_renewal_and_cancel_use_lazy_deletion():
+    schedule = LeaseSchedule()
+    schedule.schedule("A", 10)
+    schedule.schedule("A", 50)
+    schedule.schedule("B", 20)
+    schedule.cancel("B")
+
+    assert schedule.next_deadline() == 50
+    assert schedule.pop_expired(40) == []
+    assert schedule.pop_expired(50) == ["A"]
+    assert schedule.next_deadline() is None
+
+
+@pytest.mark.asyncio
+async def test_reaper_loop_skips_when_not_leader(monkeypatch):
+    class FakeManager:
+        def __init__(self):
+            self.leases = LeaseSchedule()
+            self.calls = 0
+
+        async def reap_expired_leases(self):
+            self.calls += 1
+
+    class Follower:
+        is_leader = False
+
+    async def fake_sleep(delay):
+        raise asyncio.CancelledError
+
+    monkeypatch.setattr(lease_reaper.asyncio, "sleep", fake_sleep)
+    manager = FakeManager()
+
+    await lease_reaper.reap_expired_leases(manager, Follower())
+    assert manager.calls == 0
+
+    await lease_reaper.reap_expired_leases(manager)
+    assert manager.calls == 1
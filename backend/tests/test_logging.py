@@ -1,4 +1,7 @@
+import gzip
+import json
 import logging
+import queue
 from datetime import datetime
 from pathlib import Path
 
@@ -19,6 +22,7 @@ def reset_logging_state():
 
     yield app_logging
 
+    app_logging.shutdown_logging()
     for handler in list(root.handlers):
         root.removeHandler(handler)
     for handler in original_handlers:
@@ -56,7 +60,9 @@ def test_setup_logging_warns_when_file_handler_fails(
     def raise_file_handler(*args, **kwargs):
         raise OSError("cannot create")
 
-    monkeypatch.setattr(reset_logging_state.logging, "FileHandler", raise_file_handler)
+    monkeypatch.setattr(
+        reset_logging_state, "CompressingRotatingFileHandler", raise_file_handler
+    )
 
     log_file = reset_logging_state.setup_logging()
     assert log_file is None
@@ -85,3 +91,59 @@ def test_setup_logging_logs_info_when_no_reason(reset_logging_state, monkeypatch
     log_file = reset_logging_state.setup_logging()
 
     assert log_file is None
+
+
+def test_setup_logging_writes_through_background_listener(
+    reset_logging_state, monkeypatch, tmp_path
+):
+    monkeypatch.setattr(reset_logging_state, "_ensure_log_dir", lambda: tmp_path)
+    monkeypatch.setenv("LOG_FORMAT", "json")
+
+    log_file = reset_logging_state.setup_logging()
+    logging.getLogger("app.test").info("hello %s", "world")
+    reset_logging_state.shutdown_logging()
+
+    entries = [json.loads(line) for line in log_file.read_text().splitlines()]
+    assert entries[-1]["message"] == "hello world"
+    assert entries[-1]["logger"] == "app.test"
+
+
+def test_rotating_handler_compresses_rotated_files(tmp_path):
+    handler = app_logging.CompressingRotatingFileHandler(
+        tmp_path / "app.log", max_bytes=100, backup_count=2
+    )
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    for i in range(10):
+        handler.emit(logging.makeLogRecord({"msg": f"line {i} " + "x" * 40}))
+    handler.close()
+
+    rotated = sorted(p.name for p in tmp_path.iterdir())
+    assert rotated == ["app.log", "app.log.1.gz", "app.log.2.gz"]
+    assert gzip.decompress((tmp_path / "app.log.1.gz").read_bytes()).startswith(b"line")
+
+
+def test_rotating_handler_rotates_on_interval(tmp_path):
+    handler = app_logging.CompressingRotatingFileHandler(
+        tmp_path / "app.log", interval=60, backup_count=1
+    )
+    record = logging.makeLogRecord({"msg": "late"})
+    record.created = handler._next_rollover + 1
+
+    assert handler.shouldRollover(record)
+    handler.close()
+
+
+def test_queue_handler_drops_instead_of_blocking():
+    log_queue = queue.Queue(maxsize=2)
+    handler = app_logging.DroppingQueueHandler(log_queue)
+
+    for msg in ("first", "second", "third"):
+        handler.emit(logging.makeLogRecord({"msg": msg}))
+    assert handler.dropped == 1
+
+    log_queue.get_nowait()
+    log_queue.get_nowait()
+    handler.emit(logging.makeLogRecord({"msg": "fourth"}))
+    assert "dropped 1 records" in log_queue.get_nowait().getMessage()
+    assert log_queue.get_nowait().getMessage() == "fourth"
+    assert handler.dropped == 0
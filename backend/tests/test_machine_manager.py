@@ -1,7 +1,14 @@
+import subprocess
+import threading
+from datetime import datetime, timezone
+
 import pytest
 
+from app.models.reservation import ReservationQuery
 from app.services import machine_manager
+from app.services.circuit_breaker import CircuitOpenError
 from app.services.machine_manager import MachineManager, MachineStatus, ReleaseResult
+from app.services.state_store import SQLiteStateStore
 
 
 class FakeDeviceConnector:
@@ -11,6 +18,7 @@ class FakeDeviceConnector:
         self.is_reachable_map = {}
         self.serial_map = {}
         self.reset_results = {}
+        self.closed_masters = []
 
     async def is_reachable(self, ip: str) -> bool:
         return self.is_reachable_map.get(ip, True)
@@ -21,6 +29,9 @@ class FakeDeviceConnector:
     async def reset_device(self, machine) -> bool:
         return self.reset_results.get(machine.serial, True)
 
+    async def close_master(self, machine):
+        self.closed_masters.append((machine.serial, machine.mgmt_ip))
+
 
 @pytest.fixture
 def config_data():
@@ -43,11 +54,19 @@ def config_data():
 
 
 @pytest.fixture
-def manager(monkeypatch, config_data):
+def pool_config():
+    return {}
+
+
+@pytest.fixture
+def manager(monkeypatch, config_data, pool_config):
     class DummySettings:
         def load_device_config(self):
             return config_data
 
+        def load_pool_config(self):
+            return pool_config
+
         def load_credentials(self):
             return {}, {}
 
@@ -56,21 +75,23 @@ def manager(monkeypatch, config_data):
     return MachineManager()
 
 
-def test_loads_devices_from_config(manager):
+@pytest.mark.asyncio
+async def test_loads_devices_from_config(manager):
     serials = {m.serial for m in manager._machines.values()}
     assert serials == {"S1", "H1"}
-    assert manager.get_machine("S1").vendor == "cisco"
+    assert (await manager.get_machine("S1")).vendor == "cisco"
 
 
-def test_get_machines_filters_by_vendor_and_status(manager):
+@pytest.mark.asyncio
+async def test_get_machines_filters_by_vendor_and_status(manager):
     manager._machines["S1"].status = MachineStatus.UNAVAILABLE
-    filtered = manager.get_machines(vendor="cisco", status=MachineStatus.UNAVAILABLE)
+    filtered = await manager.get_machines(vendor="cisco", status=MachineStatus.UNAVAILABLE)
     assert [m.serial for m in filtered] == ["S1"]
 
 
 @pytest.mark.asyncio
 async def test_refresh_machine_status_marks_unreachable(manager):
-    machine = manager.get_machine("S1")
+    machine = await manager.get_machine("S1")
     manager.connector.is_reachable_map[machine.mgmt_ip] = False
     await manager.refresh_machine_status(machine)
     assert machine.status == MachineStatus.UNREACHABLE
@@ -78,7 +99,7 @@ async def test_refresh_machine_status_marks_unreachable(manager):
 
 @pytest.mark.asyncio
 async def test_refresh_machine_status_marks_unavailable_on_serial_mismatch(manager):
-    machine = manager.get_machine("S1")
+    machine = await manager.get_machine("S1")
     manager.connector.serial_map[machine.serial] = "WRONG"
     await manager.refresh_machine_status(machine)
     assert machine.status == MachineStatus.UNAVAILABLE
@@ -86,7 +107,7 @@ async def test_refresh_machine_status_marks_unavailable_on_serial_mismatch(manag
 
 @pytest.mark.asyncio
 async def test_refresh_machine_status_marks_available_on_match(manager):
-    machine = manager.get_machine("S1")
+    machine = await manager.get_machine("S1")
     manager.connector.is_reachable_map[machine.mgmt_ip] = True
     manager.connector.serial_map[machine.serial] = machine.serial
     await manager.refresh_machine_status(machine)
@@ -102,7 +123,7 @@ async def test_reserve_machine_success_sets_unavailable(manager):
 
 @pytest.mark.asyncio
 async def test_reserve_machine_returns_none_when_all_unreachable(manager):
-    machine = manager.get_machine("S1")
+    machine = await manager.get_machine("S1")
     manager.connector.is_reachable_map[machine.mgmt_ip] = False
     reserved = await manager.reserve_machine("cisco", "n9k", "9.3")
     assert reserved is None
@@ -111,27 +132,30 @@ async def test_reserve_machine_returns_none_when_all_unreachable(manager):
 
 @pytest.mark.asyncio
 async def test_release_machine_success_sets_rebooting(manager):
-    machine = manager.get_machine("S1")
+    machine = await manager.get_machine("S1")
     machine.status = MachineStatus.UNAVAILABLE
     manager.connector.reset_results[machine.serial] = True
     result = await manager.release_machine(machine.serial)
     assert result == ReleaseResult.SUCCESS
     assert machine.status == MachineStatus.REBOOTING
+    assert manager.reboot_tracker.is_tracking(machine.serial)
+    assert manager.connector.closed_masters == [("S1", "10.0.0.1")]
 
 
 @pytest.mark.asyncio
 async def test_release_machine_failed_keeps_unavailable(manager):
-    machine = manager.get_machine("S1")
+    machine = await manager.get_machine("S1")
     machine.status = MachineStatus.UNAVAILABLE
     manager.connector.reset_results[machine.serial] = False
     result = await manager.release_machine(machine.serial)
     assert result == ReleaseResult.FAILED
     assert machine.status == MachineStatus.UNAVAILABLE
+    assert manager.connector.closed_masters == []
 
 
 @pytest.mark.asyncio
 async def test_release_machine_not_unavailable_returns_failed(manager):
-    machine = manager.get_machine("S1")
+    machine = await manager.get_machine("S1")
     machine.status = MachineStatus.AVAILABLE
     result = await manager.release_machine(machine.serial)
     assert result == ReleaseResult.FAILED
@@ -152,8 +176,59 @@ async def test_reload_machines_preserves_status_and_updates_list(manager, config
     )
     count = await manager.reload_machines()
     assert count == 3
-    assert manager.get_machine("S1").status == MachineStatus.UNAVAILABLE
-    assert manager.get_machine("S2").hostname == "leaf2"
+    assert (await manager.get_machine("S1")).status == MachineStatus.UNAVAILABLE
+    assert (await manager.get_machine("S2")).hostname == "leaf2"
+
+
+@pytest.mark.asyncio
+async def test_reload_machines_loads_config_off_event_loop(monkeypatch, manager, config_data):
+    loop_thread = threading.get_ident()
+    threads = []
+
+    class ThreadRecordingSettings:
+        def load_device_config(self):
+            threads.append(threading.get_ident())
+            return config_data
+
+        def load_pool_config(self):
+            threads.append(threading.get_ident())
+            return {}
+
+    monkeypatch.setattr(machine_manager, "get_settings", lambda: ThreadRecordingSettings())
+
+    assert await manager.reload_machines() == 2
+    assert threads and loop_thread not in threads
+
+
+@pytest.mark.asyncio
+async def test_reload_machines_closes_ssh_masters_of_removed_or_moved(manager, config_data):
+    config_data["cisco"]["n9k"]["9.3"][0]["mgmt_ip"] = "10.0.0.9"
+    del config_data["hp"]
+
+    await manager.reload_machines()
+
+    assert sorted(manager.connector.closed_masters) == [("H1", "10.0.0.2"), ("S1", "10.0.0.1")]
+
+
+@pytest.mark.asyncio
+async def test_machine_summary_follows_transitions_and_reload(manager, config_data):
+    manager.connector.is_reachable_map["10.0.0.1"] = True
+    manager.connector.serial_map["S1"] = "S1"
+    await manager.refresh_machine_status(await manager.get_machine("S1"))
+    await manager.reserve_machine("cisco", "n9k", "9.3")
+
+    summary = await manager.machine_summary()
+    assert summary.total == 2
+    assert summary.vendors["cisco"]["n9k"]["9.3"] == {MachineStatus.UNAVAILABLE.value: 1}
+    assert summary.by_status[MachineStatus.UNAVAILABLE.value] == 1
+
+    del config_data["hp"]
+    await manager.reload_machines()
+
+    summary = await manager.machine_summary()
+    assert summary.total == 1
+    assert "hp" not in summary.vendors
+    assert summary.by_status == {MachineStatus.UNAVAILABLE.value: 1}
 
 
 def test_parse_config_to_machines_skips_invalid_entries(manager, caplog):
@@ -179,3 +254,418 @@ async def test_initialize_status_runs_refresh(manager):
     await manager.initialize_status()
     statuses = {machine.status for machine in manager._machines.values()}
     assert statuses == {MachineStatus.AVAILABLE}
+
+
+@pytest.mark.asyncio
+async def test_shared_state_store_prevents_double_reservation(manager, tmp_path):
+    path = tmp_path / "state.db"
+    first = MachineManager(state_store=SQLiteStateStore(path))
+    second = MachineManager(state_store=SQLiteStateStore(path))
+
+    reserved = await first.reserve_machine("cisco", "n9k", "9.3")
+    assert reserved.serial == "S1"
+
+    assert await second.reserve_machine("cisco", "n9k", "9.3") is None
+    assert (await second.get_machine("S1")).status == MachineStatus.UNAVAILABLE
+
+
+@pytest.mark.asyncio
+async def test_refresh_keeps_reservation_made_by_other_worker_during_ping(manager, tmp_path):
+    path = tmp_path / "state.db"
+    first = MachineManager(state_store=SQLiteStateStore(path))
+    second = MachineManager(state_store=SQLiteStateStore(path))
+
+    async def ping_while_other_worker_reserves(ip):
+        await second.reserve_machine("cisco", "n9k", "9.3", owner="job-2", ttl=60)
+        return False
+
+    first.connector.is_reachable = ping_while_other_worker_reserves
+    assert await first.refresh_machine_status(await first.get_machine("S1")) is False
+
+    machine = await first.get_machine("S1")
+    assert machine.status == MachineStatus.UNAVAILABLE
+    assert machine.lease_owner == "job-2"
+
+
+@pytest.mark.asyncio
+async def test_initialize_status_continues_past_failing_devices(manager, config_data):
+    config_data["cisco"]["n9k"]["9.3"].append(
+        {"serial": "S2", "mgmt_ip": "10.0.0.3", "hostname": "leaf2"}
+    )
+    await manager.reload_machines()
+
+    async def get_serial(machine):
+        if machine.serial == "S1":
+            raise CircuitOpenError("S1")
+        if machine.serial == "H1":
+            raise subprocess.TimeoutExpired("ssh", 10)
+        return machine.serial
+
+    manager.connector.get_serial_via_ssh = get_serial
+
+    await manager.initialize_status()
+
+    assert (await manager.get_machine("S2")).last_verified_at is not None
+    assert (await manager.get_machine("S1")).last_verified_at is None
+
+
+@pytest.mark.asyncio
+async def test_initialize_status_skips_reserved_machines(manager):
+    machine = await manager.get_machine("S1")
+    machine.status = MachineStatus.UNAVAILABLE
+    await manager.initialize_status()
+    assert machine.status == MachineStatus.UNAVAILABLE
+
+
+@pytest.mark.asyncio
+async def test_reserve_machine_grants_lease(manager):
+    reserved = await manager.reserve_machine("cisco", "n9k", "9.3", owner="job-1", ttl=60)
+    assert reserved.lease_owner == "job-1"
+    assert reserved.lease_expires_at is not None
+    assert manager.leases.next_deadline() == pytest.approx(
+        reserved.lease_expires_at.timestamp()
+    )
+
+
+@pytest.mark.asyncio
+async def test_reserve_machine_without_ttl_has_no_expiry(manager):
+    reserved = await manager.reserve_machine("cisco", "n9k", "9.3")
+    assert reserved.lease_expires_at is None
+    assert len(manager.leases) == 0
+
+
+@pytest.mark.asyncio
+async def test_renew_lease_results(manager):
+    assert await manager.renew_lease("UNKNOWN") == machine_manager.LeaseResult.NOT_FOUND
+    assert await manager.renew_lease("S1") == machine_manager.LeaseResult.NOT_RESERVED
+
+    await manager.reserve_machine("cisco", "n9k", "9.3", owner="job-1", ttl=60)
+    before = (await manager.get_machine("S1")).lease_expires_at
+    assert (
+        await manager.renew_lease("S1", owner="job-2")
+        == machine_manager.LeaseResult.OWNER_MISMATCH
+    )
+    assert await manager.renew_lease("S1", owner="job-1", ttl=600) == machine_manager.LeaseResult.SUCCESS
+    assert (await manager.get_machine("S1")).lease_expires_at > before
+
+
+@pytest.mark.asyncio
+async def test_reap_expired_leases_releases_and_resets(manager, monkeypatch):
+    await manager.reserve_machine("cisco", "n9k", "9.3", owner="job-1", ttl=60)
+    now = machine_manager.time.time()
+    monkeypatch.setattr(machine_manager.time, "time", lambda: now + 61)
+
+    reaped = await manager.reap_expired_leases()
+
+    machine = await manager.get_machine("S1")
+    assert reaped == ["S1"]
+    assert machine.status == MachineStatus.REBOOTING
+    assert machine.lease_owner is None
+    assert machine.lease_expires_at is None
+
+
+@pytest.mark.asyncio
+async def test_heartbeat_without_ttl_keeps_granted_ttl(manager, monkeypatch):
+    await manager.reserve_machine("cisco", "n9k", "9.3", owner="job-1", ttl=600)
+    assert await manager.renew_lease("S1", owner="job-1") == machine_manager.LeaseResult.SUCCESS
+    machine = await manager.get_machine("S1")
+    assert machine.lease_ttl == 600
+    assert machine.lease_expires_at is not None
+
+    # job 當掉後不再 heartbeat，lease 仍會到期並被回收
+    now = machine_manager.time.time()
+    monkeypatch.setattr(machine_manager.time, "time", lambda: now + 601)
+    assert await manager.reap_expired_leases() == ["S1"]
+    assert machine.status == MachineStatus.REBOOTING
+    assert machine.lease_ttl is None
+
+
+@pytest.mark.asyncio
+async def test_reap_expired_leases_ignores_renewed_and_released(manager, monkeypatch):
+    await manager.reserve_machine("cisco", "n9k", "9.3", ttl=60)
+    await manager.release_machine("S1")
+    now = machine_manager.time.time()
+    monkeypatch.setattr(machine_manager.time, "time", lambda: now + 61)
+
+    assert await manager.reap_expired_leases() == []
+
+
+@pytest.mark.asyncio
+async def test_reap_expired_leases_clears_lease_when_reset_fails(manager, monkeypatch):
+    await manager.reserve_machine("cisco", "n9k", "9.3", ttl=60)
+    manager.connector.reset_results["S1"] = False
+    now = machine_manager.time.time()
+    monkeypatch.setattr(machine_manager.time, "time", lambda: now + 61)
+
+    assert await manager.reap_expired_leases() == ["S1"]
+    machine = await manager.get_machine("S1")
+    assert machine.status == MachineStatus.UNAVAILABLE
+    assert machine.lease_expires_at is None
+    assert len(manager.leases) == 0
+
+
+@pytest.mark.asyncio
+async def test_reserve_machine_records_usage(manager):
+    reserved = await manager.reserve_machine("cisco", "n9k", "9.3")
+    assert reserved.reservation_count == 1
+    assert reserved.last_reserved_at is not None
+
+
+@pytest.mark.asyncio
+async def test_reserve_machine_uses_pool_allocation_policy(manager, config_data, pool_config):
+    config_data["cisco"]["n9k"]["9.3"].append(
+        {"serial": "S2", "mgmt_ip": "10.0.0.3", "hostname": "leaf2"}
+    )
+    pool_config["pools"] = {"cisco/n9k": {"allocation_policy": "fewest_reservations"}}
+    await manager.reload_machines()
+    (await manager.get_machine("S1")).reservation_count = 5
+
+    reserved = await manager.reserve_machine("cisco", "n9k", "9.3")
+
+    assert reserved.serial == "S2"
+
+
+@pytest.mark.asyncio
+async def test_reload_rejects_unknown_allocation_policy(manager, pool_config):
+    pool_config["default"] = {"allocation_policy": "bogus"}
+    with pytest.raises(ValueError):
+        await manager.reload_machines()
+
+
+@pytest.fixture
+def spare_pool(config_data, pool_config):
+    config_data["cisco"]["n9k"]["9.3"].append(
+        {"serial": "S2", "mgmt_ip": "10.0.0.3", "hostname": "leaf2"}
+    )
+    pool_config["pools"] = {"cisco/n9k": {"hot_spares": 1, "spare_max_age": 60}}
+
+
+@pytest.mark.asyncio
+async def test_maintain_hot_spares_verifies_until_target(manager, spare_pool):
+    await manager.reload_machines()
+
+    report = await manager.maintain_hot_spares()
+
+    verified = [s for s in ("S1", "S2") if (await manager.get_machine(s)).last_verified_at]
+    assert len(verified) == 1
+    assert [(p.model, p.verified, p.deficit) for p in report] == [("n9k", 1, 0)]
+
+
+@pytest.mark.asyncio
+async def test_maintain_hot_spares_reports_depletion(manager, spare_pool):
+    await manager.reload_machines()
+    for serial in ("S1", "S2"):
+        manager.connector.is_reachable_map[(await manager.get_machine(serial)).mgmt_ip] = False
+
+    report = await manager.maintain_hot_spares()
+
+    assert report[0].deficit == 1
+    assert (await manager.get_machine("S1")).status == MachineStatus.UNREACHABLE
+
+
+@pytest.mark.asyncio
+async def test_verify_spare_does_not_override_reservation(manager, spare_pool):
+    await manager.reload_machines()
+    machine = await manager.get_machine("S1")
+    original = manager.connector.get_serial_via_ssh
+
+    async def reserve_during_check(m):
+        m.status = MachineStatus.UNAVAILABLE
+        return await original(m)
+
+    manager.connector.get_serial_via_ssh = reserve_during_check
+
+    assert await manager._verify_spare(machine, auto_reset=False) is False
+    assert machine.status == MachineStatus.UNAVAILABLE
+
+
+@pytest.mark.asyncio
+async def test_verify_spare_pre_resets_on_serial_mismatch(manager, spare_pool):
+    await manager.reload_machines()
+    machine = await manager.get_machine("S1")
+    manager.connector.serial_map["S1"] = "WRONG"
+
+    assert await manager._verify_spare(machine, auto_reset=True) is False
+    assert machine.status == MachineStatus.REBOOTING
+    assert manager.reboot_tracker.is_tracking("S1")
+    assert manager.connector.closed_masters == [("S1", "10.0.0.1")]
+
+
+@pytest.mark.asyncio
+async def test_verify_spare_failure_takes_machine_out_of_pool(manager, spare_pool):
+    await manager.reload_machines()
+    machine = await manager.get_machine("S1")
+    manager.connector.serial_map["S1"] = "WRONG"
+
+    assert await manager._verify_spare(machine, auto_reset=False) is False
+    assert machine.status == MachineStatus.UNAVAILABLE
+    assert machine.last_verified_at is None
+    assert (await manager.reserve_machine("cisco", "n9k", "9.3")).serial == "S2"
+
+
+@pytest.mark.asyncio
+async def test_verify_spare_failed_pre_reset_leaves_machine_unavailable(manager, spare_pool):
+    await manager.reload_machines()
+    machine = await manager.get_machine("S1")
+    manager.connector.serial_map["S1"] = "WRONG"
+    manager.connector.reset_results["S1"] = False
+
+    assert await manager._verify_spare(machine, auto_reset=True) is False
+    assert machine.status == MachineStatus.UNAVAILABLE
+    assert not manager.reboot_tracker.is_tracking("S1")
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "failure", [None, CircuitOpenError("S1"), subprocess.TimeoutExpired("ssh", 10)]
+)
+async def test_verify_spare_keeps_machine_available_when_serial_unknown(manager, spare_pool, failure):
+    await manager.reload_machines()
+    machine = await manager.get_machine("S1")
+
+    async def unreadable(m):
+        if isinstance(failure, Exception):
+            raise failure
+        return failure
+
+    manager.connector.get_serial_via_ssh = unreadable
+
+    assert await manager._verify_spare(machine, auto_reset=True) is False
+    assert machine.status == MachineStatus.AVAILABLE
+    assert machine.last_verified_at is None
+    assert not manager.reboot_tracker.is_tracking("S1")
+
+
+@pytest.mark.asyncio
+async def test_reserve_prefers_verified_spares(manager, spare_pool):
+    await manager.reload_machines()
+    (await manager.get_machine("S2")).last_verified_at = datetime.now(timezone.utc)
+
+    assert (await manager.reserve_machine("cisco", "n9k", "9.3")).serial == "S2"
+
+
+@pytest.mark.asyncio
+async def test_status_transitions_are_reported_to_listeners(manager):
+    transitions = []
+    manager.add_transition_listener(transitions.append)
+
+    await manager.reserve_machine("cisco", "n9k", "9.3")
+    await manager.release_machine("S1")
+
+    assert [(t.from_status, t.to_status, t.cause) for t in transitions] == [
+        (MachineStatus.AVAILABLE, MachineStatus.UNAVAILABLE, "reserve"),
+        (MachineStatus.UNAVAILABLE, MachineStatus.REBOOTING, "release"),
+    ]
+    assert transitions[0].duration is None
+    assert transitions[1].duration >= 0
+
+
+@pytest.mark.asyncio
+async def test_unreachable_candidate_is_not_reported_as_reserved(manager):
+    transitions = []
+    manager.add_transition_listener(transitions.append)
+    manager.connector.is_reachable_map["10.0.0.1"] = False
+
+    assert await manager.reserve_machine("cisco", "n9k", "9.3") is None
+
+    assert [(t.from_status, t.to_status, t.cause) for t in transitions] == [
+        (MachineStatus.AVAILABLE, MachineStatus.UNREACHABLE, "reserve: ping failed"),
+    ]
+    assert (await manager.machine_summary()).by_status[MachineStatus.UNREACHABLE.value] == 1
+
+
+@pytest.mark.asyncio
+async def test_failing_listener_does_not_break_transitions(manager):
+    def boom(_transition):
+        raise RuntimeError("listener down")
+
+    manager.add_transition_listener(boom)
+    reserved = await manager.reserve_machine("cisco", "n9k", "9.3")
+    assert reserved.status == MachineStatus.UNAVAILABLE
+
+
+@pytest.mark.asyncio
+async def test_reserve_outcomes_are_reported_to_listeners(manager):
+    outcomes = []
+    manager.add_reserve_listener(lambda *args: outcomes.append(args))
+
+    await manager.reserve_machine("cisco", "n9k", "9.3")
+    await manager.reserve_machine("cisco", "n9k", "9.3")
+
+    assert outcomes == [("cisco", "n9k", "9.3", True), ("cisco", "n9k", "9.3", False)]
+
+
+@pytest.mark.asyncio
+async def test_refresh_machines_streams_results_and_skips_reserved(manager):
+    (await manager.get_machine("S1")).status = MachineStatus.UNREACHABLE
+    (await manager.get_machine("H1")).status = MachineStatus.UNAVAILABLE
+
+    results = {r.serial: r async for r in manager.refresh_machines(await manager.get_machines(), concurrency=1)}
+
+    assert results["S1"].status == MachineStatus.AVAILABLE
+    assert results["S1"].changed
+    assert results["H1"].skipped
+    assert (await manager.get_machine("H1")).status == MachineStatus.UNAVAILABLE
+
+
+@pytest.mark.asyncio
+async def test_refresh_if_unchanged_keeps_reservation_made_during_check(manager):
+    machine = await manager.get_machine("S1")
+    original = manager.connector.get_serial_via_ssh
+
+    async def reserved_meanwhile(m):
+        await manager.reserve_machine("cisco", "n9k", "9.3")
+        return await original(m)
+
+    manager.connector.get_serial_via_ssh = reserved_meanwhile
+
+    assert await manager.refresh_if_unchanged(machine) is False
+    assert machine.status == MachineStatus.UNAVAILABLE
+
+
+@pytest.fixture
+def version_pools(config_data):
+    config_data["cisco"]["n9k"]["9.3(13)"] = [
+        {"serial": "S2", "mgmt_ip": "10.0.1.2", "hostname": "leaf2"},
+        {"serial": "S3", "mgmt_ip": "10.0.1.3", "hostname": "spine3"},
+    ]
+    config_data["cisco"]["n9k"]["10.2(1)"] = [
+        {"serial": "S4", "mgmt_ip": "10.0.2.4", "hostname": "leaf4"},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_reserve_matching_prefers_pool_with_most_available(manager, version_pools):
+    await manager.reload_machines()
+    outcomes = []
+    manager.add_reserve_listener(lambda *args: outcomes.append(args))
+
+    reserved = await manager.reserve_matching(ReservationQuery(vendor="cisco", min_version="9.3.1"), owner="ci")
+
+    assert reserved.serial == "S2"
+    assert reserved.lease_owner == "ci"
+    assert outcomes == [("cisco", "n9k", "9.3(13)", True)]
+
+
+@pytest.mark.asyncio
+async def test_reserve_matching_applies_attribute_constraints(manager, version_pools):
+    await manager.reload_machines()
+
+    by_prefix = await manager.reserve_matching(ReservationQuery(model="n9*", hostname_prefix="spine"))
+    by_subnet = await manager.reserve_matching(ReservationQuery(subnet="10.0.2.0/24"))
+    by_range = await manager.reserve_matching(ReservationQuery(vendor="cisco", max_version="9.3"))
+
+    assert [by_prefix.serial, by_subnet.serial, by_range.serial] == ["S3", "S4", "S1"]
+
+
+@pytest.mark.asyncio
+async def test_reserve_matching_reports_failure_for_matched_pools(manager, version_pools):
+    await manager.reload_machines()
+    (await manager.get_machine("S4")).status = MachineStatus.UNREACHABLE
+    outcomes = []
+    manager.add_reserve_listener(lambda *args: outcomes.append(args))
+
+    reserved = await manager.reserve_matching(ReservationQuery(version="10.*"))
+
+    assert reserved is None
+    assert outcomes == [("cisco", "n9k", "10.2(1)", False)]
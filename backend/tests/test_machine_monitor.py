@@ -4,26 +4,46 @@ import pytest
 
 from app.models.machine import Machine, MachineStatus
 from app.services import machine_monitor
+from app.services.reboot_tracker import RebootTracker
 
 
 class FakeConnector:
-    def __init__(self, reachability):
+    def __init__(self, reachability, serials=None):
         self.reachability = reachability
+        self.serials = serials or {}
+
+        self.probed = []
 
     async def is_reachable(self, ip: str) -> bool:
+        self.probed.append(ip)
         return self.reachability.get(ip, False)
 
+    async def get_serial_via_ssh(self, machine):
+        return self.serials.get(machine.serial)
+
 
 class FakeManager:
-    def __init__(self, machines, reachability):
+    def __init__(self, machines, reachability, serials=None):
         self._machines = machines
-        self.connector = FakeConnector(reachability)
+        self.connector = FakeConnector(reachability, serials)
+        self.reboot_tracker = RebootTracker()
+        self.causes = {}
 
-    def get_machines(self, status=None):
+    async def get_machines(self, status=None):
         if status is None:
             return list(self._machines)
         return [machine for machine in self._machines if machine.status == status]
 
+    async def set_status(self, machine, status, cause=""):
+        machine.status = status
+        self.causes[machine.serial] = cause
+
+    async def compare_and_set(self, machine, expected, new, cause=""):
+        if machine.status != expected:
+            return False
+        await self.set_status(machine, new, cause)
+        return True
+
 
 @pytest.mark.asyncio
 async def test_monitor_machines_updates_statuses(monkeypatch):
@@ -103,7 +123,7 @@ async def test_monitor_machines_handles_exception(monkeypatch):
         def __init__(self):
             self.connector = FakeConnector({})
 
-        def get_machines(self, status=None):
+        async def get_machines(self, status=None):
             raise RuntimeError("boom")
 
     manager = ExplodingManager()
@@ -115,3 +135,136 @@ async def test_monitor_machines_handles_exception(monkeypatch):
 
     with pytest.raises(asyncio.CancelledError):
         await machine_monitor.monitor_machines(manager)
+
+
+@pytest.mark.asyncio
+async def test_monitor_does_not_overwrite_reservation_made_during_ping(monkeypatch):
+    machine = Machine(
+        vendor="cisco",
+        model="n9k",
+        version="1.0",
+        mgmt_ip="10.0.0.1",
+        serial="A1",
+        hostname="a1",
+        status=MachineStatus.AVAILABLE,
+    )
+    manager = FakeManager([machine], reachability={})
+
+    async def ping_while_reserved(ip):
+        # 其他 worker 在 ping 期間借出了這台機器
+        machine.status = MachineStatus.UNAVAILABLE
+        return False
+
+    manager.connector.is_reachable = ping_while_reserved
+
+    async def fake_sleep(interval):
+        raise asyncio.CancelledError
+
+    monkeypatch.setattr(machine_monitor.asyncio, "sleep", fake_sleep)
+
+    await machine_monitor.monitor_machines(manager)
+
+    assert machine.status == MachineStatus.UNAVAILABLE
+    assert "A1" not in manager.causes
+
+
+@pytest.mark.asyncio
+async def test_monitor_waits_for_ssh_after_reboot(monkeypatch):
+    ready = Machine(
+        vendor="cisco",
+        model="n9k",
+        version="1.0",
+        mgmt_ip="10.0.0.1",
+        serial="B1",
+        hostname="b1",
+        status=MachineStatus.UNREACHABLE,
+    )
+    booting = Machine(
+        vendor="cisco",
+        model="n9k",
+        version="1.0",
+        mgmt_ip="10.0.0.2",
+        serial="B2",
+        hostname="b2",
+        status=MachineStatus.UNREACHABLE,
+    )
+    manager = FakeManager(
+        [ready, booting],
+        reachability={"10.0.0.1": True, "10.0.0.2": True},
+        serials={"B1": "B1", "B2": None},
+    )
+    manager.reboot_tracker.start(ready, started_at=0)
+    manager.reboot_tracker.start(booting, started_at=0)
+
+    async def fake_sleep(interval):
+        raise asyncio.CancelledError
+
+    monkeypatch.setattr(machine_monitor.asyncio, "sleep", fake_sleep)
+
+    await machine_monitor.monitor_machines(manager)
+
+    assert ready.status == MachineStatus.AVAILABLE
+    assert booting.status == MachineStatus.UNREACHABLE
+    assert not manager.reboot_tracker.is_tracking("B1")
+    assert manager.reboot_tracker.is_tracking("B2")
+    assert manager.reboot_tracker.estimate("cisco", "n9k") is not None
+
+
+@pytest.mark.asyncio
+async def test_monitor_skips_probing_when_not_leader(monkeypatch):
+    machine = Machine(
+        vendor="cisco",
+        model="n9k",
+        version="1.0",
+        mgmt_ip="10.0.0.1",
+        serial="F1",
+        hostname="f1",
+        status=MachineStatus.UNREACHABLE,
+    )
+    manager = FakeManager([machine], reachability={"10.0.0.1": True})
+
+    class Follower:
+        is_leader = False
+
+    async def fake_sleep(interval):
+        raise asyncio.CancelledError
+
+    monkeypatch.setattr(machine_monitor.asyncio, "sleep", fake_sleep)
+
+    await machine_monitor.monitor_machines(manager, Follower())
+
+    assert machine.status == MachineStatus.UNREACHABLE
+
+
+@pytest.mark.asyncio
+async def test_monitor_marks_group_unreachable_when_gateway_down(monkeypatch):
+    def lab_machine(serial, ip, status):
+        return Machine(
+            vendor="cisco",
+            model="n9k",
+            version="1.0",
+            mgmt_ip=ip,
+            serial=serial,
+            hostname=serial.lower(),
+            default_gateway="10.1.0.1",
+            netmask="255.255.255.0",
+            status=status,
+        )
+
+    available = lab_machine("G1", "10.1.0.10", MachineStatus.AVAILABLE)
+    down = lab_machine("G2", "10.1.0.11", MachineStatus.UNREACHABLE)
+    rebooting = lab_machine("G3", "10.1.0.12", MachineStatus.REBOOTING)
+    manager = FakeManager([available, down, rebooting], reachability={})
+
+    async def fake_sleep(interval):
+        raise asyncio.CancelledError
+
+    monkeypatch.setattr(machine_monitor.asyncio, "sleep", fake_sleep)
+
+    await machine_monitor.monitor_machines(manager)
+
+    assert available.status == MachineStatus.UNREACHABLE
+    assert manager.causes["G1"] == "monitor: gateway 10.1.0.1 down"
+    assert rebooting.status == MachineStatus.REBOOTING
+    # gateway 一次加上一台代表機器，不逐台探測
+    assert len(manager.connector.probed) == 2
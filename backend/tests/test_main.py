@@ -3,6 +3,7 @@ import asyncio
 import pytest
 
 from app import main
+from app.services.state_store import LocalStateStore
 
 
 def test_require_env_raises_when_missing(monkeypatch):
@@ -17,12 +18,14 @@ def test_require_env_returns_value(monkeypatch):
 
 
 @pytest.mark.asyncio
-async def test_lifespan_runs_startup_and_shutdown(monkeypatch):
+async def test_lifespan_runs_startup_and_shutdown(monkeypatch, tmp_path):
     monkeypatch.setenv("API_BEARER_TOKEN", "token")
+    monkeypatch.setenv("CONFIG_DIR", str(tmp_path))
 
     class DummyManager:
         def __init__(self):
             self.initialize_called = False
+            self.state = LocalStateStore()
 
         async def initialize_status(self):
             self.initialize_called = True
@@ -33,13 +36,100 @@ async def test_lifespan_runs_startup_and_shutdown(monkeypatch):
     async def fake_get_manager():
         return manager
 
-    async def fake_monitor(_manager):
+    async def fake_monitor(_manager, _elector=None, _gateway_min_group=2):
         monitor_started.set()
         await asyncio.Event().wait()
 
+    async def fake_reaper(_manager, _elector=None):
+        await asyncio.Event().wait()
+
     monkeypatch.setattr(main, "get_machine_manager", fake_get_manager)
     monkeypatch.setattr(main, "monitor_machines", fake_monitor)
+    monkeypatch.setattr(main, "reap_expired_leases", fake_reaper)
+    monkeypatch.setattr(main, "maintain_hot_spares", fake_reaper)
 
     async with main.lifespan(main.app):
         await asyncio.wait_for(monitor_started.wait(), timeout=1)
         assert manager.initialize_called is True
+
+
+@pytest.mark.asyncio
+async def test_lifespan_skips_startup_sweep_when_not_leader(monkeypatch, tmp_path):
+    monkeypatch.setenv("API_BEARER_TOKEN", "token")
+    monkeypatch.setenv("CONFIG_DIR", str(tmp_path))
+
+    class FollowerStore(LocalStateStore):
+        def try_acquire_lease(self, name, owner, ttl):
+            return False
+
+    class DummyManager:
+        def __init__(self):
+            self.initialize_called = False
+            self.state = FollowerStore()
+
+        async def initialize_status(self):
+            self.initialize_called = True
+
+    manager = DummyManager()
+    captured = {}
+
+    async def fake_get_manager():
+        return manager
+
+    async def fake_monitor(_manager, elector=None, _gateway_min_group=2):
+        captured["elector"] = elector
+        await asyncio.Event().wait()
+
+    async def fake_reaper(_manager, _elector=None):
+        await asyncio.Event().wait()
+
+    monkeypatch.setattr(main, "get_machine_manager", fake_get_manager)
+    monkeypatch.setattr(main, "monitor_machines", fake_monitor)
+    monkeypatch.setattr(main, "reap_expired_leases", fake_reaper)
+    monkeypatch.setattr(main, "maintain_hot_spares", fake_reaper)
+
+    async with main.lifespan(main.app):
+        await asyncio.sleep(0)
+        assert manager.initialize_called is False
+        assert captured["elector"].is_leader is False
+
+
+@pytest.mark.asyncio
+async def test_lifespan_renews_leader_lease_during_startup_sweep(monkeypatch, tmp_path):
+    monkeypatch.setenv("API_BEARER_TOKEN", "token")
+    monkeypatch.setenv("CONFIG_DIR", str(tmp_path))
+
+    class CountingStore(LocalStateStore):
+        def __init__(self):
+            self.renewals = 0
+
+        def try_acquire_lease(self, name, owner, ttl):
+            self.renewals += 1
+            return True
+
+    class SlowSweepManager:
+        def __init__(self):
+            self.state = CountingStore()
+
+        async def initialize_status(self):
+            # 啟動檢查進行中，lease 也要持續續約
+            while self.state.renewals < 2:
+                await asyncio.sleep(0)
+
+    manager = SlowSweepManager()
+
+    async def fake_get_manager():
+        return manager
+
+    async def fake_task(_manager, _elector=None, _gateway_min_group=2):
+        await asyncio.Event().wait()
+
+    monkeypatch.setattr(main, "get_machine_manager", fake_get_manager)
+    monkeypatch.setattr(main, "monitor_machines", fake_task)
+    monkeypatch.setattr(main, "reap_expired_leases", fake_task)
+    monkeypatch.setattr(main, "maintain_hot_spares", fake_task)
+
+    lifespan = main.lifespan(main.app)
+    await asyncio.wait_for(lifespan.__aenter__(), timeout=1)
+    await lifespan.__aexit__(None, None, None)
+    assert manager.state.renewals >= 2
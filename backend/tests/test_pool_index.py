@@ -0,0 +1,58 @@
+import ipaddress
+
+import pytest
+
+from app.models.machine import Machine
+from app.models.reservation import ReservationQuery
+from app.services.pool_index import PoolIndex, version_key
+
+
+def make_machine(serial, version, hostname="leaf1", mgmt_ip="10.0.0.1", vendor="cisco", model="n9k"):
+    return Machine(
+        vendor=vendor,
+        model=model,
+        version=version,
+        mgmt_ip=mgmt_ip,
+        serial=serial,
+        hostname=hostname,
+    )
+
+
+def test_version_key_orders_numerically():
+    versions = ["10.2(1)", "9.3(13)", "9.3", "9.3(9)", "17.09.05e", "17.9.5"]
+    assert sorted(versions, key=version_key) == ["9.3", "9.3(9)", "9.3(13)", "10.2(1)", "17.9.5", "17.09.05e"]
+    assert version_key("17.09.05E") == version_key("17.9.5e")
+
+
+@pytest.fixture
+def index():
+    index = PoolIndex()
+    index.rebuild([
+        make_machine("S1", "9.3"),
+        make_machine("S2", "9.3(13)"),
+        make_machine("S3", "10.2(1)"),
+        make_machine("H1", "1.0", vendor="hp", model="5945"),
+    ])
+    return index
+
+
+def test_match_filters_pools_by_glob_and_version_range(index):
+    def pools(**kwargs):
+        return [key for key, _ in index.match(ReservationQuery(**kwargs))]
+
+    assert pools(vendor="cisco", version="9.3*") == [("cisco", "n9k", "9.3"), ("cisco", "n9k", "9.3(13)")]
+    assert pools(min_version="9.3.1", max_version="10.2(1)") == [
+        ("cisco", "n9k", "9.3(13)"),
+        ("cisco", "n9k", "10.2(1)"),
+    ]
+    assert pools(model="59*") == [("hp", "5945", "1.0")]
+    assert pools(vendor="juniper") == []
+
+
+def test_accepts_checks_hostname_prefix_and_subnet():
+    machine = make_machine("S1", "9.3", hostname="leaf1", mgmt_ip="10.0.4.7")
+    network = ipaddress.ip_network("10.0.4.0/24")
+
+    assert PoolIndex.accepts(machine, ReservationQuery(hostname_prefix="leaf", subnet="10.0.4.0/24"), network)
+    assert not PoolIndex.accepts(machine, ReservationQuery(hostname_prefix="spine"), None)
+    assert not PoolIndex.accepts(machine, ReservationQuery(), ipaddress.ip_network("10.0.5.0/24"))
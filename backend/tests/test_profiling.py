@@ -0,0 +1,60 @@
+import asyncio
+import logging
+import threading
+import time
+
+import pytest
+
+from app.core.profiling import LoopLagMonitor, sample_profile
+
+
+def block_the_loop(seconds):
+    time.sleep(seconds)
+
+
+@pytest.mark.asyncio
+async def test_monitor_dumps_stack_of_blocked_loop(caplog):
+    monitor = LoopLagMonitor(threshold=0.1, interval=0.02)
+    monitor.start()
+    await asyncio.sleep(0.05)
+
+    with caplog.at_level(logging.WARNING, logger="app.core.profiling"):
+        block_the_loop(0.4)
+        await asyncio.sleep(0.05)
+    await monitor.stop()
+
+    assert monitor.stalls == 1
+    assert monitor.max_lag >= 0.3
+    assert "block_the_loop" in caplog.text
+    assert not monitor.stats().running
+
+
+@pytest.mark.asyncio
+async def test_monitor_disabled_with_zero_threshold():
+    monitor = LoopLagMonitor(threshold=0)
+    monitor.start()
+    assert not monitor.running
+    await monitor.stop()
+
+
+def test_sample_profile_returns_collapsed_stacks():
+    stop = threading.Event()
+
+    def busy_worker():
+        while not stop.is_set():
+            sum(range(1000))
+
+    worker = threading.Thread(target=busy_worker, name="busy")
+    worker.start()
+    try:
+        collapsed = sample_profile(0.1, interval=0.005)
+    finally:
+        stop.set()
+        worker.join()
+
+    lines = collapsed.splitlines()
+    busy = [line for line in lines if line.startswith("busy;")]
+    assert busy
+    stack, count = busy[0].rsplit(" ", 1)
+    assert "busy_worker (test_profiling.py)" in stack
+    assert int(count) > 0
@@ -0,0 +1,78 @@
+from datetime import datetime, timezone
+
+from app.models.machine import Machine
+from app.services.reboot_tracker import RebootTracker
+
+
+def make_machine(serial="S1", model="n9k"):
+    return Machine(
+        vendor="cisco",
+        model=model,
+        version="1.0",
+        mgmt_ip="10.0.0.1",
+        serial=serial,
+        hostname="lab",
+    )
+
+
+def test_estimate_is_none_without_history():
+    tracker = RebootTracker()
+    machine = make_machine()
+
+    tracker.start(machine, started_at=100)
+
+    assert tracker.is_tracking("S1")
+    assert tracker.estimate("cisco", "n9k") is None
+    assert machine.expected_available_at is None
+
+
+def test_complete_records_duration_and_clears_eta():
+    tracker = RebootTracker()
+    machine = make_machine()
+    tracker.start(machine, started_at=100)
+
+    duration = tracker.complete(machine, finished_at=280)
+
+    assert duration == 180
+    assert not tracker.is_tracking("S1")
+    assert machine.expected_available_at is None
+    assert tracker.estimate("cisco", "n9k") == 180
+
+
+def test_start_sets_expected_available_at_from_median():
+    tracker = RebootTracker()
+    for i, duration in enumerate((100, 200, 600)):
+        machine = make_machine(serial=f"H{i}")
+        tracker.start(machine, started_at=0)
+        tracker.complete(machine, finished_at=duration)
+
+    machine = make_machine()
+    tracker.start(machine, started_at=1000)
+
+    assert machine.expected_available_at == datetime.fromtimestamp(1200, tz=timezone.utc)
+
+
+def test_history_is_kept_per_model_and_bounded():
+    tracker = RebootTracker(history_size=2)
+    for duration in (10, 20, 30):
+        machine = make_machine()
+        tracker.start(machine, started_at=0)
+        tracker.complete(machine, finished_at=duration)
+
+    assert tracker.estimate("cisco", "n9k") == 25
+    assert tracker.estimate("cisco", "c8k") is None
+
+
+def test_complete_without_start_returns_none():
+    tracker = RebootTracker()
+    assert tracker.complete(make_machine()) is None
+
+
+def test_complete_updates_per_machine_average():
+    tracker = RebootTracker()
+    machine = make_machine()
+    for duration in (100, 200):
+        tracker.start(machine, started_at=0)
+        tracker.complete(machine, finished_at=duration)
+
+    assert machine.avg_reboot_seconds == 100 + RebootTracker.SMOOTHING * 100
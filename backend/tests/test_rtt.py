@@ -0,0 +1,63 @@
+import pytest
+
+from app.services.rtt import RttEstimator
+
+
+def test_first_sample_sets_srtt_and_timeout():
+    estimator = RttEstimator(initial_timeout=1.0, min_timeout=0.2, max_timeout=3.0)
+
+    estimator.observe(0.3)
+
+    assert estimator.srtt == pytest.approx(0.3)
+    assert estimator.rttvar == pytest.approx(0.15)
+    assert estimator.timeout == pytest.approx(0.3 + 4 * 0.15)
+
+
+def test_timeout_is_clamped_and_backs_off_on_loss():
+    estimator = RttEstimator(initial_timeout=1.0, min_timeout=0.2, max_timeout=3.0)
+    for _ in range(20):
+        estimator.observe(0.001)
+    assert estimator.timeout == pytest.approx(0.2)
+
+    estimator.observe_loss()
+    assert estimator.timeout == pytest.approx(0.4)
+    for _ in range(5):
+        estimator.observe_loss()
+    assert estimator.timeout == pytest.approx(3.0)
+
+
+def test_losses_counted_over_window():
+    estimator = RttEstimator(loss_window=3)
+    estimator.observe_loss()
+    estimator.observe(0.01)
+    estimator.observe_loss()
+    assert estimator.losses == 2
+
+    for _ in range(3):
+        estimator.observe(0.01)
+    assert estimator.losses == 0
+
+
+def test_hedge_delay_tracks_rtt_and_never_exceeds_timeout():
+    estimator = RttEstimator(initial_timeout=1.0, min_timeout=0.2, max_timeout=3.0)
+    assert estimator.hedge_delay == pytest.approx(0.5)
+
+    for _ in range(20):
+        estimator.observe(0.3)
+    assert 0.3 <= estimator.hedge_delay <= estimator.timeout
+
+
+def test_reset_backoff_returns_to_rto_from_last_samples():
+    estimator = RttEstimator(initial_timeout=1.0, min_timeout=0.2, max_timeout=3.0)
+    for _ in range(3):
+        estimator.observe_loss()
+    assert estimator.timeout == pytest.approx(3.0)
+
+    estimator.reset_backoff()
+    assert estimator.timeout == pytest.approx(1.0)
+
+    for _ in range(20):
+        estimator.observe(0.001)
+    estimator.observe_loss()
+    estimator.reset_backoff()
+    assert estimator.timeout == pytest.approx(0.2)
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+from app.services.ssh_executor import PRIORITY_RESET, PRIORITY_VERIFY, SSHExecutor
+
+pytestmark = pytest.mark.asyncio
+
+
+async def session(label, order, gate=None):
+    if gate is not None:
+        await gate.wait()
+    order.append(label)
+    return label
+
+
+async def test_queued_calls_run_by_priority():
+    pool = SSHExecutor(max_workers=1)
+    order = []
+    gate = asyncio.Event()
+
+    first = asyncio.create_task(pool.run(session, "busy", order, gate))
+    await asyncio.sleep(0)
+    verify = asyncio.create_task(pool.run(session, "verify", order, priority=PRIORITY_VERIFY))
+    reset = asyncio.create_task(pool.run(session, "reset", order, priority=PRIORITY_RESET))
+    await asyncio.sleep(0.01)
+
+    stats = pool.stats()
+    assert stats.running == 1
+    assert stats.queued == 2
+
+    gate.set()
+    await asyncio.gather(first, verify, reset)
+
+    assert order == ["busy", "reset", "verify"]
+    stats = pool.stats()
+    assert stats.completed == 3
+    assert stats.queued == 0
+    assert stats.running == 0
+    assert stats.max_wait_ms > 0
+
+
+async def test_cancel_running_session_frees_slot():
+    pool = SSHExecutor(max_workers=1)
+    order = []
+
+    task = asyncio.create_task(pool.run(session, "stuck", order, asyncio.Event()))
+    await asyncio.sleep(0.01)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert pool.stats().cancelled == 1
+    assert pool.stats().running == 0
+    assert await pool.run(session, "next", order) == "next"
+
+
+async def test_cancelled_waiter_does_not_take_slot():
+    pool = SSHExecutor(max_workers=1)
+    order = []
+    gate = asyncio.Event()
+
+    first = asyncio.create_task(pool.run(session, "busy", order, gate))
+    await asyncio.sleep(0)
+    waiter = asyncio.create_task(pool.run(session, "never", order))
+    await asyncio.sleep(0.01)
+    waiter.cancel()
+    gate.set()
+    await first
+
+    assert await pool.run(session, "after", order) == "after"
+    assert order == ["busy", "after"]
+    assert pool.stats().running == 0
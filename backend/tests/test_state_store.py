@@ -0,0 +1,122 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from app.models.machine import Machine, MachineStatus
+from app.services.state_store import (
+    LocalStateStore,
+    SQLiteStateStore,
+    create_state_store,
+)
+
+
+def make_machine(serial="S1", status=MachineStatus.AVAILABLE):
+    return Machine(
+        vendor="cisco",
+        model="n9k",
+        version="1.0",
+        mgmt_ip="10.0.0.1",
+        serial=serial,
+        hostname="lab",
+        status=status,
+    )
+
+
+@pytest.mark.asyncio
+async def test_local_store_compare_and_set_uses_machine_status():
+    store = LocalStateStore()
+    machine = make_machine()
+
+    assert await store.compare_and_set(machine, MachineStatus.AVAILABLE, MachineStatus.UNAVAILABLE)
+    assert machine.status == MachineStatus.UNAVAILABLE
+    assert not await store.compare_and_set(
+        machine, MachineStatus.AVAILABLE, MachineStatus.UNAVAILABLE
+    )
+
+
+@pytest.mark.asyncio
+async def test_sqlite_store_shares_status_between_instances(tmp_path):
+    path = tmp_path / "state.db"
+    first, second = SQLiteStateStore(path), SQLiteStateStore(path)
+    a = {"S1": make_machine()}
+    b = {"S1": make_machine()}
+    first.attach(a)
+    second.attach(b)
+
+    a["S1"].expected_available_at = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    await first.set_status(a["S1"], MachineStatus.REBOOTING)
+    await second.refresh(b.values())
+
+    assert b["S1"].status == MachineStatus.REBOOTING
+    assert b["S1"].expected_available_at == a["S1"].expected_available_at
+
+
+@pytest.mark.asyncio
+async def test_sqlite_compare_and_set_allows_single_winner(tmp_path):
+    path = tmp_path / "state.db"
+    first, second = SQLiteStateStore(path), SQLiteStateStore(path)
+    a = {"S1": make_machine()}
+    b = {"S1": make_machine()}
+    first.attach(a)
+    second.attach(b)
+
+    assert await first.compare_and_set(a["S1"], MachineStatus.AVAILABLE, MachineStatus.UNAVAILABLE)
+    assert not await second.compare_and_set(
+        b["S1"], MachineStatus.AVAILABLE, MachineStatus.UNAVAILABLE
+    )
+    # 失敗時會同步成 store 中的最新狀態
+    assert b["S1"].status == MachineStatus.UNAVAILABLE
+
+
+@pytest.mark.asyncio
+async def test_sqlite_attach_keeps_existing_state_and_drops_removed(tmp_path):
+    path = tmp_path / "state.db"
+    store = SQLiteStateStore(path)
+    store.attach({"S1": make_machine("S1"), "S2": make_machine("S2")})
+    await store.set_status(make_machine("S1"), MachineStatus.UNAVAILABLE)
+
+    reloaded = {"S1": make_machine("S1"), "S3": make_machine("S3")}
+    SQLiteStateStore(path).attach(reloaded)
+
+    assert reloaded["S1"].status == MachineStatus.UNAVAILABLE
+    assert reloaded["S3"].status == MachineStatus.AVAILABLE
+    stale = make_machine("S2", status=MachineStatus.REBOOTING)
+    await store.refresh([stale])
+    assert stale.status == MachineStatus.REBOOTING
+
+
+def test_create_state_store_selects_backend(tmp_path):
+    class DummySettings:
+        STATE_BACKEND = "sqlite"
+        STATE_DB_PATH = tmp_path / "nested" / "state.db"
+
+    settings = DummySettings()
+    assert isinstance(create_state_store(settings), SQLiteStateStore)
+    assert settings.STATE_DB_PATH.exists()
+
+    settings.STATE_BACKEND = "memory"
+    assert isinstance(create_state_store(settings), LocalStateStore)
+
+    settings.STATE_BACKEND = "bogus"
+    with pytest.raises(ValueError):
+        create_state_store(settings)
+
+
+@pytest.mark.asyncio
+async def test_sqlite_refresh_rereads_only_after_other_writers(tmp_path):
+    path = tmp_path / "state.db"
+    first, second = SQLiteStateStore(path), SQLiteStateStore(path)
+    a = {"S1": make_machine()}
+    b = {"S1": make_machine()}
+    first.attach(a)
+    second.attach(b)
+
+    # 沒有其他連線寫入時不重新讀取 (本地的變更不會被覆蓋)
+    b["S1"].reservation_count = 7
+    await second.refresh(b.values())
+    assert b["S1"].reservation_count == 7
+
+    await first.set_status(a["S1"], MachineStatus.UNAVAILABLE)
+    await second.refresh(b.values())
+    assert b["S1"].status == MachineStatus.UNAVAILABLE
+    assert b["S1"].reservation_count == 0
@@ -0,0 +1,112 @@
+from datetime import datetime, timedelta, timezone
+
+from app.models.history import StatusTransition
+from app.models.machine import MachineStatus
+from app.services.status_journal import StatusJournal, _SegmentIndex
+
+BASE = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def make_transition(seconds, serial="S1", model="n9k", to_status=MachineStatus.UNAVAILABLE):
+    return StatusTransition(
+        timestamp=BASE + timedelta(seconds=seconds),
+        serial=serial,
+        vendor="cisco",
+        model=model,
+        version="9.3(13)",
+        from_status=MachineStatus.AVAILABLE,
+        to_status=to_status,
+        cause="reserve",
+        duration=1.5,
+    )
+
+
+def test_append_and_query_round_trip(tmp_path):
+    journal = StatusJournal(tmp_path)
+    journal.append(make_transition(10))
+
+    [result] = journal.query(BASE, BASE + timedelta(minutes=1))
+
+    assert result == make_transition(10)
+
+
+def test_query_filters_by_time_serial_and_pool(tmp_path):
+    journal = StatusJournal(tmp_path)
+    for i in range(200):
+        journal.append(make_transition(i, serial=f"S{i % 2}", model="n9k" if i % 4 < 2 else "c8k"))
+
+    window = journal.query(BASE + timedelta(seconds=100), BASE + timedelta(seconds=109))
+    assert [t.timestamp for t in window] == [BASE + timedelta(seconds=s) for s in range(100, 110)]
+
+    by_serial = journal.query(BASE, BASE + timedelta(seconds=9), serial="S1")
+    assert {t.serial for t in by_serial} == {"S1"}
+    assert len(by_serial) == 5
+
+    by_pool = journal.query(BASE, BASE + timedelta(seconds=9), pool=("cisco", "c8k", None))
+    assert {t.model for t in by_pool} == {"c8k"}
+
+    assert len(journal.query(BASE, BASE + timedelta(hours=1), limit=7)) == 7
+
+
+def test_segments_rotate_and_oldest_are_removed(tmp_path):
+    journal = StatusJournal(tmp_path, segment_bytes=400, max_segments=3)
+    for i in range(50):
+        journal.append(make_transition(i))
+    journal.flush()  # 等背景寫入與 segment 輪替完成
+
+    segments = sorted(tmp_path.glob("segment-*.jsonl"))
+    assert len(segments) <= 3
+    remaining = journal.query(BASE, BASE + timedelta(hours=1), limit=100)
+    assert remaining[-1].timestamp == BASE + timedelta(seconds=49)
+    assert remaining == sorted(remaining, key=lambda t: t.timestamp)
+
+
+def test_query_sees_records_from_other_writers(tmp_path):
+    writer = StatusJournal(tmp_path)
+    reader = StatusJournal(tmp_path)
+    writer._writer_id = "other"
+
+    writer.append(make_transition(1))
+    writer.flush()
+    assert len(reader.query(BASE, BASE + timedelta(minutes=1))) == 1
+
+    writer.append(make_transition(2))
+    writer.flush()
+    assert len(reader.query(BASE, BASE + timedelta(minutes=1))) == 2
+
+
+def test_segment_index_skips_partial_last_line(tmp_path):
+    path = tmp_path / "segment-1.jsonl"
+    path.write_bytes(b'{"t": 1}\n{"t": 2')
+    index = _SegmentIndex(path)
+
+    index.update()
+
+    assert index.count == 1
+    assert index.last_ts == 1
+
+
+def test_close_writes_queued_records(tmp_path):
+    journal = StatusJournal(tmp_path)
+    for i in range(5):
+        journal.append(make_transition(i))
+
+    journal.close()
+
+    lines = b"".join(p.read_bytes() for p in tmp_path.glob("segment-*.jsonl")).splitlines()
+    assert len(lines) == 5
+    assert journal._writer is None
+
+
+def test_query_swaps_in_new_index_without_mutating_old(tmp_path):
+    journal = StatusJournal(tmp_path)
+    journal.append(make_transition(1))
+    journal.query(BASE, BASE + timedelta(minutes=1))
+    [before] = journal._indexes.values()
+
+    journal.append(make_transition(2))
+    assert len(journal.query(BASE, BASE + timedelta(minutes=1))) == 2
+
+    [after] = journal._indexes.values()
+    assert after is not before
+    assert (before.count, after.count) == (1, 2)
@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+from fastapi import APIRouter, FastAPI
+from httpx import ASGITransport, AsyncClient
+
+from app.core.timing import TimedRoute, TimingMiddleware, TimingRecorder, timed
+
+
+def test_timed_is_noop_outside_request():
+    with timed("lock"):
+        pass
+
+
+def test_recorder_keeps_only_slow_requests_in_ring_buffer():
+    recorder = TimingRecorder(slow_threshold=0.5, slow_buffer=2)
+    for i, duration in enumerate((0.1, 0.6, 0.7, 0.8)):
+        recorder.record("POST", "/reserve/{vendor}", f"/reserve/{i}", 200, duration, {"lock": 0.05})
+
+    assert [r.path for r in recorder.slow_requests] == ["/reserve/2", "/reserve/3"]
+    assert recorder.slow_requests[0].phases_ms == {"lock": 50.0}
+
+    [latency] = recorder.route_latencies()
+    assert latency.count == 4
+    assert latency.max_ms == 800.0
+    assert latency.p95_ms == 800.0
+
+
+def test_configure_resizes_ring_buffer():
+    recorder = TimingRecorder(slow_threshold=0, slow_buffer=3)
+    for i in range(3):
+        recorder.record("GET", "/machines", "/machines", 200, 0.1, {})
+
+    recorder.configure(slow_threshold=0.2, slow_buffer=1)
+
+    assert len(recorder.slow_requests) == 1
+    assert recorder.slow_threshold == 0.2
+
+
+@pytest.mark.asyncio
+async def test_middleware_reports_phases_in_server_timing_header():
+    recorder = TimingRecorder(slow_threshold=0)
+    router = APIRouter(route_class=TimedRoute)
+
+    @router.get("/items/{item_id}")
+    async def get_item(item_id: str):
+        async def probe():
+            with timed("probe"):
+                await asyncio.sleep(0.01)
+
+        # 在子 task 中計時也會計入同一個 request
+        await asyncio.create_task(probe())
+        return {"id": item_id}
+
+    app = FastAPI()
+    app.include_router(router)
+    app.add_middleware(TimingMiddleware, recorder=recorder)
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        response = await client.get("/items/a")
+        await client.get("/missing")
+
+    assert response.json() == {"id": "a"}
+    header = response.headers["server-timing"]
+    assert header.startswith("probe;dur=")
+    assert "serialize;dur=" in header and "total;dur=" in header
+
+    [slow, unmatched] = recorder.slow_requests
+    assert slow.route == "/items/{item_id}"
+    assert slow.phases_ms["probe"] >= 10
+    assert unmatched.route == "<unmatched>"
+    assert unmatched.status_code == 404
@@ -0,0 +1,70 @@
+import pytest
+
+from app.models.machine import Machine, MachineStatus
+from app.services.topology import GatewayProber, group_key
+
+
+class FakeConnector:
+    def __init__(self, reachability):
+        self.reachability = reachability
+        self.probed = []
+
+    async def is_reachable(self, ip):
+        self.probed.append(ip)
+        return self.reachability.get(ip, False)
+
+
+def make_machine(serial, ip, gateway="10.1.0.1", netmask="255.255.255.0"):
+    return Machine(
+        vendor="cisco",
+        model="n9k",
+        version="9.3",
+        mgmt_ip=ip,
+        serial=serial,
+        hostname=serial.lower(),
+        default_gateway=gateway,
+        netmask=netmask,
+        status=MachineStatus.AVAILABLE,
+    )
+
+
+def test_group_key_uses_gateway_and_subnet():
+    assert group_key(make_machine("S1", "10.1.0.10")) == ("10.1.0.1", "10.1.0.0/24")
+    assert group_key(make_machine("S2", "10.1.0.11", netmask=None)) == ("10.1.0.1", "")
+    assert group_key(make_machine("S3", "10.1.0.12", gateway=None)) is None
+
+
+@pytest.mark.asyncio
+async def test_down_groups_probes_gateway_then_one_representative():
+    lab = [make_machine(f"S{i}", f"10.1.0.{10 + i}") for i in range(3)]
+    other = [make_machine(f"T{i}", f"10.2.0.{10 + i}", gateway="10.2.0.1") for i in range(2)]
+    connector = FakeConnector({"10.2.0.1": True})
+    prober = GatewayProber(connector)
+
+    down = await prober.down_groups(lab + other)
+
+    assert list(down) == [("10.1.0.1", "10.1.0.0/24")]
+    assert down[("10.1.0.1", "10.1.0.0/24")] == lab
+    assert sorted(connector.probed) == ["10.1.0.1", "10.1.0.10", "10.2.0.1"]
+
+    connector.probed.clear()
+    await prober.down_groups(lab + other)
+    assert "10.1.0.11" in connector.probed  # 代表機器輪流
+
+
+@pytest.mark.asyncio
+async def test_gateway_that_drops_icmp_is_not_treated_as_down():
+    lab = [make_machine(f"S{i}", f"10.1.0.{10 + i}") for i in range(2)]
+    prober = GatewayProber(FakeConnector({"10.1.0.10": True}))
+
+    assert await prober.down_groups(lab) == {}
+
+
+@pytest.mark.asyncio
+async def test_small_groups_and_disabled_prober_skip_gateway_probe():
+    connector = FakeConnector({})
+    single = [make_machine("S1", "10.1.0.10")]
+
+    assert await GatewayProber(connector).down_groups(single) == {}
+    assert await GatewayProber(connector, min_group_size=0).down_groups(single * 2) == {}
+    assert connector.probed == []
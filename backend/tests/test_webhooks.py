@@ -0,0 +1,170 @@
+import asyncio
+import json
+from datetime import datetime, timezone
+
+import httpx
+import pytest
+
+from app.models.history import StatusTransition
+from app.models.machine import MachineStatus
+from app.services.webhooks import WebhookDispatcher, parse_subscriptions
+
+
+class StandIn:
+    """本地的 webhook 接收端：記錄收到的批次，可指定先回應幾個錯誤"""
+
+    def __init__(self, failures=0, status_code=503):
+        self.failures = failures
+        self.status_code = status_code
+        self.batches = []
+        self.received = asyncio.Event()
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        if self.failures > 0:
+            self.failures -= 1
+            return httpx.Response(self.status_code)
+        self.batches.append(json.loads(request.content))
+        self.received.set()
+        return httpx.Response(204)
+
+    @property
+    def transport(self):
+        return httpx.MockTransport(self.handler)
+
+
+def transition(serial="S1", to_status=MachineStatus.AVAILABLE, vendor="cisco", model="n9k"):
+    return StatusTransition(
+        timestamp=datetime.now(timezone.utc),
+        serial=serial,
+        vendor=vendor,
+        model=model,
+        version="9.3",
+        from_status=MachineStatus.REBOOTING,
+        to_status=to_status,
+        cause="test",
+    )
+
+
+def make_dispatcher(tmp_path, stand_in, subscriptions=None, **kwargs):
+    subscriptions = subscriptions or [{"name": "bot", "url": "http://bot.test/hook"}]
+    options = dict(batch_window=0.05, retry_base=0.001, retry_max=0.05, max_retries=2)
+    options.update(kwargs)
+    return WebhookDispatcher(
+        parse_subscriptions({"subscriptions": subscriptions}),
+        queue_dir=tmp_path,
+        transport=stand_in.transport,
+        **options,
+    )
+
+
+async def wait_for(predicate, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_batches_matching_transitions_per_subscriber(tmp_path):
+    stand_in = StandIn()
+    dispatcher = make_dispatcher(tmp_path, stand_in, subscriptions=[
+        {"name": "n9k-free", "url": "http://bot.test/n9k", "pools": ["cisco/n9k/*"], "statuses": ["available"]},
+    ])
+    await dispatcher.start()
+    try:
+        dispatcher.on_transition(transition("S1"))
+        dispatcher.on_transition(transition("S2"))
+        dispatcher.on_transition(transition("S3", to_status=MachineStatus.UNREACHABLE))
+        dispatcher.on_transition(transition("H1", vendor="hp", model="5945"))
+        await asyncio.wait_for(stand_in.received.wait(), 2)
+    finally:
+        await dispatcher.stop()
+
+    assert len(stand_in.batches) == 1
+    assert stand_in.batches[0]["subscription"] == "n9k-free"
+    assert [e["serial"] for e in stand_in.batches[0]["events"]] == ["S1", "S2"]
+
+
+@pytest.mark.asyncio
+async def test_retries_with_backoff_before_succeeding(tmp_path):
+    stand_in = StandIn(failures=2)
+    dispatcher = make_dispatcher(tmp_path, stand_in)
+    await dispatcher.start()
+    try:
+        dispatcher.on_transition(transition())
+        await asyncio.wait_for(stand_in.received.wait(), 2)
+    finally:
+        await dispatcher.stop()
+
+    [stats] = dispatcher.stats()
+    assert stats.delivered_events == 1
+    assert stats.failed_attempts == 2
+    assert stats.spooled == 0
+
+
+@pytest.mark.asyncio
+async def test_spools_to_disk_and_redelivers_in_order(tmp_path):
+    stand_in = StandIn(failures=3)
+    dispatcher = make_dispatcher(tmp_path, stand_in)
+    await dispatcher.start()
+    try:
+        dispatcher.on_transition(transition("S1"))
+        await wait_for(lambda: dispatcher.stats()[0].spooled == 1)
+        assert list((tmp_path / "bot").glob("*.json"))
+
+        dispatcher.on_transition(transition("S2"))
+        await wait_for(lambda: len(stand_in.batches) == 2)
+    finally:
+        await dispatcher.stop()
+
+    assert [b["events"][0]["serial"] for b in stand_in.batches] == ["S1", "S2"]
+    assert not list((tmp_path / "bot").glob("*.json"))
+
+
+@pytest.mark.asyncio
+async def test_client_errors_are_dropped_not_retried(tmp_path):
+    stand_in = StandIn(failures=1, status_code=400)
+    dispatcher = make_dispatcher(tmp_path, stand_in)
+    await dispatcher.start()
+    try:
+        dispatcher.on_transition(transition())
+        await wait_for(lambda: dispatcher.stats()[0].dropped_events == 1)
+    finally:
+        await dispatcher.stop()
+
+    assert dispatcher.stats()[0].failed_attempts == 0
+    assert stand_in.batches == []
+
+
+@pytest.mark.asyncio
+async def test_stop_persists_buffered_events_and_disk_queue_is_bounded(tmp_path):
+    stand_in = StandIn()
+    dispatcher = make_dispatcher(tmp_path, stand_in, batch_window=60, queue_max=1)
+    await dispatcher.start()
+    dispatcher.on_transition(transition("S1"))
+    await asyncio.sleep(0.01)
+    await dispatcher.stop()
+
+    [saved] = list((tmp_path / "bot").glob("*.json"))
+    assert [e["serial"] for e in json.loads(saved.read_text())] == ["S1"]
+
+    # 下次啟動時先送出磁碟上的批次
+    restarted = make_dispatcher(tmp_path, stand_in)
+    await restarted.start()
+    try:
+        restarted.on_transition(transition("S2"))
+        await wait_for(lambda: len(stand_in.batches) == 2)
+    finally:
+        await restarted.stop()
+    assert [b["events"][0]["serial"] for b in stand_in.batches] == ["S1", "S2"]
+
+
+def test_parse_subscriptions_rejects_duplicates_and_unknown_fields():
+    with pytest.raises(ValueError):
+        parse_subscriptions({"subscriptions": [
+            {"name": "a", "url": "http://a"},
+            {"name": "a", "url": "http://b"},
+        ]})
+    with pytest.raises(ValueError):
+        parse_subscriptions({"subscriptions": [{"name": "a", "url": "http://a", "pool": "x"}]})
+    assert parse_subscriptions({}) == []
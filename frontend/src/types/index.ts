@@ -11,6 +11,16 @@ export interface Machine {
   hostname: string;
   default_gateway?: string;
   netmask?: string;
+  expected_available_at?: string | null;
+  lease_owner?: string | null;
+  lease_expires_at?: string | null;
+  lease_ttl?: number | null;
+  last_reserved_at?: string | null;
+  reservation_count?: number;
+  avg_reboot_seconds?: number | null;
+  last_verified_at?: string | null;
+  circuit_state?: "closed" | "open" | "half_open";
+  circuit_retry_at?: string | null;
 }
 
 export interface MachineListResponse {